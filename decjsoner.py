@@ -1,29 +1,12 @@
-import psycopg2
 import json
-from decouple import config
-
-
-def connect_db():
-    try:
-        conn = psycopg2.connect(
-            database=config("DB_NAME"),
-            user=config("DB_USER"),
-            password=config("DB_PASS"),
-            host=config("DB_SERVICE"),
-            port=config("DB_PORT"),
-        )
-    except Exception as e:
-        print(f"Error connecting to the database: {str(e)}")
-    finally:
-        return conn
+from dukegeometry import hull_json
+from dukejsoner import duration_text, outage_columns, tracker_columns
+from dukestorage import get_storage
 
 
 def fetch_outage_tracker():
-    conn = connect_db()
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM outage_tracker")
-        rows = cur.fetchall()
+        rows = get_storage().stream_rows("outage_tracker", tracker_columns)
 
         # Convert query to objects of key-value pairs
         objects_list = []
@@ -32,8 +15,8 @@ def fetch_outage_tracker():
             d["outage_identifer"] = str(row[0])
             d["device_lat"] = float(row[1])
             d["device_lon"] = float(row[2])
-            d["block_fips"] = float(row[3]) if row[3] is not None else None
-            d["convex_hull"] = str(row[4])
+            d["block_fips"] = row[3]
+            d["convex_hull"] = hull_json(row[4])
             d["jurisdiction"] = str(row[5])
             d["origin"] = str(row[6])
             d["state"] = str(row[7])
@@ -42,26 +25,19 @@ def fetch_outage_tracker():
             d["cause"] = str(row[10])
             d["start_estimate"] = str(row[11])
             d["ended_estimate"] = str(row[12])
-            d["fix_duration_estimate"] = str(row[13])
+            d["fix_duration_estimate"] = str(duration_text(row[13]))
             d["outage_restored"] = str(row[14])
             objects_list.append(d)
 
-        cur.close()
-
         return json.dumps(objects_list, indent=4)
 
     except Exception as e:
         print(f"Error fetching data: {str(e)}")
-    finally:
-        conn.close()
 
 
 def fetch_duke_outages():
     try:
-        conn = connect_db()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM duke_outages")
-        rows = cur.fetchall()
+        rows = get_storage().stream_rows("duke_outages", outage_columns)
 
         # Convert query to objects of key-value pairs
         objects_list = []
@@ -70,20 +46,16 @@ def fetch_duke_outages():
             d["outage_identifer"] = str(row[0])
             d["device_lat"] = float(row[1])
             d["device_lon"] = float(row[2])
-            d["convex_hull"] = str(row[3])
+            d["convex_hull"] = hull_json(row[3])
             d["jurisdiction"] = str(row[4])
             d["affected"] = int(row[5])
             d["cause"] = str(row[6])
             objects_list.append(d)
 
-        cur.close()
-
         return json.dumps(objects_list, indent=4)
 
     except Exception as e:
         print(f"Error fetching data: {str(e)}")
-    finally:
-        conn.close()
 
 
 def main():
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import gzip
+import hashlib
+import json
+import threading
+from datetime import timedelta, timezone
+from decouple import config
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from dukegeometry import decode_hull
+from dukesnapshots import SnapshotFollower
+from dukestorage import get_storage
+
+"""
+Read service for the live outage snapshot. The scheduler keeps the active
+outages, and those restored in the last READ_API_RESTORED_HOURS, in memory
+and serves them over HTTP as JSON or NDJSON, filtered by jurisdiction,
+state, county and restored status. Each ingestion cycle stages the outages
+whose live fields changed, and once its transaction commits reads only the
+outage_tracker rows updated since the last cycle, so read traffic never
+reaches the database. Every cycle publishes an immutable snapshot with each
+outage pre-serialized; a view is rendered and gzipped once per snapshot and
+answered with 304 when the client's ETag still matches.
+"""
+
+# Local port of the read API, 0 disables it
+read_api_port = config("READ_API_PORT", default=8100, cast=int)
+read_api_host = config("READ_API_HOST", default="127.0.0.1")
+
+# How long restored outages stay in the snapshot
+restored_hours = config("READ_API_RESTORED_HOURS", default=24, cast=float)
+
+# How far back each refresh re-reads outage_tracker, so rows committed late
+# by other writers are not missed
+refresh_overlap = config("READ_API_REFRESH_OVERLAP", default=900, cast=int)
+
+# Filtered views kept rendered per snapshot
+cached_views = config("READ_API_CACHED_VIEWS", default=64, cast=int)
+
+snapshot_columns = [
+    "outage_identifer",
+    "jurisdiction",
+    "state",
+    "county",
+    "block_fips",
+    "device_lat",
+    "device_lon",
+    "affected",
+    "cause",
+    "hull_geometry",
+    "outage_start_estimate",
+    "outage_end_estimate",
+    "outage_restored",
+    "fix_duration_seconds",
+    "updated_at",
+]
+
+# Fields that come from the Duke payload and change while an outage is active
+live_fields = ["jurisdiction", "device_lat", "device_lon", "affected", "cause", "convex_hull"]
+
+formats = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+
+"""
+Method for turning an outage_tracker row into a snapshot record
+"""
+
+
+def tracker_record(row):
+    row = dict(zip(snapshot_columns, row))
+    restored = bool(row["outage_restored"])
+
+    return {
+        "outage_identifer": str(row["outage_identifer"]),
+        "jurisdiction": row["jurisdiction"],
+        "state": row["state"],
+        "county": row["county"],
+        "block_fips": row["block_fips"],
+        "device_lat": float(row["device_lat"]),
+        "device_lon": float(row["device_lon"]),
+        "affected": row["affected"],
+        "cause": row["cause"],
+        "convex_hull": decode_hull(row["hull_geometry"]),
+        "outage_start_estimate": row["outage_start_estimate"].isoformat() if row["outage_start_estimate"] else None,
+        "outage_end_estimate": row["outage_end_estimate"].isoformat() if restored and row["outage_end_estimate"] else None,
+        "outage_restored": restored,
+        "fix_duration_seconds": row["fix_duration_seconds"],
+    }
+
+
+"""
+Method for reading the live fields of a reported outage entry
+"""
+
+
+def entry_fields(entry):
+    return {
+        "jurisdiction": entry["jurisdiction"],
+        "device_lat": float(entry["device_lat"]),
+        "device_lon": float(entry["device_lon"]),
+        "affected": int(entry["affected"]) if entry["affected"] is not None else None,
+        "cause": entry["cause"],
+        "convex_hull": entry["convex_hull"],
+    }
+
+
+"""
+Method for reading the live fields of an outage's latest snapshot
+"""
+
+
+def snapshot_fields(snapshot):
+    return entry_fields({
+        "jurisdiction": snapshot["jurisdiction"],
+        "device_lat": snapshot["device_lat"],
+        "device_lon": snapshot["device_lon"],
+        "affected": snapshot["affected"],
+        "cause": snapshot["cause"],
+        "convex_hull": decode_hull(snapshot["hull_geometry"]),
+    })
+
+
+"""
+One published generation of the snapshot
+Note: Never modified once published, so request threads read it without
+locking; only its cache of rendered views is guarded
+"""
+
+
+class Snapshot:
+    def __init__(self, records, fragments, updated_at):
+        self.records = records
+        self.fragments = fragments
+        self.updated_at = updated_at
+        self.last_modified = format_datetime(updated_at.astimezone(timezone.utc), usegmt=True)
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def select(self, jurisdictions, states, counties, restored):
+        for record, fragment in zip(self.records, self.fragments):
+            if jurisdictions and record["jurisdiction"] not in jurisdictions:
+                continue
+            if states and record["state"] not in states:
+                continue
+            if counties and record["county"] not in counties:
+                continue
+            if restored is not None and record["outage_restored"] != restored:
+                continue
+            yield fragment
+
+    def render(self, fmt, fragments):
+        fragments = list(fragments)
+        if fmt == "ndjson":
+            return "".join(f"{fragment}\n" for fragment in fragments).encode("utf-8")
+
+        header = json.dumps({"updated_at": self.updated_at.isoformat(), "count": len(fragments)})
+        return f'{header[:-1]}, "outages": [{",".join(fragments)}]}}'.encode("utf-8")
+
+    """
+    Method for getting the digest, body and gzipped body of a view, rendering it once
+    Note: The digest is that of the identity body; the gzipped body's ETag is derived from it
+    """
+
+    def view(self, fmt, jurisdictions=(), states=(), counties=(), restored=None):
+        key = (fmt, tuple(sorted(jurisdictions)), tuple(sorted(states)), tuple(sorted(counties)), restored)
+        with self.lock:
+            cached = self.views.get(key)
+        if cached is not None:
+            return cached
+
+        body = self.render(fmt, self.select(set(jurisdictions), set(states), set(counties), restored))
+        cached = (hashlib.sha1(body).hexdigest()[:20], body, gzip.compress(body, compresslevel=6))
+
+        with self.lock:
+            if len(self.views) >= cached_views:
+                self.views.pop(next(iter(self.views)))
+            self.views[key] = cached
+        return cached
+
+
+"""
+The snapshot kept current by the ingestion cycles
+Note: Like PollState, what a cycle stages is only applied after its
+transaction has committed, and a failed refresh falls back to a full reload
+on the next cycle
+"""
+
+
+class LiveSnapshot:
+    def __init__(self):
+        self.enabled = False
+        self.records = {}
+        self.fragments = {}
+        self.versions = {}
+        self.live = {}
+        self.pending = {}
+        self.current = None
+        self.jurisdictions = None
+        self.watermark = None
+        self.stale = True
+        self.published = None
+        self.follower = SnapshotFollower()
+
+    def begin(self):
+        self.pending = {}
+        self.current = None
+        self.jurisdictions = None
+
+    """
+    Method for staging the reported outages whose live fields differ from the snapshot
+    """
+
+    def stage(self, entries):
+        if not self.enabled:
+            return
+
+        for entry in entries:
+            try:
+                identifer = str(entry["source_event_number"])
+                fields = entry_fields(entry)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if self.live.get(identifer) != fields:
+                self.pending[identifer] = fields
+
+    """
+    Method for staging the identifiers of every outage still reported in this cycle
+    Note: With jurisdictions, only the live fields of those jurisdictions can be dropped
+    """
+
+    def stage_current(self, current_identifers, jurisdictions=None):
+        if self.enabled:
+            self.current = {str(identifer) for identifer in current_identifers}
+            self.jurisdictions = None if jurisdictions is None else set(jurisdictions)
+
+    def rollback(self):
+        self.pending = {}
+        self.current = None
+        self.jurisdictions = None
+
+    """
+    Method for reading outage_tracker rows: all active and recently restored
+    ones on a full load, otherwise those updated since the last refresh
+    Note: Loads stay full until a row has set the watermark, as on an empty tracker
+    """
+
+    def read_tracker(self, now):
+        storage = get_storage()
+        if self.stale or self.watermark is None:
+            since = now - timedelta(hours=restored_hours)
+            where = f"WHERE outage_restored = false OR updated_at >= {storage.param('since')}"
+        else:
+            since = self.watermark - timedelta(seconds=refresh_overlap)
+            where = f"WHERE updated_at >= {storage.param('since')}"
+
+        return storage.stream_rows("outage_tracker", snapshot_columns, where=where, params={"since": since})
+
+    """
+    Method for applying the staged cycle and publishing a new snapshot
+    """
+
+    def commit(self):
+        if not self.enabled:
+            return
+
+        try:
+            now = get_storage().capture_time()
+            if self.stale:
+                self.records = {}
+                self.fragments = {}
+                self.versions = {}
+                self.follower = SnapshotFollower()
+
+            changed = set(self.pending)
+            watermark = self.watermark
+            for row in self.read_tracker(now):
+                identifer = str(row[0])
+                updated_at = row[snapshot_columns.index("updated_at")]
+                if updated_at is not None and (watermark is None or updated_at > watermark):
+                    watermark = updated_at
+
+                # Rows re-read by the overlap that did not change since are skipped
+                if identifer in self.records and self.versions.get(identifer) == updated_at:
+                    continue
+
+                record = tracker_record(row)
+                previous = self.records.get(identifer)
+                if previous is not None:
+                    # Live fields come from the Duke payload, the tracker keeps the first ones seen
+                    record.update({field: previous[field] for field in live_fields})
+                self.records[identifer] = record
+                self.versions[identifer] = updated_at
+                changed.add(identifer)
+
+            # The live fields of other workers' outages come from their snapshots
+            followed = self.follower.read() if self.jurisdictions is not None else {}
+        except Exception as e:
+            print(f"Error refreshing the read API snapshot: {str(e)}")
+            self.stale = True
+            self.rollback()
+            return
+
+        self.live.update(self.pending)
+        if self.current is not None:
+            self.live = {
+                identifer: fields for identifer, fields in self.live.items()
+                if identifer in self.current
+                or (self.jurisdictions is not None and fields["jurisdiction"] not in self.jurisdictions)
+            }
+
+        for identifer, snapshot in followed.items():
+            if identifer in self.current or identifer in self.pending:
+                continue
+            if snapshot["restored"]:
+                self.live.pop(identifer, None)
+                continue
+            if snapshot["jurisdiction"] in self.jurisdictions:
+                continue
+            try:
+                fields = snapshot_fields(snapshot)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if self.live.get(identifer) != fields:
+                self.live[identifer] = fields
+                changed.add(identifer)
+
+        for identifer in changed:
+            if identifer in self.records:
+                if identifer in self.live:
+                    self.records[identifer].update(self.live[identifer])
+                self.fragments[identifer] = json.dumps(self.records[identifer], separators=(",", ":"))
+
+        # Restored outages leave the snapshot once they are older than the window
+        cutoff = (now - timedelta(hours=restored_hours)).isoformat()
+        for identifer in [
+            identifer for identifer, record in self.records.items()
+            if record["outage_restored"] and (record["outage_end_estimate"] or "") < cutoff
+        ]:
+            del self.records[identifer]
+            del self.fragments[identifer]
+            self.versions.pop(identifer, None)
+
+        self.watermark = watermark
+        self.stale = False
+        self.rollback()
+        self.publish(now)
+
+    def publish(self, now):
+        order = sorted(self.records)
+        snapshot = Snapshot(
+            [self.records[identifer] for identifer in order],
+            [self.fragments[identifer] for identifer in order],
+            now,
+        )
+
+        # The unfiltered views are rendered up front, off the request path
+        for fmt in formats:
+            snapshot.view(fmt)
+        self.published = snapshot
+
+
+live_snapshot = LiveSnapshot()
+
+
+"""
+Method for loading the snapshot once the tables exist
+Note: Run once per process; afterwards every cycle keeps it current
+"""
+
+
+def load_snapshot():
+    if live_snapshot.enabled:
+        live_snapshot.begin()
+        live_snapshot.commit()
+
+
+def split_values(query, name):
+    values = []
+    for value in query.get(name, []):
+        values.extend(part.strip() for part in value.split(",") if part.strip())
+    return values
+
+
+class ReadApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def respond(self, head):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+
+        if url.path in ("/outages", "/outages.json"):
+            fmt = query.get("format", ["json"])[0]
+        elif url.path == "/outages.ndjson":
+            fmt = "ndjson"
+        else:
+            self.send_error(404)
+            return
+
+        restored = query.get("restored", ["any"])[0].lower()
+        if fmt not in formats or restored not in ("true", "false", "any"):
+            self.send_error(400)
+            return
+
+        snapshot = live_snapshot.published
+        if snapshot is None:
+            self.send_error(503, "Snapshot not loaded yet")
+            return
+
+        digest, body, compressed = snapshot.view(
+            fmt,
+            split_values(query, "jurisdiction"),
+            split_values(query, "state"),
+            split_values(query, "county"),
+            None if restored == "any" else restored == "true",
+        )
+
+        # Each encoding is a different representation, so each gets its own strong ETag
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = compressed
+            encoding = "gzip"
+            etag = f'"{digest}-gz"'
+        else:
+            encoding = None
+            etag = f'"{digest}"'
+
+        if etag in [tag.strip().removeprefix("W/") for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", f"{formats[fmt]}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        if snapshot.last_modified:
+            self.send_header("Last-Modified", snapshot.last_modified)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+"""
+Method for serving the read API from a background thread
+"""
+
+
+def start_server(port, host="127.0.0.1"):
+    live_snapshot.enabled = True
+    server = ThreadingHTTPServer((host, port), ReadApiHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -1,6 +1,12 @@
 import requests
 import json
 import base64
+import threading
+import time
+from decouple import config
+
+# Seconds the Authorization header and cookies are reused before being rebuilt
+credential_ttl = config("CREDENTIAL_TTL", default=3600, cast=float)
 
 """
 Method for getting the auth string needed to access the Duke Power API
@@ -10,31 +16,76 @@ Method for getting the auth string needed to access the Duke Power API
 def get_auth():
     # For config data and auth key & secret
     config_url = "https://outagemap.duke-energy.com/config/config.prod.json"
-    random_url = "https://outagemap.duke-energy.com/"
-
-    r = requests.get(config_url)
-    # configjson = json.loads(r.content)
-    # # So the auth string we need for the countyurl is a base64 concatentation of two JSON values separated by a colon,
-    # # prefixed by "Basic "
-    # # For this, Thomas Wilburn is owed many frosty beverages
-
-    # authstring = bytes("Basic ", "utf-8") + base64.b64encode(
-    #     bytes(
-    #         f"{configjson['consumer_key_emp']}:{configjson['consumer_secret_emp']}",
-    #         "utf-8",
-    #     )
-    # )
-
-    # cookies = r.cookies
-
-    # headers = {
-    #     "Accept": "application/json, text/plain, */*",
-    #     "Origin": "https://outagemap.duke-energy.com",
-    #     "Referer": "https://outagemap.duke-energy.com/",
-    #     "Sec-Fetch-Mode": "cors",
-    #     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/76.0.3809.132 Safari/537.36",
-    # }
-
-    # headers["Authorization"] = authstring
-
-    return "returned:", r.status_code
+
+    r = requests.get(config_url, timeout=30)
+    r.raise_for_status()
+    configjson = json.loads(r.content)
+    # So the auth string we need for the countyurl is a base64 concatentation of two JSON values separated by a colon,
+    # prefixed by "Basic "
+    # For this, Thomas Wilburn is owed many frosty beverages
+
+    authstring = bytes("Basic ", "utf-8") + base64.b64encode(
+        bytes(
+            f"{configjson['consumer_key_emp']}:{configjson['consumer_secret_emp']}",
+            "utf-8",
+        )
+    )
+
+    cookies = r.cookies
+
+    headers = {
+        "Accept": "application/json, text/plain, */*",
+        "Origin": "https://outagemap.duke-energy.com",
+        "Referer": "https://outagemap.duke-energy.com/",
+        "Sec-Fetch-Mode": "cors",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/76.0.3809.132 Safari/537.36",
+    }
+
+    headers["Authorization"] = authstring
+
+    return headers, cookies
+
+
+"""
+Cached provider of the (headers, cookies) pair returned by get_auth
+Note: The credentials are rebuilt only when the TTL runs out or when the API
+rejects them. Concurrent fetchers share one refresh: the lock serializes
+them, and invalidate() only refreshes if the rejected credentials are still
+the current ones, so every other caller just picks up the new pair.
+"""
+
+
+class CredentialProvider:
+    def __init__(self, ttl=credential_ttl, fetch=None):
+        self.ttl = ttl
+        self.fetch = fetch or get_auth
+        self.lock = threading.Lock()
+        self.credentials = None
+        self.expires_at = 0.0
+
+    """
+    Method for getting the current credentials, refreshing them if expired
+    """
+
+    def get(self):
+        with self.lock:
+            if self.credentials is None or time.monotonic() >= self.expires_at:
+                self._refresh()
+            return self.credentials
+
+    """
+    Method for replacing credentials the API answered with 401/403
+    """
+
+    def invalidate(self, stale):
+        with self.lock:
+            if self.credentials is None or self.credentials is stale:
+                self._refresh()
+            return self.credentials
+
+    def _refresh(self):
+        self.credentials = self.fetch()
+        self.expires_at = time.monotonic() + self.ttl
+
+
+credentials = CredentialProvider()
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import contextlib
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from decouple import Csv, config
+
+"""
+Synthetic-load benchmarks for the dukeoutages ingestion cycle. Local
+stand-ins for the Duke outages API and the FCC area API (with configurable
+latency and error rates) serve outages from a generator that clusters them
+around storm cells inside each jurisdiction's territory. The harness runs a
+cold cycle, a few churn cycles and an unchanged cycle per size against a
+dedicated PostgreSQL database (or a fresh SQLite file), and appends the per-stage timings as one JSON
+line to BENCH_OUTPUT so runs can be compared over time.
+Note: On PostgreSQL every table of the pipeline is truncated before each
+size, so BENCH_DB_SERVICE must point at a throwaway database
+"""
+
+# Outage counts to benchmark and the cycles run per count, the first one cold
+bench_sizes = config("BENCH_SIZES", default="100,1000,10000", cast=Csv(int))
+bench_cycles = config("BENCH_CYCLES", default=3, cast=int)
+
+# Share of the outages restored, replaced or updated between two cycles
+bench_churn = config("BENCH_CHURN", default=0.1, cast=float)
+bench_seed = config("BENCH_SEED", default=42, cast=int)
+
+# Seconds of latency and share of failed requests of each stand-in
+duke_latency = config("BENCH_DUKE_LATENCY", default=0.2, cast=float)
+duke_error_rate = config("BENCH_DUKE_ERROR_RATE", default=0.0, cast=float)
+fcc_latency = config("BENCH_FCC_LATENCY", default=0.0, cast=float)
+fcc_error_rate = config("BENCH_FCC_ERROR_RATE", default=0.0, cast=float)
+
+bench_db_service = config("BENCH_DB_SERVICE", default="")
+bench_output = config("BENCH_OUTPUT", default="bench_results.jsonl")
+bench_quiet = config("BENCH_QUIET", default=True, cast=bool)
+
+# Rough bounding boxes (south, west, north, east) of each Duke territory
+# and the share of all outages it gets
+territories = {
+    "DEF": ((27.5, -83.5, 30.5, -80.8), 0.25),
+    "DEC": ((34.0, -83.0, 36.5, -78.5), 0.40),
+    "DEI": ((38.0, -87.5, 41.5, -85.0), 0.15),
+    "DEM": ((38.8, -85.0, 39.5, -84.0), 0.20),
+}
+
+causes = [
+    ("weather", 40),
+    ("tree", 25),
+    ("equipment", 15),
+    ("animal", 8),
+    ("vehicle", 5),
+    ("planned", 2),
+    ("under investigation", 5),
+]
+
+pipeline_tables = [
+    "duke_outages",
+    "outage_tracker",
+    "outage_snapshots",
+    "outage_snapshot_heads",
+    "outage_rollups",
+    "rollup_members",
+    "ingestion_leases",
+]
+
+
+"""
+Synthetic outages for every jurisdiction, clustered around storm cells
+Note: Most outages fall within a few kilometres of a cell centre and the
+rest are spread over the territory, while affected customers follow a
+heavy-tailed distribution, which is roughly what a storm looks like
+"""
+
+
+class OutageGenerator:
+    def __init__(self, size, churn=bench_churn, seed=bench_seed):
+        self.random = random.Random(seed)
+        self.churn = churn
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.payloads = {}
+
+        self.cells = {
+            jurisdiction: [self.storm_cell(box) for _ in range(2 + int(math.sqrt(size) / 10))]
+            for jurisdiction, (box, share) in territories.items()
+        }
+        self.outages = {jurisdiction: {} for jurisdiction in territories}
+        for jurisdiction, (box, share) in territories.items():
+            for _ in range(max(1, round(size * share))):
+                self.add_outage(jurisdiction)
+
+    def storm_cell(self, box):
+        south, west, north, east = box
+        return (
+            self.random.uniform(south, north),
+            self.random.uniform(west, east),
+            self.random.uniform(0.02, 0.15),
+            self.random.paretovariate(1.5),
+        )
+
+    """
+    Method for placing a new outage in a jurisdiction
+    """
+
+    def add_outage(self, jurisdiction):
+        box = territories[jurisdiction][0]
+        if self.random.random() < 0.9:
+            lat, lon, spread, weight = self.random.choices(
+                self.cells[jurisdiction], weights=[cell[3] for cell in self.cells[jurisdiction]])[0]
+            lat = self.random.gauss(lat, spread)
+            lon = self.random.gauss(lon, spread)
+        else:
+            lat = self.random.uniform(box[0], box[2])
+            lon = self.random.uniform(box[1], box[3])
+
+        self.sequence += 1
+        identifer = f"{jurisdiction}{self.sequence:09d}"
+        self.outages[jurisdiction][identifer] = self.nugget(identifer, round(lat, 6), round(lon, 6))
+
+    def nugget(self, identifer, lat, lon):
+        affected = min(5000, int(self.random.paretovariate(1.2)))
+
+        hull = []
+        if affected > 1:
+            radius = 0.0005 * math.sqrt(affected)
+            hull = [
+                {
+                    "lat": round(lat + radius * math.sin(angle), 6),
+                    "lng": round(lon + radius * math.cos(angle), 6),
+                }
+                for angle in sorted(self.random.uniform(0, 2 * math.pi) for _ in range(6))
+            ]
+
+        return {
+            "sourceEventNumber": identifer,
+            "deviceLatitudeLocation": lat,
+            "deviceLongitudeLocation": lon,
+            "convexHull": hull,
+            "customersAffectedNumber": affected,
+            "outageCause": self.random.choices(
+                [cause for cause, weight in causes], weights=[weight for cause, weight in causes])[0],
+        }
+
+    """
+    Method for moving to the next cycle: some outages are restored and
+    replaced by new ones, and some change their affected customers
+    """
+
+    def step(self):
+        with self.lock:
+            for jurisdiction, outages in self.outages.items():
+                changes = int(len(outages) * self.churn)
+                identifers = self.random.sample(list(outages), min(len(outages), changes))
+
+                for identifer in identifers[:changes // 2]:
+                    del outages[identifer]
+                    self.add_outage(jurisdiction)
+
+                for identifer in identifers[changes // 2:]:
+                    outages[identifer]["customersAffectedNumber"] = max(
+                        1, outages[identifer]["customersAffectedNumber"] + self.random.randint(-10, 10))
+
+            self.payloads = {}
+
+    """
+    Method for getting the encoded payload and ETag of a jurisdiction
+    """
+
+    def payload(self, jurisdiction):
+        with self.lock:
+            if jurisdiction not in self.payloads:
+                body = json.dumps({"data": list(self.outages.get(jurisdiction, {}).values())}).encode("utf-8")
+                self.payloads[jurisdiction] = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+            return self.payloads[jurisdiction]
+
+    def count(self):
+        with self.lock:
+            return sum(len(outages) for outages in self.outages.values())
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def delay_or_fail(self):
+        if self.server.latency:
+            time.sleep(self.server.random.uniform(0.5, 1.5) * self.server.latency)
+
+        if self.server.random.random() < self.server.error_rate:
+            self.send_body(503, b'{"error": "service unavailable"}')
+            return True
+        return False
+
+    def send_body(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+"""
+Stand-in for the Duke outages API, answering conditional requests with a 304
+"""
+
+
+class DukeHandler(StandInHandler):
+    def do_GET(self):
+        if self.delay_or_fail():
+            return
+
+        jurisdiction = parse_qs(urlparse(self.path).query).get("jurisdiction", [""])[0]
+        body, etag = self.server.generator.payload(jurisdiction)
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_body(200, body, {"ETag": etag})
+
+
+"""
+Stand-in for the FCC area API, deriving a stable block from the coordinates
+"""
+
+
+class FccHandler(StandInHandler):
+    def do_GET(self):
+        if self.delay_or_fail():
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        lat = float(query["lat"][0])
+        lon = float(query["lon"][0])
+
+        block = int(hashlib.sha1(f"{lat:.3f},{lon:.3f}".encode("utf-8")).hexdigest(), 16)
+        body = json.dumps({"results": [{
+            "block_fips": f"37{block % 10 ** 13:013d}",
+            "county_name": f"County {block % 100}",
+            "state_name": "North Carolina",
+        }]}).encode("utf-8")
+
+        self.send_body(200, body)
+
+
+"""
+Method for serving a stand-in API from a background thread
+"""
+
+
+def start_standin(handler, latency=0.0, error_rate=0.0, generator=None, seed=bench_seed):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.generator = generator
+    server.random = random.Random(seed)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+"""
+Method for emptying the pipeline tables and the geocode cache between sizes
+"""
+
+
+def reset_state(dukeoutages, storage, cache_file):
+    with storage.transaction() as conn:
+        cur = conn.cursor()
+        try:
+            if storage.name == "postgres":
+                cur.execute(f"TRUNCATE {', '.join(pipeline_tables)}")
+            else:
+                for table in pipeline_tables:
+                    cur.execute(f"DELETE FROM {table}")
+        finally:
+            cur.close()
+
+    if dukeoutages.geocache is not None:
+        dukeoutages.geocache.close()
+        dukeoutages.geocache = None
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(cache_file + suffix):
+            os.remove(cache_file + suffix)
+
+    dukeoutages.poll_state = dukeoutages.PollState()
+
+
+"""
+Method for reading the on-disk size of every pipeline table in bytes
+Note: SQLite keeps every table in one file, so only the file size is reported
+"""
+
+
+def table_sizes(storage):
+    if storage.name == "sqlite":
+        return {"database": sum(
+            os.path.getsize(storage.path + suffix)
+            for suffix in ("", "-wal") if os.path.exists(storage.path + suffix)
+        )}
+
+    with storage.transaction() as conn:
+        cur = conn.cursor()
+        try:
+            sizes = {}
+            for table in pipeline_tables:
+                # Partitioned tables are summed over their partitions
+                cur.execute("""
+                    SELECT pg_total_relation_size(%(table)s::regclass) + COALESCE((
+                        SELECT SUM(pg_total_relation_size(relid))
+                        FROM pg_partition_tree(%(table)s::regclass)
+                        WHERE relid <> %(table)s::regclass
+                    ), 0)
+                """, {"table": table})
+                sizes[table] = int(cur.fetchone()[0])
+            return sizes
+        finally:
+            cur.close()
+
+
+"""
+Method for running and timing one ingestion cycle
+"""
+
+
+def run_cycle(dukeoutages, kind):
+    started = time.perf_counter()
+    record = {"kind": kind}
+
+    try:
+        with contextlib.ExitStack() as stack:
+            if bench_quiet:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            result = dukeoutages.main({}, {})
+    except Exception as e:
+        record.update(status="failed", error=str(e))
+    else:
+        record.update(
+            status="skipped" if result["skipped"] else "ok",
+            timings={stage: round(seconds, 4) for stage, seconds in result["timings"].items()},
+            changed=result["changed"],
+            closed=result["closed"],
+            active=result["active"],
+        )
+
+    record["seconds"] = round(time.perf_counter() - started, 4)
+    return record
+
+
+"""
+Method for benchmarking every cycle of a single size
+"""
+
+
+def run_size(size, duke, dukeoutages, storage, cache_file):
+    generator = OutageGenerator(size)
+    duke.generator = generator
+    reset_state(dukeoutages, storage, cache_file)
+
+    cycles = []
+    for cycle in range(max(1, bench_cycles)):
+        if cycle:
+            generator.step()
+        cycles.append(run_cycle(dukeoutages, "cold" if cycle == 0 else "churn"))
+        print(f"{size} outages, cycle {cycle}: {cycles[-1]['status']} in {cycles[-1]['seconds']}s")
+
+    # Nothing changed since the last cycle, so this measures the polling overhead alone
+    cycles.append(run_cycle(dukeoutages, "unchanged"))
+    print(f"{size} outages, unchanged cycle: {cycles[-1]['status']} in {cycles[-1]['seconds']}s")
+
+    return {
+        "size": generator.count(),
+        "cycles": cycles,
+        "table_bytes": table_sizes(storage),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    sqlite = config("STORAGE_BACKEND", default="postgres") == "sqlite"
+    if not (sqlite or bench_db_service):
+        raise ValueError("BENCH_DB_SERVICE is not set; it must point at a throwaway database")
+
+    workdir = tempfile.mkdtemp(prefix="dukebench-")
+    cache_file = os.path.join(workdir, "geocode_cache.db")
+
+    duke = start_standin(DukeHandler, duke_latency, duke_error_rate)
+    fcc = start_standin(FccHandler, fcc_latency, fcc_error_rate)
+
+    # dukeoutages reads its settings on import, so they are set before importing it
+    os.environ.update({
+        "REMOTE_DB_SERVICE": bench_db_service,
+        "SQLITE_FILE": os.path.join(workdir, "dukeoutages.db"),
+        "DUKE_OUTAGES_URL": f"http://127.0.0.1:{duke.server_address[1]}/outages?jurisdiction=",
+        "FCC_AREA_URL": f"http://127.0.0.1:{fcc.server_address[1]}/area",
+        "GEOCODE_CACHE_FILE": cache_file,
+        "REJECT_FILE": os.path.join(workdir, "rejected_outages.jsonl"),
+    })
+    import dukeoutages
+    from dukestorage import get_storage
+
+    dukeoutages.init_db()
+
+    run = {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "settings": {
+            "cycles": bench_cycles,
+            "churn": bench_churn,
+            "seed": bench_seed,
+            "duke_latency": duke_latency,
+            "duke_error_rate": duke_error_rate,
+            "fcc_latency": fcc_latency,
+            "fcc_error_rate": fcc_error_rate,
+            "streaming": dukeoutages.streaming,
+            "geocoder": dukeoutages.geocoder,
+            "storage": get_storage().name,
+        },
+        "results": [run_size(size, duke, dukeoutages, get_storage(), cache_file) for size in bench_sizes],
+    }
+
+    duke.shutdown()
+    fcc.shutdown()
+
+    with open(bench_output, "a") as f:
+        f.write(json.dumps(run) + "\n")
+    print(f"Benchmark results appended to {bench_output}")
+
+    return run
+
+
+if __name__ == '__main__':
+    main()
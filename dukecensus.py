@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import json
+import math
+from collections import defaultdict
+from decouple import config
+
+"""
+Offline replacement for hit_fcc/hit_geo. County and census-block boundaries
+are loaded from local TIGER/Line GeoJSON files (convert the published
+shapefiles once with `ogr2ogr -f GeoJSON -t_srs EPSG:4326 out.geojson in.shp`)
+into a uniform grid spatial index, and whole batches of outage points are
+resolved to block_fips/state/county without any network round trip.
+"""
+
+counties_file = config("CENSUS_COUNTIES_FILE", default="tl_2020_us_county.geojson")
+blocks_file = config("CENSUS_BLOCKS_FILE", default="")
+
+# Grid cell size in degrees for the county and block indexes
+county_cell_size = config("CENSUS_COUNTY_CELL_SIZE", default=0.25, cast=float)
+block_cell_size = config("CENSUS_BLOCK_CELL_SIZE", default=0.01, cast=float)
+
+# State names keyed on state FIPS code, matching the FCC API's state_name
+state_names = {
+    "01": "Alabama", "02": "Alaska", "04": "Arizona", "05": "Arkansas",
+    "06": "California", "08": "Colorado", "09": "Connecticut", "10": "Delaware",
+    "11": "District of Columbia", "12": "Florida", "13": "Georgia", "15": "Hawaii",
+    "16": "Idaho", "17": "Illinois", "18": "Indiana", "19": "Iowa",
+    "20": "Kansas", "21": "Kentucky", "22": "Louisiana", "23": "Maine",
+    "24": "Maryland", "25": "Massachusetts", "26": "Michigan", "27": "Minnesota",
+    "28": "Mississippi", "29": "Missouri", "30": "Montana", "31": "Nebraska",
+    "32": "Nevada", "33": "New Hampshire", "34": "New Jersey", "35": "New Mexico",
+    "36": "New York", "37": "North Carolina", "38": "North Dakota", "39": "Ohio",
+    "40": "Oklahoma", "41": "Oregon", "42": "Pennsylvania", "44": "Rhode Island",
+    "45": "South Carolina", "46": "South Dakota", "47": "Tennessee", "48": "Texas",
+    "49": "Utah", "50": "Vermont", "51": "Virginia", "53": "Washington",
+    "54": "West Virginia", "55": "Wisconsin", "56": "Wyoming", "72": "Puerto Rico",
+}
+
+
+"""
+Method for checking whether a point falls inside a polygon given as a list of
+rings (outer ring first, holes after), using the even-odd rule
+"""
+
+
+def point_in_rings(lon, lat, rings):
+    inside = False
+    for ring in rings:
+        j = len(ring) - 1
+        for i in range(len(ring)):
+            xi, yi = ring[i][0], ring[i][1]
+            xj, yj = ring[j][0], ring[j][1]
+            if (yi > lat) != (yj > lat) and lon < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+                inside = not inside
+            j = i
+    return inside
+
+
+"""
+Uniform grid over polygon bounding boxes. Each cell holds the ids of the
+polygons whose bbox overlaps it, so a lookup only ray-casts against the
+handful of polygons that can actually contain the point.
+"""
+
+
+class GridIndex:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.polygons = []
+
+    def cell(self, lon, lat):
+        return (math.floor(lon / self.cell_size), math.floor(lat / self.cell_size))
+
+    def add(self, polygons, properties):
+        # polygons is a list of polygons, each a list of rings
+        for rings in polygons:
+            xs = [point[0] for point in rings[0]]
+            ys = [point[1] for point in rings[0]]
+            bbox = (min(xs), min(ys), max(xs), max(ys))
+
+            polygon_id = len(self.polygons)
+            self.polygons.append((bbox, rings, properties))
+
+            min_cell = self.cell(bbox[0], bbox[1])
+            max_cell = self.cell(bbox[2], bbox[3])
+            for cx in range(min_cell[0], max_cell[0] + 1):
+                for cy in range(min_cell[1], max_cell[1] + 1):
+                    self.cells[(cx, cy)].append(polygon_id)
+
+    def candidates(self, cell):
+        return [self.polygons[polygon_id] for polygon_id in self.cells.get(cell, ())]
+
+    def find(self, lon, lat, candidates=None):
+        if candidates is None:
+            candidates = self.candidates(self.cell(lon, lat))
+
+        for bbox, rings, properties in candidates:
+            if bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]:
+                if point_in_rings(lon, lat, rings):
+                    return properties
+        return None
+
+
+"""
+Method for reading the polygons and properties out of a GeoJSON feature collection
+"""
+
+
+def read_features(path):
+    with open(path) as f:
+        collection = json.load(f)
+
+    for feature in collection["features"]:
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            continue
+
+        yield polygons, feature.get("properties") or {}
+
+
+def first_property(properties, *names):
+    for name in names:
+        if properties.get(name) is not None:
+            return str(properties[name])
+    return None
+
+
+"""
+Offline resolver answering block_fips/state/county from the boundary indexes
+"""
+
+
+class CensusResolver:
+    def __init__(self, counties_path=counties_file, blocks_path=blocks_file):
+        self.counties = GridIndex(county_cell_size)
+        self.county_names = {}
+        self.blocks = None
+
+        for polygons, properties in read_features(counties_path):
+            geoid = first_property(properties, "GEOID", "GEOID20", "GEOID10")
+            county = {
+                "geoid": geoid,
+                "state": state_names.get(geoid[:2]),
+                # NAMELSAD carries the " County" suffix the FCC's county_name has
+                "county": first_property(
+                    properties, "NAMELSAD", "NAMELSAD20", "NAMELSAD10", "NAME", "NAME20", "NAME10"),
+            }
+            self.county_names[geoid] = county
+            self.counties.add(polygons, county)
+
+        if blocks_path:
+            self.blocks = GridIndex(block_cell_size)
+            for polygons, properties in read_features(blocks_path):
+                self.blocks.add(
+                    polygons, first_property(properties, "GEOID20", "GEOID", "GEOID10")
+                )
+
+    """
+    Method for resolving a single point, returning the same keys as hit_fcc
+    """
+
+    def resolve(self, lat, lon):
+        return self.resolve_batch([{"device_lat": lat, "device_lon": lon}])[0]
+
+    """
+    Method for resolving a whole batch of nuggets in one call. Points are
+    deduplicated and grouped by grid cell so the candidate polygons of a cell
+    are gathered once for every point that falls in it.
+    """
+
+    def resolve_batch(self, nuggets):
+        points = [(float(n["device_lon"]), float(n["device_lat"])) for n in nuggets]
+        resolved = {}
+
+        by_cell = defaultdict(list)
+        for point in set(points):
+            by_cell[self.counties.cell(*point)].append(point)
+
+        for cell, cell_points in by_cell.items():
+            candidates = self.counties.candidates(cell)
+            for lon, lat in cell_points:
+                resolved[(lon, lat)] = self._resolve_point(lon, lat, candidates)
+
+        return [dict(resolved[point]) for point in points]
+
+    def _resolve_point(self, lon, lat, county_candidates):
+        block_fips = None
+        county = None
+
+        if self.blocks is not None:
+            block_fips = self.blocks.find(lon, lat)
+            if block_fips is not None:
+                county = self.county_names.get(block_fips[:5])
+
+        if county is None:
+            county = self.counties.find(lon, lat, county_candidates) or {}
+
+        return {
+            "block_fips": block_fips,
+            "state": county.get("state"),
+            "county": county.get("county"),
+        }
+
+
+# Resolver loaded on first use, the boundary files take a while to index
+resolver = None
+
+
+def get_resolver():
+    global resolver
+    if resolver is None:
+        resolver = CensusResolver()
+    return resolver
+
+
+"""
+Method for resolving area data offline based on latitude and longitude
+Note: Drop-in replacement for the hit_fcc method
+"""
+
+
+def hit_census(nugget):
+    return get_resolver().resolve_batch([nugget])[0]
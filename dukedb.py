@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import io
+import psycopg2
+from contextlib import contextmanager
+from decouple import config
+from psycopg2 import pool
+
+"""
+Shared PostgreSQL plumbing: the process-wide connection pool, the
+transaction helper every save/update/export step runs in, and the COPY
+helpers used to bulk-load staging tables.
+"""
+
+# Database connection pool shared by every cycle of the process
+db_pool_size = config("DB_POOL_SIZE", default=4, cast=int)
+db_pool = None
+
+
+"""
+Method for getting the connection string of the database
+Note: Falls back to the DB_* settings the export scripts used to read
+"""
+
+
+def db_service():
+    service = config("REMOTE_DB_SERVICE", default="")
+    if service:
+        return service
+
+    return psycopg2.extensions.make_dsn(
+        dbname=config("DB_NAME"),
+        user=config("DB_USER"),
+        password=config("DB_PASS"),
+        host=config("DB_SERVICE"),
+        port=config("DB_PORT"),
+    )
+
+
+"""
+Method for connecting to the database
+"""
+
+
+def connect_db():
+    try:
+        conn = psycopg2.connect(db_service())
+    except Exception as e:
+        print(f"Error connecting to the database: {str(e)}")
+    finally:
+        return conn
+
+
+"""
+Method for getting the connection pool shared by every cycle of this process
+"""
+
+
+def get_pool():
+    global db_pool
+    if db_pool is None:
+        db_pool = pool.ThreadedConnectionPool(1, db_pool_size, db_service())
+    return db_pool
+
+
+"""
+Method for running database work in a transaction on a pooled connection
+Note: When a connection is passed in, it belongs to an enclosing transaction
+and is yielded as is; committing and rolling back are left to the owner.
+"""
+
+
+@contextmanager
+def transaction(conn=None):
+    if conn is not None:
+        yield conn
+        return
+
+    conn = get_pool().getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        get_pool().putconn(conn, close=bool(conn.closed))
+
+
+"""
+Method for turning a Python value into a field of PostgreSQL's COPY text format
+"""
+
+
+def copy_field(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # BYTEA hex input, with the backslash escaped for COPY
+        return "\\\\x" + bytes(value).hex()
+
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+"""
+Method for streaming rows into a table with a single COPY round trip
+"""
+
+
+def copy_rows(cur, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_field(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+"""
+Method for creating an empty, transaction-scoped staging table
+Note: The table is truncated when it already exists, so a staging table
+can be reused by several batches within the same cycle transaction
+"""
+
+
+def stage_table(cur, table, columns_sql):
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} ({columns_sql}) ON COMMIT DROP")
+    cur.execute(f"TRUNCATE {table}")
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from decouple import config
+
+"""
+Two-level cache for geocoding results (block_fips, state, county).
+Lookups are keyed on coordinates rounded to GEOCODE_CACHE_PRECISION decimal
+places (4 places is roughly 11 meters), so outages that keep coming back on
+the same feeders resolve without another FCC/Census round trip. The first
+level is an in-process LRU, the second an on-disk SQLite store that survives
+restarts. Both levels honour a TTL, and both are trimmed to a maximum size.
+"""
+
+cache_file = config("GEOCODE_CACHE_FILE", default="geocode_cache.db")
+cache_precision = config("GEOCODE_CACHE_PRECISION", default=4, cast=int)
+cache_ttl = config("GEOCODE_CACHE_TTL", default=30 * 24 * 3600, cast=int)
+memory_size = config("GEOCODE_CACHE_MEMORY_SIZE", default=10000, cast=int)
+disk_size = config("GEOCODE_CACHE_DISK_SIZE", default=500000, cast=int)
+
+# How many disk writes happen between two size-based evictions
+evict_every = 1000
+
+
+class GeoCache:
+    def __init__(self, path=cache_file, precision=cache_precision, ttl=cache_ttl,
+                 memory_size=memory_size, disk_size=disk_size):
+        self.precision = precision
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                created_at REAL
+            )
+        """)
+        self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS geocode_cache_created_at
+            ON geocode_cache (created_at)
+        """)
+        self.conn.commit()
+        self.evict()
+
+    """
+    Method for building the quantized cache key of a coordinate pair
+    """
+
+    def key(self, lat, lon):
+        return f"{float(lat):.{self.precision}f},{float(lon):.{self.precision}f}"
+
+    """
+    Method for reading a cached result, trying memory first and disk second
+    """
+
+    def get(self, lat, lon):
+        key = self.key(lat, lon)
+        now = time.time()
+
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached is not None:
+                value, created_at = cached
+                if now - created_at < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return dict(value)
+                del self.memory[key]
+
+            row = self.conn.execute(
+                "SELECT value, created_at FROM geocode_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] < self.ttl:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                self.stats["disk_hits"] += 1
+                return dict(value)
+
+            self.stats["misses"] += 1
+            return None
+
+    """
+    Method for storing a result in both cache levels
+    """
+
+    def put(self, lat, lon, value):
+        key = self.key(lat, lon)
+        now = time.time()
+
+        with self.lock:
+            self._remember(key, value, now)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO geocode_cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), now),
+            )
+            self.conn.commit()
+
+            self.writes += 1
+            if self.writes % evict_every == 0:
+                self._evict_disk(now)
+
+    """
+    Method for resolving a nugget through the cache, falling back to the given
+    resolver (hit_fcc or hit_geo) on a miss. Failed lookups are not cached.
+    """
+
+    def lookup(self, nugget, resolver):
+        lat = nugget["device_lat"]
+        lon = nugget["device_lon"]
+
+        cached = self.get(lat, lon)
+        if cached is not None:
+            return cached
+
+        value = resolver(nugget)
+        if value:
+            self.put(lat, lon, value)
+        return value
+
+    """
+    Method for dropping expired rows and trimming the disk store to its size limit
+    """
+
+    def evict(self):
+        with self.lock:
+            self._evict_disk(time.time())
+
+    """
+    Method for reporting hit/miss counts since the cache was opened
+    """
+
+    def summary(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = sum(stats.values())
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        stats["hit_ratio"] = round(hits / lookups, 3) if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _remember(self, key, value, created_at):
+        self.memory[key] = (value, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        self.conn.execute(
+            "DELETE FROM geocode_cache WHERE created_at < ?", (now - self.ttl,)
+        )
+        self.conn.execute("""
+            DELETE FROM geocode_cache
+            WHERE key IN (
+                SELECT key FROM geocode_cache
+                ORDER BY created_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        """, (self.disk_size,))
+        self.conn.commit()
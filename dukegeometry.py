@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import json
+from dukestorage import get_storage
+
+"""
+Compact storage of the convex_hull polygons Duke reports with each outage.
+A hull is a list of {"lat", "lng"} points; it is stored as a small binary
+blob in hull_geometry: a format byte, the point count as a varint, then
+every coordinate quantized to 1e-7 degrees (about a centimetre) and written
+as a zigzag varint delta from the previous point. Typical hulls shrink from
+a few hundred bytes of JSON to a few dozen. A hull whose points would not
+decode to exactly the same JSON (extra keys, more than 7 decimals, integer
+coordinates) is stored as tagged raw JSON instead, so decoding is always
+lossless. The bounding box and centroid of each hull are kept in their own
+columns, so spatial filters never decode a blob.
+"""
+
+# Leading byte of an encoded hull
+format_raw = 0
+format_delta = 1
+
+# Quantization of the delta format, in units per degree
+hull_scale = 10 ** 7
+
+# Rows re-encoded per batch by backfill_geometry
+backfill_batch_size = 5000
+
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value):
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+"""
+Method for quantizing a coordinate, or None when it would not decode to the same float
+"""
+
+
+def quantize(value):
+    if type(value) is not float:
+        return None
+
+    quantized = round(value * hull_scale)
+    if quantized / hull_scale != value:
+        return None
+    return quantized
+
+
+"""
+Method for reading the points of a hull that the delta format can hold exactly
+Note: Returns None for anything else, which is then stored as raw JSON
+"""
+
+
+def hull_points(hull):
+    if not isinstance(hull, list):
+        return None
+
+    points = []
+    for point in hull:
+        if not isinstance(point, dict) or list(point) != ["lat", "lng"]:
+            return None
+        lat = quantize(point["lat"])
+        lng = quantize(point["lng"])
+        if lat is None or lng is None:
+            return None
+        points.append((lat, lng))
+
+    return points
+
+
+"""
+Method for encoding a convex_hull into the bytes stored in hull_geometry
+"""
+
+
+def encode_hull(hull):
+    if hull is None:
+        return None
+
+    points = hull_points(hull)
+    if points is None:
+        return bytes([format_raw]) + json.dumps(hull).encode("utf-8")
+
+    out = bytearray([format_delta])
+    write_varint(out, len(points))
+    previous_lat, previous_lng = 0, 0
+    for lat, lng in points:
+        write_varint(out, zigzag(lat - previous_lat))
+        write_varint(out, zigzag(lng - previous_lng))
+        previous_lat, previous_lng = lat, lng
+
+    return bytes(out)
+
+
+"""
+Method for decoding hull_geometry bytes back into the original convex_hull
+"""
+
+
+def decode_hull(data):
+    if data is None:
+        return None
+
+    data = bytes(data)
+    if data[0] == format_raw:
+        return json.loads(data[1:].decode("utf-8"))
+    if data[0] != format_delta:
+        raise ValueError(f"Unknown hull format: {data[0]}")
+
+    count, pos = read_varint(data, 1)
+    hull = []
+    lat, lng = 0, 0
+    for _ in range(count):
+        delta, pos = read_varint(data, pos)
+        lat += unzigzag(delta)
+        delta, pos = read_varint(data, pos)
+        lng += unzigzag(delta)
+        hull.append({"lat": lat / hull_scale, "lng": lng / hull_scale})
+
+    return hull
+
+
+"""
+Method for decoding hull_geometry bytes into the JSON text exports write
+"""
+
+
+def hull_json(data):
+    return json.dumps(decode_hull(data))
+
+
+"""
+Method for computing the bounding box and centroid of a hull
+Note: The centroid is the area centroid of the polygon, falling back to the
+mean of its points when they are collinear. Outages without a usable hull
+are bounded by their device location.
+"""
+
+
+def hull_bounds(hull, device_lat, device_lon):
+    points = []
+    if isinstance(hull, list):
+        for point in hull:
+            try:
+                points.append((float(point["lat"]), float(point["lng"])))
+            except (KeyError, TypeError, ValueError):
+                continue
+    if not points:
+        return (device_lat, device_lon, device_lat, device_lon, device_lat, device_lon)
+
+    lats = [lat for lat, lng in points]
+    lngs = [lng for lat, lng in points]
+
+    # Shoelace formula, relative to the first point for precision
+    origin_lat, origin_lng = points[0]
+    area = centroid_lat = centroid_lng = 0.0
+    for (lat1, lng1), (lat2, lng2) in zip(points, points[1:] + points[:1]):
+        lat1, lng1 = lat1 - origin_lat, lng1 - origin_lng
+        lat2, lng2 = lat2 - origin_lat, lng2 - origin_lng
+        cross = lng1 * lat2 - lng2 * lat1
+        area += cross
+        centroid_lat += (lat1 + lat2) * cross
+        centroid_lng += (lng1 + lng2) * cross
+
+    if abs(area) > 1e-12:
+        centroid_lat = origin_lat + centroid_lat / (3 * area)
+        centroid_lng = origin_lng + centroid_lng / (3 * area)
+    else:
+        centroid_lat = sum(lats) / len(lats)
+        centroid_lng = sum(lngs) / len(lngs)
+
+    return (min(lats), min(lngs), max(lats), max(lngs), centroid_lat, centroid_lng)
+
+
+"""
+Method for turning a convex_hull into its hull_geometry value and bounds columns
+"""
+
+
+def hull_geometry(hull, device_lat, device_lon):
+    return encode_hull(hull), hull_bounds(hull, device_lat, device_lon)
+
+
+"""
+Method for finding the outages whose hull bounding box overlaps a box
+Note: Only active outages are searched unless active_only is False
+"""
+
+
+def outages_in_bbox(min_lat, min_lon, max_lat, max_lon, active_only=True, conn=None):
+    return get_storage().outages_in_bbox(min_lat, min_lon, max_lat, max_lon, active_only, conn)
+
+
+"""
+Method for turning legacy hull rows into the geometry updates that replace their JSON
+Note: Rows without a device location are bounded by their hull alone
+"""
+
+
+def legacy_geometry(rows):
+    updates = []
+    for key, device_lat, device_lon, hull in rows:
+        encoded, bounds = hull_geometry(
+            hull,
+            None if device_lat is None else float(device_lat),
+            None if device_lon is None else float(device_lon),
+        )
+        updates.append((key, encoded, *bounds))
+    return updates
+
+
+"""
+Method for moving hulls still stored as JSON into hull_geometry
+Note: Rows written before the compact encoding keep their JSON in
+convex_hull; they are re-encoded in batches, with their bounds, and the JSON
+is cleared. The batches walk the identifiers, and the few rows without one
+are then matched by their row instead. Run by dukemigrations before
+convex_hull is dropped
+"""
+
+
+def backfill_geometry(table, conn=None):
+    storage = get_storage()
+    total = 0
+    after = ""
+    while True:
+        with storage.transaction(conn) as batch:
+            rows = storage.legacy_hulls(table, after, backfill_batch_size, batch)
+            if not rows:
+                break
+            after = rows[-1][0]
+            storage.update_geometry(table, legacy_geometry(rows), batch)
+            total += len(rows)
+
+    while True:
+        with storage.transaction(conn) as batch:
+            rows = storage.legacy_hulls(table, None, backfill_batch_size, batch)
+            if not rows:
+                return total
+            # Every row updated clears its JSON, so the next batch moves on
+            if storage.update_geometry(table, legacy_geometry(rows), batch, by_row=True) < len(rows):
+                raise RuntimeError(f"{table}: hulls without an outage identifier could not be re-encoded")
+            total += len(rows)
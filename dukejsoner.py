@@ -1,93 +1,430 @@
-import psycopg2
 import json
+import gzip
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from decouple import config
+from dukegeometry import hull_json
+from dukestorage import get_storage
 
+# Streaming export settings: output format ("json" array, "ndjson", or the
+# columnar "parquet" and "arrow" formats),
+# on-the-fly gzip, and how many rows each server-side cursor fetch returns
+export_streaming = config("EXPORT_STREAMING", default=False, cast=bool)
+export_format = config("EXPORT_FORMAT", default="json")
+export_gzip = config("EXPORT_GZIP", default=False, cast=bool)
+export_itersize = config("EXPORT_ITERSIZE", default=2000, cast=int)
 
-def connect_db():
-    try:
-        conn = psycopg2.connect(
-            database=config("DB_NAME"),
-            user=config("DB_USER"),
-            password=config("DB_PASS"),
-            host=config("DB_SERVICE"),
-            port=config("DB_PORT"),
-        )
-    except Exception as e:
-        print(f"Error connecting to the database: {str(e)}")
-    finally:
-        return conn
+tracker_columns = [
+    "outage_identifer",
+    "device_lat",
+    "device_lon",
+    "block_fips",
+    "hull_geometry",
+    "jurisdiction",
+    "origin",
+    "state",
+    "county",
+    "affected",
+    "cause",
+    "outage_start_estimate",
+    "outage_end_estimate",
+    "fix_duration_seconds",
+    "outage_restored",
+]
+
+outage_columns = [
+    "outage_identifer",
+    "device_lat",
+    "device_lon",
+    "hull_geometry",
+    "jurisdiction",
+    "affected",
+    "cause",
+    "created_at",
+]
+
+
+# Incremental export settings: where partitioned output and the watermarks
+# live, and how far behind the database clock a watermark stays so rows of
+# still-running ingestion transactions are never skipped
+export_incremental = config("EXPORT_INCREMENTAL", default=False, cast=bool)
+export_dir = config("EXPORT_DIR", default="exports")
+export_state_file = config("EXPORT_STATE_FILE", default="export_state.json")
+export_safety_lag = config("EXPORT_SAFETY_LAG", default=900, cast=int)
+
+# Column each table's watermark is kept on
+watermark_columns = {"duke_outages": "created_at", "outage_tracker": "updated_at"}
+
+# Columnar formats and the file extension each one is written with
+columnar_formats = {"parquet": "parquet", "arrow": "arrows"}
+
+
+# Format a duration in seconds the way fix_duration_estimate has always been written
+def duration_text(seconds):
+    if seconds is None:
+        return None
+    return f"{seconds // 86400}d {seconds % 86400 // 3600}h {seconds % 3600 // 60}m {seconds % 60}s"
+
+
+# Convert an outage_tracker row to an object of key-value pairs
+def tracker_object(row):
+    d = {}
+    d["outage_identifer"] = str(row[0])
+    d["device_lat"] = float(row[1])
+    d["device_lon"] = float(row[2])
+    d["block_fips"] = row[3]
+    d["convex_hull"] = hull_json(row[4])
+    d["jurisdiction"] = str(row[5])
+    d["origin"] = str(row[6])
+    d["state"] = str(row[7])
+    d["county"] = str(row[8])
+    d["affected"] = str(row[9])
+    d["cause"] = str(row[10])
+    d["outage_start_estimate"] = str(row[11])
+    d["outage_end_estimate"] = str(row[12])
+    d["fix_duration_estimate"] = str(duration_text(row[13]))
+    d["outage_restored"] = str(row[14])
+    return d
+
+
+# Convert a duke_outages row to an object of key-value pairs
+def outage_object(row):
+    d = {}
+    d["outage_identifer"] = str(row[0])
+    d["device_lat"] = float(row[1])
+    d["device_lon"] = float(row[2])
+    d["convex_hull"] = hull_json(row[3])
+    d["jurisdiction"] = str(row[4])
+    d["affected"] = int(row[5])
+    d["cause"] = str(row[6])
+    d["created_at"] = str(row[7])
+    return d
 
 
 def fetch_outage_tracker():
-    conn = connect_db()
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM outage_tracker")
-        rows = cur.fetchall()
+        rows = get_storage().stream_rows("outage_tracker", tracker_columns)
 
         # Convert query to objects of key-value pairs
-        objects_list = []
-        for row in rows:
-            d = {}
-            d["outage_identifer"] = str(row[0])
-            d["device_lat"] = float(row[1])
-            d["device_lon"] = float(row[2])
-            d["block_fips"] = float(row[3]) if row[3] is not None else None
-            d["convex_hull"] = str(row[4])
-            d["jurisdiction"] = str(row[5])
-            d["origin"] = str(row[6])
-            d["state"] = str(row[7])
-            d["county"] = str(row[8])
-            d["affected"] = str(row[9])
-            d["cause"] = str(row[10])
-            d["outage_start_estimate"] = str(row[11])
-            d["outage_end_estimate"] = str(row[12])
-            d["fix_duration_estimate"] = str(row[13])
-            d["outage_restored"] = str(row[14])
-            objects_list.append(d)
-
-        cur.close()
+        objects_list = [tracker_object(row) for row in rows]
 
         return json.dumps(objects_list, indent=4)
 
     except Exception as e:
         print(f"Error fetching data: {str(e)}")
-    finally:
-        conn.close()
 
 
 def fetch_duke_outages():
     try:
-        conn = connect_db()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM duke_outages")
-        rows = cur.fetchall()
+        rows = get_storage().stream_rows("duke_outages", outage_columns)
 
         # Convert query to objects of key-value pairs
-        objects_list = []
-        for row in rows:
-            d = {}
-            d["outage_identifer"] = str(row[0])
-            d["device_lat"] = float(row[1])
-            d["device_lon"] = float(row[2])
-            d["convex_hull"] = str(row[3])
-            d["jurisdiction"] = str(row[4])
-            d["affected"] = int(row[5])
-            d["cause"] = str(row[6])
-            d["created_at"] = str(row[7])
-            objects_list.append(d)
-
-        cur.close()
+        objects_list = [outage_object(row) for row in rows]
 
         return json.dumps(objects_list, indent=4)
 
     except Exception as e:
         print(f"Error fetching data: {str(e)}")
+
+
+# Stream the rows of a table from the storage backend, so only itersize rows
+# are held in memory at a time
+def stream_rows(table, columns, itersize=export_itersize, where="", params=None):
+    return get_storage().stream_rows(table, columns, itersize, where, params)
+
+
+# Open an export file for writing text, gzip-compressed on the fly if asked
+def open_export(path, compress=export_gzip):
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+# Write objects incrementally as NDJSON (one object per line) or as a JSON array
+def write_objects(f, objects, fmt=export_format):
+    count = 0
+
+    if fmt == "ndjson":
+        for obj in objects:
+            f.write(json.dumps(obj))
+            f.write("\n")
+            count += 1
+        return count
+
+    f.write("[")
+    for obj in objects:
+        f.write(",\n" if count else "\n")
+        f.write(json.dumps(obj))
+        count += 1
+    f.write("\n]\n")
+    return count
+
+
+# Export a whole table with constant memory, whatever its size
+def export_table(table, path, fmt=export_format, compress=export_gzip, itersize=export_itersize):
+    if table == "outage_tracker":
+        columns, to_object = tracker_columns, tracker_object
+    else:
+        columns, to_object = outage_columns, outage_object
+
+    rows = stream_rows(table, columns, itersize)
+    with open_export(path, compress) as f:
+        return write_objects(f, (to_object(row) for row in rows), fmt)
+
+
+# Arrow schema of each table: real timestamps, integers and booleans, text
+# identifiers, and dictionary-encoded low-cardinality columns
+def columnar_schema(table):
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int32(), pa.string())
+
+    if table == "outage_tracker":
+        return pa.schema([
+            ("outage_identifer", pa.string()),
+            ("device_lat", pa.float64()),
+            ("device_lon", pa.float64()),
+            ("block_fips", pa.string()),
+            ("convex_hull", pa.string()),
+            ("jurisdiction", category),
+            ("origin", category),
+            ("state", category),
+            ("county", category),
+            ("affected", pa.int32()),
+            ("cause", category),
+            ("outage_start_estimate", pa.timestamp("us")),
+            ("outage_end_estimate", pa.timestamp("us")),
+            ("fix_duration_estimate", pa.string()),
+            ("outage_restored", pa.bool_()),
+            ("fix_duration_seconds", pa.int32()),
+        ])
+
+    return pa.schema([
+        ("outage_identifer", pa.string()),
+        ("device_lat", pa.float64()),
+        ("device_lon", pa.float64()),
+        ("convex_hull", pa.string()),
+        ("jurisdiction", category),
+        ("affected", pa.int32()),
+        ("cause", category),
+        ("created_at", pa.timestamp("us")),
+    ])
+
+
+# Database column each Arrow column is read from, where the names differ
+columnar_sources = {"convex_hull": "hull_geometry", "fix_duration_estimate": "fix_duration_seconds"}
+
+
+# Convert a database value to the Python value its Arrow column expects
+def columnar_value(name, value):
+    if value is None:
+        return None
+    if name in ("device_lat", "device_lon"):
+        return float(value)
+    if name == "convex_hull":
+        return hull_json(value)
+    if name == "fix_duration_estimate":
+        return duration_text(value)
+    return value
+
+
+# Build one Arrow record batch from a chunk of rows
+def columnar_batch(schema, rows):
+    import pyarrow as pa
+
+    arrays = []
+    for index, field in enumerate(schema):
+        values = [columnar_value(field.name, row[index]) for row in rows]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, field.type))
+
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+# Export a whole table as Parquet or as an Arrow IPC stream, one record batch
+# (and one Parquet row group) per itersize rows, so memory stays constant.
+# The rows can come from another table with the same columns, such as an
+# archive, and be narrowed with a where clause
+def export_columnar(table, path, fmt="parquet", itersize=export_itersize, source=None, where="", params=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = columnar_schema(table)
+    columns = [columnar_sources.get(field.name, field.name) for field in schema]
+
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(path, schema, compression="zstd")
+        write = writer.write_batch
+    else:
+        writer = pa.ipc.new_stream(path, schema)
+        write = writer.write_batch
+
+    count = 0
+    try:
+        chunk = []
+        for row in stream_rows(source or table, columns, itersize, where, params):
+            chunk.append(row)
+            if len(chunk) >= itersize:
+                write(columnar_batch(schema, chunk))
+                count += len(chunk)
+                chunk = []
+
+        if chunk:
+            write(columnar_batch(schema, chunk))
+            count += len(chunk)
     finally:
-        conn.close()
+        writer.close()
+
+    return count
+
+
+# Name of the export file of a table for the configured format and compression
+def export_path(table, fmt=export_format, compress=export_gzip):
+    if fmt in columnar_formats:
+        return f"{table}.{columnar_formats[fmt]}"
+
+    path = f"{table}.{'ndjson' if fmt == 'ndjson' else 'json'}"
+    return f"{path}.gz" if compress else path
+
+
+# Read the watermarks left by the previous incremental export
+def load_watermarks(path=export_state_file):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# Save the watermarks atomically, only after the part files are complete
+def save_watermarks(watermarks, path=export_state_file):
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(watermarks, f, indent=4)
+    os.replace(f"{path}.tmp", path)
+
+
+# Upper bound of this run's export window, taken from the database clock
+def export_bound():
+    return get_storage().capture_time() - timedelta(seconds=export_safety_lag)
+
+
+# Export the rows of a table that are new or changed since its watermark into
+# a new part file of the day's partition: exports/<table>/dt=<day>/part-<bound>
+def export_increment(table, watermark, bound, compress=export_gzip, itersize=export_itersize):
+    if table == "outage_tracker":
+        columns, to_object = tracker_columns, tracker_object
+    else:
+        columns, to_object = outage_columns, outage_object
+    watermark_column = watermark_columns[table]
+
+    where = f"WHERE {watermark_column} < {get_storage().param('bound')}"
+    if watermark is not None:
+        where += f" AND {watermark_column} >= {get_storage().param('watermark')}"
+    params = {
+        "watermark": datetime.fromisoformat(watermark) if watermark is not None else None,
+        "bound": bound,
+    }
+
+    def objects():
+        for row in stream_rows(table, columns + [watermark_column], itersize, where, params):
+            obj = to_object(row)
+            obj[watermark_column] = str(row[-1])
+            yield obj
+
+    partition = os.path.join(export_dir, table, f"dt={bound:%Y-%m-%d}")
+    os.makedirs(partition, exist_ok=True)
+    path = os.path.join(partition, f"part-{bound:%Y%m%dT%H%M%S}.ndjson{'.gz' if compress else ''}")
+
+    with open_export(f"{path}.tmp", compress) as f:
+        count = write_objects(f, objects(), "ndjson")
+
+    if count:
+        os.replace(f"{path}.tmp", path)
+    else:
+        os.remove(f"{path}.tmp")
+
+    return count
+
+
+# Merge the part files of every closed day partition into one file. Tracker
+# rows can change more than once, so only their latest version is kept.
+def compact(table, today, compress=export_gzip):
+    table_dir = os.path.join(export_dir, table)
+    if not os.path.isdir(table_dir):
+        return 0
+
+    compacted = 0
+    for partition in sorted(os.listdir(table_dir)):
+        if partition >= f"dt={today:%Y-%m-%d}":
+            continue
+
+        partition_dir = os.path.join(table_dir, partition)
+        parts = sorted(name for name in os.listdir(partition_dir) if name.startswith("part-"))
+        if not parts:
+            continue
+
+        latest = OrderedDict()
+        existing = [name for name in os.listdir(partition_dir) if name.startswith("compacted")]
+        for name in existing + parts:
+            opener = gzip.open if name.endswith(".gz") else open
+            with opener(os.path.join(partition_dir, name), "rt", encoding="utf-8") as f:
+                for line in f:
+                    obj = json.loads(line)
+                    key = obj["outage_identifer"]
+                    latest.pop(key, None)
+                    latest[key] = obj
+
+        path = os.path.join(partition_dir, f"compacted.ndjson{'.gz' if compress else ''}")
+        with open_export(f"{path}.tmp", compress) as f:
+            write_objects(f, latest.values(), "ndjson")
+        os.replace(f"{path}.tmp", path)
+
+        for name in existing + parts:
+            if os.path.join(partition_dir, name) != path:
+                os.remove(os.path.join(partition_dir, name))
+        compacted += 1
+
+    return compacted
+
+
+# Export only what changed since the last run, then compact closed partitions
+def export_incremental_tables():
+    watermarks = load_watermarks()
+    bound = export_bound()
+
+    for table in ["outage_tracker", "duke_outages"]:
+        watermark = watermarks.get(table)
+        count = export_increment(table, watermark, bound)
+        watermarks[table] = bound.isoformat()
+        print(f"Exported {count} new or changed rows from '{table}' since {watermark}")
+
+    save_watermarks(watermarks)
+
+    for table in ["outage_tracker", "duke_outages"]:
+        compacted = compact(table, bound)
+        if compacted:
+            print(f"Compacted {compacted} '{table}' partitions")
 
 
 def main():
+    if export_incremental:
+        export_incremental_tables()
+        return
+
+    if export_format in columnar_formats:
+        for table in ["outage_tracker", "duke_outages"]:
+            count = export_columnar(table, export_path(table), export_format)
+            print(f"Exported {count} rows from '{table}' to '{export_path(table)}'")
+        return
+
+    if export_streaming:
+        for table in ["outage_tracker", "duke_outages"]:
+            count = export_table(table, export_path(table))
+            print(f"Exported {count} rows from '{table}' to '{export_path(table)}'")
+        return
+
     with open("outage_tracker.json", "w") as f:
         f.write(fetch_outage_tracker())
 
@@ -98,6 +435,7 @@ def main():
 if __name__ == "__main__":
     try:
         main()
-        print("Outage data saved in 'outage_tracker.json' and 'duke_outages.json' files!.")
+        if not (export_streaming or export_incremental or export_format in columnar_formats):
+            print("Outage data saved in 'outage_tracker.json' and 'duke_outages.json' files!.")
     except Exception as e:
         print(f"Task failed with error: {e}")
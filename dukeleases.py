@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os
+import socket
+from datetime import timedelta
+from decouple import config
+from dukestorage import get_storage
+
+"""
+Coordination of several ingestion workers through the ingestion_leases
+table. With INGEST_LEASES enabled, every cycle starts by leasing this
+worker's share of the jurisdictions, and only those are fetched, geocoded,
+written and checked for restored outages, so adding workers divides the
+load instead of duplicating it. Each worker also holds a lease on its own
+name: the live workers split the jurisdictions evenly, a worker holding
+more than its share releases the surplus to the others, and the leases of
+a worker that stops renewing them expire after INGEST_LEASE_SECONDS, when
+the remaining workers take them over. The cycle renews its leases once more
+inside its own transaction, so a worker that lost one while it was running
+rolls back instead of writing over the new owner.
+"""
+
+# Whether jurisdictions are leased, so several workers can share them
+ingest_leases = config("INGEST_LEASES", default=False, cast=bool)
+
+# Name of this worker in the leases; a stable one, such as Heroku's DYNO,
+# lets a restarted worker take its jurisdictions back straight away
+worker_id = config("WORKER_ID", default=os.environ.get("DYNO") or f"{socket.gethostname()}:{os.getpid()}")
+
+# Seconds a lease lasts unless renewed; must exceed the polling interval plus a cycle
+lease_seconds = config("INGEST_LEASE_SECONDS", default=1800, cast=int)
+
+worker_prefix = "worker:"
+jurisdiction_prefix = "jurisdiction:"
+
+
+"""
+The jurisdictions leased to this worker
+"""
+
+
+class JurisdictionLeases:
+    def __init__(self, worker=worker_id, seconds=lease_seconds):
+        self.worker = worker
+        self.seconds = seconds
+        self.owned = []
+
+    """
+    Method for renewing this worker's leases and taking its share of the free jurisdictions
+    Note: A worker joining a busy cluster gets its share once the others have
+    released their surplus on their next cycle, so while the workers rebalance
+    the released jurisdictions can go one cycle without being polled
+    """
+
+    def assign(self, jurisdictions):
+        storage = get_storage()
+
+        with storage.transaction() as conn:
+            now = storage.capture_time(conn)
+
+            workers = {self.worker}
+            holders = {}
+            for name, worker, expires_at in storage.read_leases(conn):
+                if name.startswith(worker_prefix):
+                    if expires_at >= now:
+                        workers.add(worker)
+                    elif worker != self.worker:
+                        # Workers that stopped renewing are forgotten
+                        storage.release_leases([name], worker, conn)
+                elif name.startswith(jurisdiction_prefix) and (worker == self.worker or expires_at >= now):
+                    holders[name[len(jurisdiction_prefix):]] = worker
+
+            # Every worker gets as many, and the first workers by name one of the leftovers each
+            share, leftovers = divmod(len(jurisdictions), len(workers))
+            if sorted(workers).index(self.worker) < leftovers:
+                share += 1
+            held = [jurisdiction for jurisdiction in jurisdictions if holders.get(jurisdiction) == self.worker]
+            free = [jurisdiction for jurisdiction in jurisdictions if jurisdiction not in holders]
+            wanted = held[:share] + free[:max(share - len(held), 0)]
+
+            taken = storage.take_leases(
+                [worker_prefix + self.worker] + [jurisdiction_prefix + jurisdiction for jurisdiction in wanted],
+                self.worker,
+                now + timedelta(seconds=self.seconds),
+                now,
+                conn,
+            )
+            storage.release_leases(
+                [jurisdiction_prefix + jurisdiction for jurisdiction in held[share:]], self.worker, conn)
+
+        self.owned = [jurisdiction for jurisdiction in jurisdictions if jurisdiction_prefix + jurisdiction in taken]
+        return self.owned
+
+    """
+    Method for renewing the leases inside the cycle's transaction
+    Note: Raises when another worker took one over, so the cycle rolls back
+    """
+
+    def renew(self, conn):
+        storage = get_storage()
+        now = storage.capture_time(conn)
+
+        taken = storage.take_leases(
+            [jurisdiction_prefix + jurisdiction for jurisdiction in self.owned],
+            self.worker,
+            now + timedelta(seconds=self.seconds),
+            now,
+            conn,
+        )
+        lost = [jurisdiction for jurisdiction in self.owned if jurisdiction_prefix + jurisdiction not in taken]
+        if lost:
+            raise RuntimeError(f"Leases of {', '.join(lost)} were taken over by another worker during the cycle")
+
+    """
+    Method for handing every lease back, so the other workers take over on their next cycle
+    """
+
+    def release(self):
+        get_storage().release_leases(
+            [worker_prefix + self.worker] + [jurisdiction_prefix + jurisdiction for jurisdiction in self.owned],
+            self.worker,
+        )
+        self.owned = []
+
+
+leases = JurisdictionLeases()
+
+
+"""
+Method for taking a named lease for a number of seconds
+Note: For jobs only one worker should run, such as the retention job
+"""
+
+
+def claim(name, seconds):
+    storage = get_storage()
+
+    with storage.transaction() as conn:
+        now = storage.capture_time(conn)
+        return name in storage.take_leases([name], worker_id, now + timedelta(seconds=seconds), now, conn)
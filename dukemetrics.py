@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+In-process metrics for the ingestion pipeline: counters, gauges and latency
+histograms with labels, rendered in the Prometheus text exposition format on
+a local HTTP endpoint and summarized as JSON for the per-cycle log line.
+"""
+
+# Latency buckets in seconds, from a cache hit to a storm-sized cycle
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+registry = []
+lock = threading.Lock()
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def summary_key(key):
+    return ",".join(f"{name}={value}" for name, value in key) or "total"
+
+
+def render_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [(self.name, key, (), value) for key, value in self.values.items()]
+
+    def summary(self):
+        return {summary_key(key): value for key, value in self.values.items()}
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with lock:
+            self.values[label_key(labels)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.values = {}
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        with lock:
+            series = self.values.setdefault(
+                key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0, "last": 0.0}
+            )
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+            series["last"] = value
+
+    def samples(self):
+        samples = []
+        for key, series in self.values.items():
+            for bound, count in zip(self.buckets, series["buckets"]):
+                samples.append((f"{self.name}_bucket", key, (("le", bound),), count))
+            samples.append((f"{self.name}_bucket", key, (("le", "+Inf"),), series["count"]))
+            samples.append((f"{self.name}_sum", key, (), series["sum"]))
+            samples.append((f"{self.name}_count", key, (), series["count"]))
+        return samples
+
+    def summary(self):
+        return {
+            summary_key(key): {
+                "last": round(series["last"], 4),
+                "count": series["count"],
+                "sum": round(series["sum"], 4),
+            }
+            for key, series in self.values.items()
+        }
+
+
+stage_seconds = Histogram("duke_stage_seconds", "Seconds spent in each stage of an ingestion cycle")
+fetch_seconds = Histogram("duke_fetch_seconds", "Seconds spent fetching the outages of a jurisdiction")
+rows_total = Counter("duke_rows_total", "Rows inserted, skipped or rejected per table")
+geocode_calls_total = Counter("duke_geocode_calls_total", "Geocode lookups by the source that answered them")
+active_outages = Gauge("duke_active_outages", "Outages reported as active by the last cycle")
+cycles_total = Counter("duke_cycles_total", "Ingestion cycles by outcome")
+
+
+"""
+Method for timing a block into a histogram
+"""
+
+
+@contextmanager
+def timer(histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+
+"""
+Method for rendering every metric in the Prometheus text exposition format
+"""
+
+
+def render():
+    lines = []
+    with lock:
+        for metric in registry:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{render_labels(key, extra)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+"""
+Method for summarizing every metric as a JSON-serializable dict
+"""
+
+
+def summary():
+    with lock:
+        return {metric.name: metric.summary() for metric in registry if metric.values}
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+"""
+Method for serving /metrics from a background thread
+"""
+
+
+def start_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from dukegeometry import backfill_geometry
+from dukestorage import archive_tables, get_storage, hull_tables
+
+"""
+Versioned schema migrations. schema_migrations records the version of every
+migration a database has been through, and migrate() applies the missing
+ones in order, in one transaction, before the first ingestion cycle of a
+process. create_tables holds the current schema, so a new database only
+runs it and finds nothing else to change; databases created by earlier
+versions, including the copies of the tables save_outages and save_tracker
+used to create, are brought to the same schema by the migrations after it.
+"""
+
+
+def create_tables(storage, conn):
+    storage.create_tables(conn)
+    storage.create_snapshot_tables(conn)
+    storage.create_rollup_tables(conn)
+
+    # Archives created from older hot tables get the columns added since
+    if storage.existing_tables([archive for archive, partition_key in archive_tables.values()], conn):
+        storage.create_archive_tables(conn)
+
+
+def unique_identifers(storage, conn):
+    storage.unique_identifers(conn)
+
+
+def block_fips_text(storage, conn):
+    storage.block_fips_text(conn)
+
+
+def duration_seconds(storage, conn):
+    storage.duration_seconds(conn)
+
+
+def ingestion_leases(storage, conn):
+    storage.create_lease_table(conn)
+
+
+"""
+Method for moving the remaining convex_hull JSON into hull_geometry and dropping the column
+"""
+
+
+def hull_geometry_only(storage, conn):
+    for table in storage.existing_tables(hull_tables, conn):
+        if "convex_hull" in storage.table_columns(table, conn):
+            backfill_geometry(table, conn)
+    storage.drop_convex_hull(conn)
+
+
+# Every migration, by version; a version is never reused or reordered
+migrations = [
+    (1, "create_tables", create_tables),
+    (2, "unique_identifers", unique_identifers),
+    (3, "block_fips_text", block_fips_text),
+    (4, "duration_seconds", duration_seconds),
+    (5, "hull_geometry_only", hull_geometry_only),
+    (6, "ingestion_leases", ingestion_leases),
+]
+
+
+"""
+Method for applying the migrations a database has not been through yet
+Note: Planner statistics are refreshed on every run, so they also cover
+whatever changed since the last start
+"""
+
+
+def migrate(conn=None):
+    storage = get_storage()
+    applied = []
+
+    with storage.transaction(conn) as conn:
+        done = storage.applied_migrations(conn)
+        for version, name, apply in migrations:
+            if version in done:
+                continue
+            apply(storage, conn)
+            storage.record_migration(version, name, conn)
+            applied.append(name)
+            print(f"Applied schema migration {version}: {name}")
+
+        storage.optimize(conn)
+
+    return applied
+
+
+if __name__ == '__main__':
+    try:
+        migrate()
+    except Exception as e:
+        print(f"Schema migration failed with error: {e}")
@@ -3,12 +3,31 @@
 
 import requests
 import json
+import ijson
+import queue
+import threading
+import time
 from decouple import config
-import psycopg2
 from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dukegeocache import GeoCache
+from dukegeometry import hull_geometry
+from dukecensus import get_resolver
+import dukemetrics
+import dukereplay
+from dukeauth import credentials
+from dukepolling import PollState
+from dukerollups import apply_rollups, rebuild_rollups, remove_restored_rollups, rollup_changes
+from dukesnapshots import capture_time, close_snapshots, record_snapshots
+from dukemigrations import migrate
+from dukespatial import active_index, load_index, spatial_index
+from dukeapi import live_snapshot, load_snapshot
+from dukeleases import ingest_leases, leases
+from dukestorage import get_storage
 
 # For area data, census block, county, state, and market area information based on latitude/longitude input
-area_url = "https://geo.fcc.gov/api/census/area"
+area_url = config("FCC_AREA_URL", default="https://geo.fcc.gov/api/census/area")
 geo_url = "https://geocoding.geo.census.gov/geocoder/geographies/coordinates"
 
 # For Duke outages location data
@@ -17,7 +36,10 @@ geo_url = "https://geocoding.geo.census.gov/geocoder/geographies/coordinates"
 # )
 
 # For outages data with latitudes and longitudes
-outages_url = "https://prod.apigee.duke-energy.app/outage-maps/v1/outages?jurisdiction="
+outages_url = config(
+    "DUKE_OUTAGES_URL",
+    default="https://prod.apigee.duke-energy.app/outage-maps/v1/outages?jurisdiction=",
+)
 
 # Constants
 censusYear = 2020
@@ -28,6 +50,88 @@ jurisdictions = [
     "DEM"    # Duke Energy Ohio and Kentucky, which somehow have an M in them.
 ]
 
+# HTTP tuning: per-request timeout in seconds and the number of concurrent jurisdiction fetches
+request_timeout = config("REQUEST_TIMEOUT", default=30, cast=float)
+fetch_workers = config("FETCH_WORKERS", default=len(jurisdictions), cast=int)
+
+
+"""
+Method for building the pooled, keep-alive HTTP session shared by all API calls
+Note: The adapter records or replays the traffic when HTTP_MODE asks for it
+"""
+
+
+def create_session():
+    session = requests.Session()
+
+    adapter = dukereplay.create_adapter(pool_connections=4, pool_maxsize=max(fetch_workers, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+    return session
+
+
+session = create_session()
+
+# Columns written by save_outages, and where entries that fail validation are reported
+outage_columns = [
+    "outage_identifer",
+    "device_lat",
+    "device_lon",
+    "jurisdiction",
+    "affected",
+    "cause",
+    "hull_geometry",
+    "min_lat",
+    "min_lon",
+    "max_lat",
+    "max_lon",
+    "centroid_lat",
+    "centroid_lon",
+]
+reject_file = config("REJECT_FILE", default="rejected_outages.jsonl")
+
+# Columns written by save_tracker for newly tracked outages
+tracker_columns = [
+    "outage_identifer",
+    "device_lat",
+    "device_lon",
+    "block_fips",
+    "jurisdiction",
+    "origin",
+    "state",
+    "county",
+    "affected",
+    "cause",
+    "outage_restored",
+    "hull_geometry",
+    "min_lat",
+    "min_lon",
+    "max_lat",
+    "max_lon",
+    "centroid_lat",
+    "centroid_lon",
+]
+
+# Streaming mode parses the Duke payloads incrementally and writes them in batches of this size
+streaming = config("STREAMING", default=False, cast=bool)
+stream_batch_size = config("STREAM_BATCH_SIZE", default=1000, cast=int)
+
+# Conditional requests (ETag / If-Modified-Since plus payload hashing) in the buffered fetch mode
+conditional_polling = config("POLL_CONDITIONAL", default=True, cast=bool)
+poll_state = PollState()
+
+# Whether the schema has been checked by this process
+schema_ready = False
+
+# Geocoder used by save_tracker: "fcc" (cached hit_fcc calls) or "offline" (local TIGER boundaries)
+geocoder = config("GEOCODER", default="fcc")
+
+# Geocode cache in front of hit_fcc, opened on first use
+geocache = None
+
 
 """
 Method for hitting the FCC API to get area data based on latitude and longitude
@@ -39,8 +143,9 @@ def hit_fcc(nugget):
     lat = nugget["device_lat"]
     lon = nugget["device_lon"]
 
-    area_request = requests.get(
-        f"{area_url}?lat={lat}&lon={lon}&censusYear={censusYear}&format=json"
+    area_request = session.get(
+        f"{area_url}?lat={lat}&lon={lon}&censusYear={censusYear}&format=json",
+        timeout=request_timeout,
     )
 
     area_data = json.loads(area_request.content)
@@ -67,8 +172,9 @@ Note: Either this method or the hit_fcc method can be used, not both
 def hit_geo(nugget):
     lat = nugget["device_lat"]
     lon = nugget["device_lon"]
-    geo_request = requests.get(
-        f"{geo_url}?x={lon}&y={lat}&benchmark=4&vintage=423&format=json"
+    geo_request = session.get(
+        f"{geo_url}?x={lon}&y={lat}&benchmark=4&vintage=423&format=json",
+        timeout=request_timeout,
     )
     geo_data = json.loads(geo_request.content)
 
@@ -90,388 +196,644 @@ def hit_geo(nugget):
 
 
 """
-Method for hitting the Duke Power API to get outage data based on jurisdiction
+Method for geocoding an entry through the persistent geocode cache
 """
 
 
-def hit_duke(jurisdictions, headers, cookies):
-    master = []
+def geocode(nugget):
+    global geocache
+    if geocache is None:
+        geocache = GeoCache()
+
+    def resolve(nugget):
+        dukemetrics.geocode_calls_total.inc(source="fcc")
+        return hit_fcc(nugget)
+
+    result = geocache.lookup(nugget, resolve)
+    dukemetrics.geocode_calls_total.inc(source="cache_lookup")
+    return result
+
 
-    for jurisdiction in jurisdictions:
-        outages_res = requests.get(
-            f"{outages_url}{jurisdiction}", headers=headers, cookies=cookies
+"""
+Method for turning a single Duke Power API outage record into an entry
+Note: Missing fields are left as None, so a record lacking one goes to the
+reject report with the other invalid entries instead of failing the fetch
+"""
+
+
+def parse_nugget(nugget, jurisdiction):
+    return {
+        "source_event_number": nugget.get("sourceEventNumber"),
+        "device_lat": nugget.get("deviceLatitudeLocation"),
+        "device_lon": nugget.get("deviceLongitudeLocation"),
+        "convex_hull": nugget.get("convexHull"),
+        "jurisdiction": jurisdiction,
+        "affected": nugget.get("customersAffectedNumber"),
+        "cause": nugget.get("outageCause"),
+        "origin": "Duke Energy",
+    }
+
+
+"""
+Method for requesting the outages of a jurisdiction from the Duke Power API
+Note: Without explicit headers the cached credentials from dukeauth are used,
+and a 401/403 refreshes them once and retries the request
+"""
+
+
+def duke_get(jurisdiction, headers, cookies, extra_headers=None, stream=False):
+    managed = headers is None
+    if managed:
+        current = credentials.get()
+        headers, cookies = current
+
+    def request():
+        return session.get(
+            f"{outages_url}{jurisdiction}",
+            headers=dict(headers, **(extra_headers or {})),
+            cookies=cookies,
+            timeout=request_timeout,
+            stream=stream,
         )
 
+    outages_res = request()
+    if managed and outages_res.status_code in (401, 403):
+        outages_res.close()
+        headers, cookies = credentials.invalidate(current)
+        outages_res = request()
+
+    return outages_res
+
+
+"""
+Method for hitting the Duke Power API to get outage data for a single jurisdiction
+"""
+
+
+def fetch_jurisdiction(jurisdiction, headers, cookies):
+    with dukemetrics.timer(dukemetrics.fetch_seconds, jurisdiction=jurisdiction):
+        return fetch_jurisdiction_entries(jurisdiction, headers, cookies)
+
+
+def fetch_jurisdiction_entries(jurisdiction, headers, cookies):
+    extra_headers = poll_state.conditional_headers(jurisdiction) if conditional_polling else {}
+    outages_res = duke_get(jurisdiction, headers, cookies, extra_headers)
+    if outages_res.status_code != 304:
+        outages_res.raise_for_status()
+
+    # A 304 or an identical payload reuses the entries parsed in an earlier cycle
+    entries = poll_state.unchanged_entries(jurisdiction, outages_res) if conditional_polling else None
+    changed = entries is None
+
+    if changed:
         outages_data = json.loads(outages_res.content)
+        entries = [parse_nugget(nugget, jurisdiction) for nugget in outages_data["data"]]
 
-        for nugget in outages_data["data"]:
-            source_event_number = nugget["sourceEventNumber"]
-            device_lat = nugget["deviceLatitudeLocation"]
-            device_lon = nugget["deviceLongitudeLocation"]
-            jurisdiction = jurisdiction
-            affected = nugget["customersAffectedNumber"]
-            cause = nugget["outageCause"]
-            convex_hull = nugget["convexHull"]
-
-            entry = {
-                "source_event_number": source_event_number,
-                "device_lat": device_lat,
-                "device_lon": device_lon,
-                "convex_hull": convex_hull,
-                "jurisdiction": jurisdiction,
-                "affected": affected,
-                "cause": cause,
-                "origin": "Duke Energy",
-            }
-
-            master.append(entry)
+    if conditional_polling:
+        poll_state.record(jurisdiction, outages_res, entries, changed)
+
+    return entries
+
+
+"""
+Method for hitting the Duke Power API to get outage data based on jurisdiction
+Note: All jurisdictions are fetched concurrently over the shared session, so the
+wall-clock time tracks the slowest jurisdiction rather than the sum of all of them.
+A failed jurisdiction fails the whole fetch, otherwise update_tracker would mark
+all of its outages as restored.
+"""
+
+
+def hit_duke(jurisdictions, headers=None, cookies=None):
+    master = []
+
+    if not jurisdictions:
+        return master
+
+    workers = max(1, min(fetch_workers, len(jurisdictions)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch_jurisdiction, jurisdiction, headers, cookies): jurisdiction
+            for jurisdiction in jurisdictions
+        }
+
+        for future in as_completed(futures):
+            try:
+                master.extend(future.result())
+            except Exception as e:
+                print(f"Error fetching outages for {futures[future]}: {str(e)}")
+                for pending in futures:
+                    pending.cancel()
+                raise
 
     return master
 
 
 """
-Method for creating duke_outages, and
-outage_tracker tables in the database
+Method for streaming the outages of a single jurisdiction from the Duke Power API
+Note: The 'data' items are parsed incrementally as the response downloads,
+so the full payload is never held in memory
 """
 
 
-def create_tables():
-    conn = connect_db()
-    try:
-        cur = conn.cursor()
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS duke_outages (
-                outage_identifer TEXT UNIQUE,
-                device_lat DECIMAL,
-                device_lon DECIMAL,
-                convex_hull JSONB,
-                jurisdiction TEXT,
-                affected INTEGER,
-                cause TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS outage_tracker (
-                outage_identifer TEXT UNIQUE,
-                device_lat DECIMAL,
-                device_lon DECIMAL,
-                block_fips DECIMAL,
-                convex_hull JSONB,
-                jurisdiction TEXT,
-                origin TEXT, 
-                state TEXT,
-                county TEXT,
-                affected INTEGER,
-                cause TEXT,
-                outage_start_estimate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                outage_end_estimate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                fix_duration_estimate TEXT,
-                outage_restored BOOLEAN
-            )
-        """)
-
-        conn.commit()
-    except Exception as e:
-        print(f"Error creating tables: {str(e)}")
-        conn.rollback()
-    finally:
-        cur.close()
-        conn.close()
+def stream_jurisdiction(jurisdiction, headers, cookies):
+    with duke_get(jurisdiction, headers, cookies, stream=True) as outages_res:
+        outages_res.raise_for_status()
+        outages_res.raw.decode_content = True
+
+        for nugget in ijson.items(outages_res.raw, "data.item", use_float=True):
+            yield parse_nugget(nugget, jurisdiction)
 
 
 """
-Method for saving outage data to the duke_outages table
+Method for streaming the outages of all jurisdictions concurrently
+Note: Each jurisdiction is read by its own thread into a bounded queue, so
+downloads overlap while memory stays bounded by the queue size. A failed
+jurisdiction raises in the consumer, which aborts the cycle.
 """
 
 
-def save_outages(data):
-    try:
-        conn = connect_db()
+def stream_duke(jurisdictions, headers=None, cookies=None):
+    entries = queue.Queue(maxsize=stream_batch_size * 2)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                entries.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(jurisdiction):
+        started = time.perf_counter()
         try:
-            cur = conn.cursor()
-
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS duke_outages (
-                    outage_identifer TEXT,
-                    device_lat DECIMAL,
-                    device_lon DECIMAL,
-                    convex_hull JSONB,
-                    jurisdiction TEXT,
-                    affected INTEGER,
-                    cause TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            for entry in data:
-                try:
-                    entry['convex_hull'] = json.dumps(entry['convex_hull'])
-
-                    cur.execute("""
-                        SELECT COUNT(*) FROM duke_outages
-                        WHERE outage_identifer = %(source_event_number)s
-                    """, entry)
-                    count = cur.fetchone()[0]
-
-                    if count == 0:
-                        cur.execute("""
-                            INSERT INTO duke_outages (
-                                outage_identifer,
-                                device_lat,
-                                device_lon,
-                                convex_hull,
-                                jurisdiction,
-                                affected,
-                                cause
-                            )
-                            VALUES (
-                                %(source_event_number)s,
-                                %(device_lat)s,
-                                %(device_lon)s,
-                                %(convex_hull)s,
-                                %(jurisdiction)s,
-                                %(affected)s,
-                                %(cause)s
-                            )
-                        """, entry)
-                except Exception as e:
-                    print(f"Error inserting entry: {entry}")
-                    print(f"Error message: {str(e)}")
-                    conn.rollback()
-
-            conn.commit()
+            for entry in stream_jurisdiction(jurisdiction, headers, cookies):
+                if not put(entry):
+                    return
+            dukemetrics.fetch_seconds.observe(time.perf_counter() - started, jurisdiction=jurisdiction)
         except Exception as e:
-            print(f"Error executing database operations: {str(e)}")
-            conn.rollback()
+            print(f"Error fetching outages for {jurisdiction}: {str(e)}")
+            put(e)
         finally:
-            cur.close()
-    except Exception as e:
-        print(f"Error connecting to the database: {str(e)}")
+            put(done)
+
+    producers = [
+        threading.Thread(target=produce, args=(jurisdiction,), daemon=True)
+        for jurisdiction in jurisdictions
+    ]
+    for producer in producers:
+        producer.start()
+
+    try:
+        remaining = len(producers)
+        while remaining:
+            item = entries.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
     finally:
-        conn.close()
+        stop.set()
 
 
 """
-Method for saving outage data to the outage_tracker table
+Method for creating duke_outages, and
+outage_tracker tables in the database
+Note: Existing tables are migrated to the current schema
 """
 
 
-def save_tracker(data):
-    try:
-        conn = connect_db()
+def create_tables(conn=None):
+    return migrate(conn)
+
+
+"""
+Method for checking the schema once per process, before the first cycle
+Note: The rollups are rebuilt here too, so their deltas start from the
+active outages as they are now
+"""
+
+
+def init_db():
+    global schema_ready
+    if not schema_ready:
+        create_tables()
+        rebuild_rollups()
+        load_index()
+        load_snapshot()
+        schema_ready = True
+
+
+"""
+Method for validating an entry and converting it into a duke_outages row
+Note: Raises for anything PostgreSQL would reject, so one bad entry
+cannot fail the COPY for the whole cycle
+"""
+
+
+def outage_row(entry):
+    identifier = entry["source_event_number"]
+    if identifier is None or str(identifier).strip() == "":
+        raise ValueError("missing source_event_number")
+
+    device_lat = float(entry["device_lat"])
+    device_lon = float(entry["device_lon"])
+    if not (-90 <= device_lat <= 90 and -180 <= device_lon <= 180):
+        raise ValueError(f"coordinates out of range: {device_lat}, {device_lon}")
+
+    affected = entry["affected"]
+    if affected is not None:
+        affected = int(affected)
+        if not -2147483648 <= affected <= 2147483647:
+            raise ValueError(f"affected out of range: {affected}")
+
+    # The hull is stored compactly, with its bounding box and centroid
+    geometry, bounds = hull_geometry(entry["convex_hull"], device_lat, device_lon)
+
+    return (
+        str(identifier),
+        device_lat,
+        device_lon,
+        entry["jurisdiction"],
+        affected,
+        entry["cause"],
+        geometry,
+        *bounds,
+    )
+
+
+"""
+Method for splitting entries into valid duke_outages rows and rejects
+"""
+
+
+def validate_entries(data):
+    rows = []
+    rejects = []
+    for entry in data:
         try:
-            cur = conn.cursor()
-
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS outage_tracker (
-                    outage_identifer TEXT,
-                    device_lat DECIMAL,
-                    device_lon DECIMAL,
-                    block_fips DECIMAL,
-                    convex_hull JSONB,
-                    jurisdiction TEXT,
-                    origin TEXT,
-                    state TEXT,
-                    county TEXT,
-                    affected INTEGER,
-                    cause TEXT,
-                    outage_start_estimate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    outage_end_estimate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    fix_duration_estimate TEXT,
-                    outage_restored BOOLEAN
-                )
-            """)
-
-            for entry in data:
-                try:
-
-                    # Check if the entry already exists in the tracker table based on source_event_number
-                    cur.execute("""
-                        SELECT COUNT(*) FROM outage_tracker
-                        WHERE outage_identifer = %(source_event_number)s
-                    """, entry)
-                    count = cur.fetchone()[0]
-
-                    if count == 0:
-                        additional_data = hit_fcc(entry) or {}
-
-                        # Merge the additional data into the entry dictionary
-                        entry['block_fips'] = additional_data['block_fips'] if 'block_fips' in additional_data else None
-                        entry['state'] = additional_data['state']
-                        entry['county'] = additional_data['county']
-
-                        # entry['fips'] = additional_data['fips']
-                        # entry['tract'] = additional_data['tract']
-
-                        entry['outage_restored'] = False
-
-                        cur.execute("""
-                            INSERT INTO outage_tracker (
-                                outage_identifer,
-                                device_lat,
-                                device_lon,
-                                block_fips,
-                                convex_hull,
-                                jurisdiction,
-                                origin,
-                                state,
-                                county,
-                                affected,
-                                cause,
-                                outage_restored
-                            )
-                            VALUES (
-                                %(source_event_number)s,
-                                %(device_lat)s,
-                                %(device_lon)s,
-                                %(block_fips)s,
-                                %(convex_hull)s,
-                                %(jurisdiction)s,
-                                %(origin)s,
-                                %(state)s,
-                                %(county)s,
-                                %(affected)s,
-                                %(cause)s,
-                                %(outage_restored)s
-                            )
-                        """, entry)
-                except Exception as e:
-                    print(f"Error inserting entry: {entry}")
-                    print(f"Error message: {str(e)}")
-                    conn.rollback()
-
-            conn.commit()
-        except Exception as e:
-            print(f"Error executing database operations: {str(e)}")
-            conn.rollback()
-        finally:
-            cur.close()
+            rows.append((entry, outage_row(entry)))
+        except (KeyError, TypeError, ValueError) as e:
+            rejects.append((entry, str(e)))
 
-    except Exception as e:
-        print(f"Error connecting to the database: {str(e)}")
+    return rows, rejects
 
 
 """
-Method for updating the outage_tracker table
+Method for appending rejected entries to the reject report
 """
 
 
-def update_tracker(data):
-    try:
-        current_datetime = datetime.now()
-        formatted_datetime = current_datetime.strftime("%Y-%m-%d %H:%M:%S.%f")
+def report_rejects(table, rejects):
+    if not rejects:
+        return
+
+    rejected_at = datetime.now().isoformat()
+    with open(reject_file, "a") as f:
+        for entry, error in rejects:
+            f.write(json.dumps({
+                "table": table,
+                "rejected_at": rejected_at,
+                "error": error,
+                "entry": entry,
+            }, default=str) + "\n")
+
+    print(f"Rejected {len(rejects)} {table} entries, see {reject_file}")
+
+
+"""
+Method for saving outage data to the duke_outages table
+Note: The storage backend merges the cycle's rows in one set-based step
+(COPY into a staging table on PostgreSQL, an executemany batch on SQLite),
+so the cost does not grow with round trips per outage. Invalid entries go
+to the reject report.
+"""
+
+
+def save_outages(data, conn=None):
+    result = {"inserted": 0, "skipped": 0, "rejected": 0}
+
+    rows, rejects = validate_entries(data)
 
-        conn = connect_db()
+    inserted = get_storage().insert_outages(outage_columns, [row for entry, row in rows], conn)
+
+    result["inserted"] = inserted
+    result["skipped"] = len(rows) - inserted
+    result["rejected"] = len(rejects)
+
+    report_rejects("duke_outages", rejects)
+    print(f"duke_outages: {result}")
+    for outcome, count in result.items():
+        dukemetrics.rows_total.inc(count, table="duke_outages", result=outcome)
+
+    return result
+
+
+"""
+Method for geocoding the entries that are new to the outage_tracker table
+Note: Entries that fail to geocode are left out and retried next cycle
+"""
+
+
+def geocode_entries(entries):
+    if geocoder == "offline":
+        dukemetrics.geocode_calls_total.inc(len(entries), source="offline")
+        return list(zip(entries, get_resolver().resolve_batch(entries)))
+
+    geocoded = []
+    for entry in entries:
         try:
-            cur = conn.cursor()
-
-            cur.execute("""
-                SELECT outage_identifer FROM outage_tracker
-            """)
-            tracker_identifers = [row[0] for row in cur.fetchall()]
-
-            """
-            Mark entries as outage_restored if they are no longer
-            in the data from Duke Power API, and update the 'ended_estimate'
-            with the current time and 'fix_duration_estimate' field
-            based on the difference between the 'start_estimate' field
-            and current time
-            """
-            for event_number in tracker_identifers:
-                try:
-                    if event_number not in [entry['source_event_number'] for entry in data]:
-
-                        cur.execute("""
-                            SELECT outage_start_estimate
-                            FROM outage_tracker
-                            WHERE outage_identifer = %(outage_identifer)s
-                        """, {'outage_identifer': event_number})
-                        start_estimate = cur.fetchone()[0]
-
-                        formatted_datetime = datetime.now()
-
-                        duration = formatted_datetime - start_estimate
-                        """
-                        better to be number of seconds to be calculated from ended - started
-                        """
-                        # Convert the duration to days, hours, minutes, and seconds
-                        days = duration.days
-                        hours = duration.seconds // 3600
-                        minutes = (duration.seconds // 60) % 60
-                        seconds = duration.seconds % 60
-
-                        fix_duration_estimate = f"{days}d {hours}h {minutes}m {seconds}s"
-
-                        cur.execute("""
-                            UPDATE outage_tracker
-                            SET
-                                outage_restored = true,
-                                outage_end_estimate = CASE
-                                    WHEN outage_restored = false THEN %(outage_end_estimate)s
-                                    ELSE outage_end_estimate
-                                END,
-                                fix_duration_estimate = CASE
-                                    WHEN outage_restored = false THEN %(fix_duration_estimate)s
-                                    ELSE fix_duration_estimate
-                                END
-                            WHERE outage_identifer = %(outage_identifer)s
-                        """, {
-                            'outage_end_estimate': formatted_datetime,
-                            'outage_identifer': event_number,
-                            'fix_duration_estimate': fix_duration_estimate
-                        })
-                except Exception as e:
-                    print(
-                        f"Error in update_tracker method - Marking outage as restored: {event_number}")
-                    print(f"Error message: {str(e)}")
-                    conn.rollback()
-
-            conn.commit()
+            geocoded.append((entry, geocode(entry) or {}))
         except Exception as e:
-            print(
-                f"Error in update_tracker method - Executing database operations: {str(e)}")
-            conn.rollback()
-        finally:
-            cur.close()
-    except Exception as e:
-        print(
-            f"Error in update_tracker method - Connecting to the database: {str(e)}")
-    finally:
-        conn.close()
+            print(f"Error geocoding entry: {entry['source_event_number']}")
+            print(f"Error message: {str(e)}")
+
+    if geocache is not None:
+        print(f"Geocode cache: {geocache.summary()}")
+
+    return geocoded
 
 
 """
-Method for connecting to the database
+Method for saving outage data to the outage_tracker table
+Note: Only outages that are not tracked yet are geocoded. New outages are
+found with one anti-join against a staging table and inserted in one batch.
 """
 
 
-def connect_db():
+def save_tracker(data, conn=None, timings=None):
+    result = {"inserted": 0, "skipped": 0, "rejected": 0}
+
+    rows, rejects = validate_entries(data)
+
+    with get_storage().transaction(conn) as conn:
+        # Find the candidates that are not in the tracker table yet
+        new_identifers = get_storage().new_identifers([row[0] for entry, row in rows], conn)
+
+        new_entries = {}
+        for entry, row in rows:
+            if row[0] in new_identifers and row[0] not in new_entries:
+                new_entries[row[0]] = entry
+
+        tracker_rows = []
+        with timed(timings, "geocode"):
+            geocoded = geocode_entries(list(new_entries.values()))
+        for entry, additional_data in geocoded:
+            tracker_rows.append(tracker_row(entry, additional_data))
+
+        inserted = get_storage().insert_tracker(tracker_columns, tracker_rows, conn)
+
+    result["inserted"] = inserted
+    result["skipped"] = len(rows) - inserted
+    result["rejected"] = len(rejects)
+
+    report_rejects("outage_tracker", rejects)
+    print(f"outage_tracker: {result}")
+    for outcome, count in result.items():
+        dukemetrics.rows_total.inc(count, table="outage_tracker", result=outcome)
+
+    return result
+
+
+"""
+Method for merging an entry with its geocoded area data into an outage_tracker row
+"""
+
+
+def tracker_row(entry, additional_data):
+    identifier, device_lat, device_lon, jurisdiction, affected, cause, *geometry = outage_row(entry)
+
+    return (
+        identifier,
+        device_lat,
+        device_lon,
+        additional_data.get("block_fips"),
+        jurisdiction,
+        entry.get("origin"),
+        additional_data.get("state"),
+        additional_data.get("county"),
+        affected,
+        cause,
+        False,
+        *geometry,
+    )
+
+
+"""
+Method for updating the outage_tracker table
+Note: The identifiers in the current data are staged once, and every tracked
+outage that is still active but no longer reported is marked restored by a
+single UPDATE. The end time and 'fix_duration_seconds' are both computed by
+the database; exports format the duration from the seconds. The partial
+index on active outages keeps the cost proportional to the active outages
+rather than the table's history.
+"""
+
+
+def update_tracker(data, conn=None):
+    return mark_restored(
+        {entry['source_event_number'] for entry in data if entry['source_event_number'] is not None}, conn)
+
+
+"""
+Method for marking every active outage missing from the current identifiers as restored
+Note: Needs the identifiers of the whole cycle, not a single batch; with
+jurisdictions, only the outages of those jurisdictions are considered
+"""
+
+
+def mark_restored(current_identifers, conn=None, jurisdictions=None):
+    restored = get_storage().mark_restored(current_identifers, conn, jurisdictions)
+
+    print(f"outage_tracker: {restored} outages marked as restored")
+
+    return restored
+
+
+"""
+Method for grouping a stream of entries into lists of at most batch_size entries
+"""
+
+
+def batched(entries, batch_size):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+"""
+Method for timing a stage of the cycle, accumulating across batches
+Note: The totals are reported to the stage latency histogram once per cycle
+"""
+
+
+@contextmanager
+def timed(timings, stage):
+    started = time.perf_counter()
     try:
-        conn = psycopg2.connect(config("REMOTE_DB_SERVICE"))
-    except Exception as e:
-        print(f"Error connecting to the database: {str(e)}")
+        yield
     finally:
-        return conn
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+"""
+Method for running the save, update and snapshot steps over a stream of entries
+Note: Entries are written in fixed-size batches, and only the identifiers of
+the cycle are kept in memory for the restoration and snapshot bookkeeping.
+In streaming mode the time spent waiting on the Duke API is counted as 'fetch'.
+With jurisdictions, restoration, snapshot closing and the pruning of the
+in-memory index and snapshot are limited to them, so the outages of workers
+leasing other jurisdictions are left alone.
+"""
+
+
+def run_pipeline(entries, conn, timings, jurisdictions=None):
+    captured_at = capture_time(conn)
+    current_identifers = set()
+    reported = {}
+    changed = 0
+
+    batches = batched(entries, stream_batch_size)
+    while True:
+        with timed(timings, "fetch"):
+            batch = next(batches, None)
+        if batch is None:
+            break
+
+        # Save outage data to the tables
+        with timed(timings, "save_outages"):
+            save_outages(batch, conn)
+        with timed(timings, "save_tracker"):
+            save_tracker(batch, conn, timings)
+
+        # Append the outages that changed since the last cycle to the snapshot series
+        with timed(timings, "record_snapshots"):
+            changed += record_snapshots(batch, captured_at, conn)
+
+        # Collect what this batch moves in the county and state totals
+        rollup_changes(batch, reported)
+
+        # Stage the moved and changed outages for the spatial index, applied on commit
+        if spatial_index:
+            with timed(timings, "spatial_index"):
+                active_index.stage(batch)
+        with timed(timings, "read_api"):
+            live_snapshot.stage(batch)
+
+        current_identifers.update(
+            entry['source_event_number'] for entry in batch if entry['source_event_number'] is not None)
+
+    # Update tracker table
+    with timed(timings, "update_tracker"):
+        mark_restored(current_identifers, conn, jurisdictions)
+
+    with timed(timings, "close_snapshots"):
+        closed = close_snapshots(current_identifers, captured_at, conn, jurisdictions)
+
+    # Move the county and state totals last, as other workers wait on them until this commits
+    with timed(timings, "rollups"):
+        apply_rollups(reported, captured_at, conn)
+        remove_restored_rollups(captured_at, conn)
+
+    if spatial_index:
+        active_index.stage_current(current_identifers, jurisdictions)
+    live_snapshot.stage_current(current_identifers, jurisdictions)
+    print(f"outage_snapshots: {changed} changed, {closed} closed")
+
+    # Other workers' outages are only in the tables, so with jurisdictions the gauge counts those
+    dukemetrics.active_outages.set(
+        len(current_identifers) if jurisdictions is None else get_storage().count_active(conn))
+
+    return {"changed": changed, "closed": closed, "active": len(current_identifers)}
+
+
+"""
+Method for reporting a finished cycle's stage timings and outcome to the metrics
+"""
+
+
+def report_cycle(timings, outcome):
+    for stage, seconds in timings.items():
+        dukemetrics.stage_seconds.observe(seconds, stage=stage)
+    dukemetrics.cycles_total.inc(result=outcome)
 
 
 """
 Main method for running all the methods
+Note: The save and update steps run as one pipeline in a single transaction,
+so a failed cycle leaves the tables exactly as the previous cycle left them.
+In streaming mode the Duke payloads are parsed as they download and flow
+through the pipeline batch by batch, so memory stays flat during storms.
+In buffered mode a cycle where no jurisdiction's payload changed skips the
+pipeline. With INGEST_LEASES only the jurisdictions leased to this worker
+are ingested. Returns the seconds spent in each stage, whether the cycle was
+skipped, and how many active outages changed or closed.
 """
 
 
-def main(headers, cookies):
-    # Create tables if they don't exist
-    create_tables()
+def main(headers=None, cookies=None):
+    timings = {}
 
-    # Fetch outage data from Duke Power API
-    data = hit_duke(jurisdictions, headers, cookies)
+    # Create tables if they don't exist, once per process
+    init_db()
 
-    # Save outage data to the tables
-    save_outages(data)
-    save_tracker(data)
+    owned = jurisdictions
+    if ingest_leases:
+        with timed(timings, "leases"):
+            owned = leases.assign(jurisdictions)
+        poll_state.retain(owned)
+        if not owned:
+            print("No jurisdictions leased to this worker, skipping the cycle")
+            report_cycle(timings, "skipped")
+            return {"timings": timings, "skipped": True, "changed": 0, "closed": 0, "active": 0}
 
-    # # Update tracker table
-    update_tracker(data)
+    try:
+        # Fetch outage data from Duke Power API
+        poll_state.begin()
+        active_index.begin()
+        live_snapshot.begin()
+        with timed(timings, "fetch"):
+            if streaming:
+                entries = stream_duke(owned, headers, cookies)
+            else:
+                entries = hit_duke(owned, headers, cookies)
+
+        if not streaming and conditional_polling and not poll_state.any_changed():
+            print("Duke payloads unchanged since the last cycle, skipping the pipeline")
+            poll_state.commit()
+            report_cycle(timings, "skipped")
+            return {"timings": timings, "skipped": True, "changed": 0, "closed": 0, "active": len(entries)}
+
+        with get_storage().transaction() as conn:
+            result = run_pipeline(entries, conn, timings, owned if ingest_leases else None)
+            if ingest_leases:
+                leases.renew(conn)
+            commit_started = time.perf_counter()
+        timings["commit"] = time.perf_counter() - commit_started
+    except Exception as e:
+        poll_state.rollback()
+        active_index.rollback()
+        live_snapshot.rollback()
+        report_cycle(timings, "failed")
+        print(f"Error running the ingestion cycle: {str(e)}")
+        raise
+
+    poll_state.commit()
+    active_index.commit()
+    with timed(timings, "read_api"):
+        live_snapshot.commit()
+    report_cycle(timings, "ok")
+
+    return dict(result, timings=timings, skipped=False)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import hashlib
+import threading
+from decouple import config
+
+"""
+Adaptive polling for the Duke outages endpoint. PollState remembers, per
+jurisdiction, the ETag/Last-Modified validators and the hash of the last
+payload that made it into the database, so unchanged payloads can be
+answered from memory (304 or identical hash) and a cycle where nothing
+changed skips the pipeline entirely. AdaptiveInterval shortens the polling
+interval when the share of changing outages rises (storm mode) and
+lengthens it again when things are quiet.
+"""
+
+min_interval = config("POLL_MIN_INTERVAL", default=120, cast=float)
+max_interval = config("POLL_MAX_INTERVAL", default=900, cast=float)
+smoothing = config("POLL_SMOOTHING", default=0.5, cast=float)
+
+# Share of active outages changing per cycle that counts as a full storm
+storm_fraction = config("POLL_STORM_FRACTION", default=0.2, cast=float)
+
+
+"""
+Per-jurisdiction validators and payload hashes
+Note: What a cycle learns is kept pending until the cycle's transaction has
+committed, so a failed cycle is never mistaken for an unchanged payload
+"""
+
+
+class PollState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.committed = {}
+        self.pending = {}
+        self.changed = set()
+
+    """
+    Method for starting a new cycle
+    """
+
+    def begin(self):
+        with self.lock:
+            self.pending = {}
+            self.changed = set()
+
+    """
+    Method for building the conditional request headers of a jurisdiction
+    """
+
+    def conditional_headers(self, jurisdiction):
+        with self.lock:
+            state = self.committed.get(jurisdiction)
+
+        headers = {}
+        if state is not None:
+            if state["etag"]:
+                headers["If-None-Match"] = state["etag"]
+            if state["last_modified"]:
+                headers["If-Modified-Since"] = state["last_modified"]
+        return headers
+
+    """
+    Method for getting the last committed entries of a jurisdiction whose
+    payload did not change, or None when the payload has to be parsed
+    """
+
+    def unchanged_entries(self, jurisdiction, response):
+        with self.lock:
+            state = self.committed.get(jurisdiction)
+        if state is None:
+            return None
+
+        if response.status_code == 304:
+            return state["entries"]
+        if hashlib.sha1(response.content).hexdigest() == state["payload_hash"]:
+            return state["entries"]
+        return None
+
+    """
+    Method for remembering the payload of a jurisdiction seen in this cycle
+    """
+
+    def record(self, jurisdiction, response, entries, changed):
+        with self.lock:
+            previous = self.committed.get(jurisdiction, {})
+            self.pending[jurisdiction] = {
+                "etag": response.headers.get("ETag") or previous.get("etag"),
+                "last_modified": response.headers.get("Last-Modified") or previous.get("last_modified"),
+                "payload_hash": (
+                    previous.get("payload_hash") if response.status_code == 304
+                    else hashlib.sha1(response.content).hexdigest()
+                ),
+                "entries": entries,
+            }
+            if changed:
+                self.changed.add(jurisdiction)
+
+    """
+    Method for checking whether any jurisdiction's payload changed this cycle
+    """
+
+    def any_changed(self):
+        with self.lock:
+            return bool(self.changed) or not self.pending
+
+    """
+    Method for keeping what this cycle learned, once its data is committed
+    """
+
+    def commit(self):
+        with self.lock:
+            self.committed.update(self.pending)
+            self.pending = {}
+
+    """
+    Method for forgetting the jurisdictions this worker no longer ingests
+    Note: Another worker may have written newer data for them meanwhile, so
+    their payloads are parsed in full once they are leased again
+    """
+
+    def retain(self, jurisdictions):
+        with self.lock:
+            self.committed = {
+                jurisdiction: state for jurisdiction, state in self.committed.items()
+                if jurisdiction in jurisdictions
+            }
+
+    """
+    Method for forgetting what a failed cycle learned
+    """
+
+    def rollback(self):
+        with self.lock:
+            self.pending = {}
+
+
+"""
+Polling interval following an exponentially weighted change rate
+"""
+
+
+class AdaptiveInterval:
+    def __init__(self, min_interval=min_interval, max_interval=max_interval,
+                 smoothing=smoothing, storm_fraction=storm_fraction):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.storm_fraction = storm_fraction
+        self.rate = 0.0
+
+    @property
+    def interval(self):
+        return self.max_interval - (self.max_interval - self.min_interval) * self.rate
+
+    """
+    Method for folding a cycle's outcome into the change rate, returning the next interval
+    """
+
+    def update(self, changed, active):
+        sample = min(1.0, changed / max(active, 1) / self.storm_fraction)
+        self.rate = self.smoothing * sample + (1 - self.smoothing) * self.rate
+        return self.interval
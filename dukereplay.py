@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import base64
+import io
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from decouple import config
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from urllib3 import HTTPResponse
+
+"""
+Record-and-replay of the HTTP traffic of the ingestion cycle. With
+HTTP_MODE = record every request sent through the shared session (Duke,
+FCC and Census) is appended with its response and timing to
+HTTP_CAPTURE_FILE as one JSON line. With HTTP_MODE = replay the session
+answers from that file instead of the network, in recorded order per URL,
+either at the recorded pace or as fast as possible, so storm-day traffic
+can be profiled offline and pipeline versions compared on identical input.
+Note: Authorization and cookie headers are never written to the capture
+"""
+
+# live, record or replay
+http_mode = config("HTTP_MODE", default="live")
+capture_file = config("HTTP_CAPTURE_FILE", default="http_capture.jsonl")
+
+# 1 replays at the recorded pace, 2 twice as fast, 0 as fast as possible
+replay_speed = config("HTTP_REPLAY_SPEED", default=0.0, cast=float)
+
+redacted_headers = {"authorization", "cookie", "set-cookie"}
+
+
+"""
+Method for building a urllib3 response around an already decoded body
+"""
+
+
+def raw_response(status, reason, headers, body):
+    headers = {
+        name: value for name, value in headers.items()
+        if name.lower() not in ("content-encoding", "content-length", "transfer-encoding")
+    }
+    headers["Content-Length"] = str(len(body))
+
+    return HTTPResponse(
+        body=io.BytesIO(body),
+        headers=headers,
+        status=status,
+        reason=reason,
+        preload_content=False,
+        decode_content=False,
+    )
+
+
+def encode_body(body):
+    try:
+        return body.decode("utf-8"), "utf-8"
+    except UnicodeDecodeError:
+        return base64.b64encode(body).decode("ascii"), "base64"
+
+
+def decode_body(capture):
+    if capture.get("body_encoding") == "base64":
+        return base64.b64decode(capture["body"])
+    return capture["body"].encode("utf-8")
+
+
+"""
+Transport adapter that sends requests to the network and appends every
+exchange to the capture file
+Note: The body is read in full before it is recorded, and the response handed
+back is rebuilt from it, so streaming readers still get a fresh raw stream
+"""
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, path=capture_file, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def send(self, request, **kwargs):
+        offset = time.time() - self.started
+        started = time.perf_counter()
+        response = super().send(request, **kwargs)
+        body = response.content
+        elapsed = time.perf_counter() - started
+
+        text, encoding = encode_body(body)
+        capture = {
+            "method": request.method,
+            "url": request.url,
+            "request_headers": {
+                name: value for name, value in request.headers.items()
+                if name.lower() not in redacted_headers
+            },
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {
+                name: value for name, value in response.headers.items()
+                if name.lower() not in redacted_headers
+            },
+            "body": text,
+            "body_encoding": encoding,
+            "offset": round(offset, 6),
+            "elapsed": round(elapsed, 6),
+        }
+
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(capture) + "\n")
+
+        recorded = self.build_response(
+            request, raw_response(response.status_code, response.reason, response.headers, body))
+        recorded.elapsed = response.elapsed
+        return recorded
+
+
+"""
+Transport adapter that answers requests from the capture file
+Note: Responses are served in recorded order per method and URL. Once a URL
+runs out, its last response is repeated, and a URL that was never recorded
+fails like an unreachable host.
+"""
+
+
+class ReplayAdapter(HTTPAdapter):
+    def __init__(self, path=capture_file, speed=replay_speed, **kwargs):
+        super().__init__(**kwargs)
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.started = None
+        self.captures = defaultdict(deque)
+        self.last = {}
+
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    capture = json.loads(line)
+                    self.captures[(capture["method"], capture["url"])].append(capture)
+
+    """
+    Method for counting the responses not served yet for URLs starting with a prefix
+    """
+
+    def remaining(self, prefix=""):
+        with self.lock:
+            return sum(len(queue) for (method, url), queue in self.captures.items() if url.startswith(prefix))
+
+    def next_capture(self, key):
+        with self.lock:
+            if self.started is None:
+                self.started = time.monotonic()
+
+            if self.captures.get(key):
+                self.last[key] = self.captures[key].popleft()
+            return self.last.get(key), self.started
+
+    def send(self, request, **kwargs):
+        capture, started = self.next_capture((request.method, request.url))
+        if capture is None:
+            raise ConnectionError(f"No recorded response for {request.method} {request.url}", request=request)
+
+        if self.speed > 0:
+            delay = started + capture["offset"] / self.speed - time.monotonic()
+            time.sleep(max(0.0, delay) + capture["elapsed"] / self.speed)
+
+        return self.build_response(
+            request, raw_response(capture["status"], capture["reason"], capture["headers"], decode_body(capture)))
+
+
+"""
+Method for building the transport adapter selected by HTTP_MODE
+"""
+
+
+def create_adapter(**kwargs):
+    if http_mode == "record":
+        return RecordingAdapter(**kwargs)
+    if http_mode == "replay":
+        return ReplayAdapter(**kwargs)
+    if http_mode != "live":
+        raise ValueError(f"Unknown HTTP_MODE: {http_mode}")
+    return HTTPAdapter(**kwargs)
+
+
+"""
+Method for running ingestion cycles until the recorded Duke responses run out
+Note: Explicit empty credentials are passed, since replayed requests are
+matched on their URL alone and must not trigger a live config fetch
+"""
+
+
+def replay():
+    import dukeoutages
+
+    if http_mode != "replay":
+        raise ValueError("Set HTTP_MODE = replay to replay a capture")
+
+    adapter = dukeoutages.session.get_adapter(dukeoutages.outages_url)
+    cycles = []
+
+    while adapter.remaining(dukeoutages.outages_url):
+        started = time.perf_counter()
+        try:
+            result = dukeoutages.main({}, {})
+        except Exception as e:
+            print(f"Error replaying cycle {len(cycles)}: {str(e)}")
+            result = {"failed": True}
+
+        result["seconds"] = time.perf_counter() - started
+        cycles.append(result)
+        print(f"Replayed cycle {len(cycles)} in {result['seconds']:.2f}s")
+
+    return cycles
+
+
+if __name__ == '__main__':
+    replay()
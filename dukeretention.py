@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os
+from datetime import timedelta
+from decouple import config
+import dukejsoner
+from dukestorage import archive_tables, get_storage, month_bounds
+
+"""
+Retention and archival of duke_outages and outage_tracker. The hot tables
+only keep what ingestion, the rollups and the read API still work on: active
+outages and the ones restored in the last ARCHIVE_AFTER_DAYS. Older rows are
+moved in batches to duke_outages_archive and outage_tracker_archive, which
+PostgreSQL partitions by month on created_at and outage_start_estimate.
+Archive months older than ARCHIVE_RETENTION_MONTHS are written to zstd
+Parquet files in ARCHIVE_DIR, and only once a file is complete is the month
+detached and dropped. Nothing is dropped until ARCHIVE_DIR is set, and it
+should point at durable storage: on an ephemeral filesystem such as a Heroku
+dyno's, the files are gone after the next restart.
+"""
+
+archive_after_days = config("ARCHIVE_AFTER_DAYS", default=30, cast=int)
+archive_retention_months = config("ARCHIVE_RETENTION_MONTHS", default=12, cast=int)
+# Unset keeps every archive month in the database
+archive_dir = config("ARCHIVE_DIR", default="")
+
+# Rows moved per transaction, so ingestion never waits long on the archiver
+archive_batch_size = config("ARCHIVE_BATCH_SIZE", default=5000, cast=int)
+
+
+"""
+Method for creating the archive tables
+"""
+
+
+def create_archive_tables(conn=None):
+    get_storage().create_archive_tables(conn)
+
+
+"""
+Method for moving the rows due for the archive out of the hot tables
+Note: outage_tracker goes first, so the first sightings of the outages it
+archives become due in the same run
+"""
+
+
+def archive_restored(now=None):
+    storage = get_storage()
+    cutoff = (now or storage.capture_time()) - timedelta(days=archive_after_days)
+
+    moved = {}
+    for table in ("outage_tracker", "duke_outages"):
+        moved[table] = 0
+        while True:
+            count = storage.archive_rows(table, cutoff, archive_batch_size)
+            moved[table] += count
+            if count < archive_batch_size:
+                break
+
+    return moved
+
+
+"""
+Method for finding the first month whose archive is still kept in the database
+"""
+
+
+def retention_start(now):
+    year, month = now.year, now.month - archive_retention_months
+    while month < 1:
+        year, month = year - 1, month + 12
+    return now.replace(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+"""
+Method for exporting the archive months past retention to Parquet and dropping them
+Note: Each file is written under a temporary name and renamed when complete,
+so a month is only ever dropped once its file exists in full
+"""
+
+
+def export_expired(now=None):
+    if not archive_dir:
+        print("Archive months past retention were kept, set ARCHIVE_DIR to export and drop them")
+        return []
+
+    storage = get_storage()
+    before = retention_start(now or storage.capture_time())
+    os.makedirs(archive_dir, exist_ok=True)
+
+    exported = []
+    for table, (archive, partition_key) in archive_tables.items():
+        for month in storage.archive_months(table, before):
+            month_start, month_end = month_bounds(month)
+            path = os.path.join(archive_dir, f"{table}_{month:%Y-%m}.parquet")
+
+            count = dukejsoner.export_columnar(
+                table,
+                f"{path}.tmp",
+                "parquet",
+                source=archive,
+                where=f"WHERE {partition_key} >= {storage.param('month_start')} "
+                      f"AND {partition_key} < {storage.param('month_end')}",
+                params={"month_start": month_start, "month_end": month_end},
+            )
+            os.replace(f"{path}.tmp", path)
+
+            storage.drop_archive_month(table, month)
+            exported.append((path, count))
+            print(f"Archived {count} {table} rows of {month:%Y-%m} to {path}")
+
+    return exported
+
+
+"""
+Method for running the whole retention job
+"""
+
+
+def run_retention():
+    create_archive_tables()
+
+    moved = archive_restored()
+    print(f"Moved to the archive: {moved}")
+
+    try:
+        exported = export_expired()
+    except ImportError as e:
+        print(f"Archive months past retention were kept, Parquet export needs pyarrow: {str(e)}")
+        exported = []
+
+    return {"moved": moved, "exported": exported}
+
+
+if __name__ == '__main__':
+    try:
+        run_retention()
+    except Exception as e:
+        print(f"Retention job failed with error: {e}")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from dukestorage import get_storage, statewide
+
+"""
+Per-county and per-state totals of active outages and affected customers,
+kept up to date by the ingestion cycle instead of being recomputed. Each
+cycle applies only the outages that are new or whose affected customers
+changed and takes the restored outages back out, adjusting the
+outage_rollups rows by their deltas. rollup_members remembers what every
+active outage contributed, so a delta never needs the full table. Reading
+the rollups is a primary-key lookup, and outpct is derived from the
+customer accounts dukereports stores next to the totals.
+"""
+
+# Duke reports states by their postal code, the FCC by their name
+state_abbreviations = {
+    "FL": "Florida",
+    "IN": "Indiana",
+    "KY": "Kentucky",
+    "NC": "North Carolina",
+    "OH": "Ohio",
+    "SC": "South Carolina",
+}
+
+
+"""
+Method for creating the outage_rollups and rollup_members tables
+"""
+
+
+def create_rollup_tables(conn=None):
+    get_storage().create_rollup_tables(conn)
+
+
+"""
+Method for recomputing the rollups from the active outages
+Note: Run once per process, so deltas always start from a consistent state
+"""
+
+
+def rebuild_rollups(updated_at=None, conn=None):
+    storage = get_storage()
+    with storage.transaction(conn) as conn:
+        storage.lock_rollups(conn)
+        storage.rebuild_rollups(updated_at or storage.capture_time(conn), conn)
+
+
+"""
+Method for collecting what a batch of reported outages changes in the rollups
+Note: Outages that are not in the outage_tracker table yet, such as ones
+that failed to geocode, are picked up by a later cycle once they are, and
+entries save_outages rejects are left out
+"""
+
+
+def rollup_changes(data, changes=None):
+    # Imported here, as dukeoutages imports this module
+    from dukeoutages import outage_row
+
+    changes = {} if changes is None else changes
+    for entry in data:
+        try:
+            identifer, device_lat, device_lon, jurisdiction, affected, *rest = outage_row(entry)
+        except (KeyError, TypeError, ValueError):
+            continue
+        changes[identifer] = affected or 0
+    return changes
+
+
+"""
+Method for applying a cycle's collected changes to the rollups
+Note: Rows shared by several workers are locked here until the cycle
+commits, so this runs once, at the end of the cycle
+"""
+
+
+def apply_rollups(changes, updated_at, conn=None):
+    storage = get_storage()
+    with storage.transaction(conn) as conn:
+        storage.lock_rollups(conn)
+        return storage.apply_rollup_changes(list(changes.items()), updated_at, conn)
+
+
+"""
+Method for taking the outages restored in this cycle out of the rollups
+"""
+
+
+def remove_restored_rollups(updated_at, conn=None):
+    return get_storage().remove_restored_rollups(updated_at, conn)
+
+
+"""
+Method for turning a state postal code into the state name used by the rollups
+"""
+
+
+def state_name(state):
+    return state_abbreviations.get(state, state)
+
+
+"""
+Method for turning a county name into the county name used by the rollups
+"""
+
+
+def county_name(county):
+    if county.endswith(" County"):
+        county = county[:-len(" County")]
+    return county
+
+
+"""
+Method for storing the customer accounts of every county, and their state-wide sums
+"""
+
+
+def save_accounts(accounts, conn=None):
+    storage = get_storage()
+
+    # Counties are matched without regard to case, and take the spelling the
+    # tracker uses, since Duke may write them all in capitals ("MCDOWELL")
+    spellings = {(state, county.lower()): county for state, county in storage.rollup_counties(conn)}
+
+    rows = {}
+    for state, county, count in accounts:
+        state, county = state_name(state), county_name(county)
+        key = (state, spellings.get((state, county.lower()), county))
+        rows[key] = rows.get(key, 0) + count
+
+    states = {}
+    for (state, county), count in rows.items():
+        states[state] = states.get(state, 0) + count
+    for state, count in states.items():
+        rows[(state, statewide)] = count
+
+    # Accounts saved earlier under another spelling of the same county are cleared
+    saved = {(state, county.lower()) for state, county in rows}
+    for state, county, outages, affected, count, updated_at in storage.read_rollups(conn=conn):
+        if (state, county) not in rows and (state, county.lower()) in saved and count is not None:
+            rows[(state, county)] = None
+
+    storage.save_accounts([(state, county, count) for (state, county), count in rows.items()], conn)
+
+
+"""
+Method for reading the rollups, with each row's share of accounts out
+"""
+
+
+def read_rollups(state=None, conn=None):
+    rollups = []
+    for state, county, outages, affected, accounts, updated_at in get_storage().read_rollups(state, conn):
+        rollups.append({
+            "state": state,
+            "county": county,
+            "outages": outages,
+            "affected": affected,
+            "accounts": accounts,
+            "outpct": round(100 * float(affected) / float(accounts), 1) if accounts else None,
+            "updated_at": updated_at,
+        })
+
+    return rollups
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import hashlib
+import json
+from datetime import timedelta
+from decouple import config
+from dukestorage import get_storage
+
+"""
+Append-only time series of outage states. Every cycle hashes the content of
+each reported outage, and only the outages whose hash differs from the last
+recorded one are appended to the outage_snapshots table (monthly-partitioned on PostgreSQL),
+so storage grows with actual change instead of outage count x poll count.
+outage_snapshot_heads keeps the latest hash of every active outage, and an
+outage that disappears gets a final 'restored' snapshot.
+"""
+
+# Seconds re-read before the last follow, so cycles of other workers that
+# committed after it with an earlier capture time are not missed
+follow_overlap = config("SNAPSHOT_FOLLOW_OVERLAP", default=900, cast=int)
+
+# Columns of the snapshots other workers' outages are followed from
+follow_columns = [
+    "outage_identifer",
+    "captured_at",
+    "jurisdiction",
+    "device_lat",
+    "device_lon",
+    "affected",
+    "cause",
+    "hull_geometry",
+    "restored",
+]
+
+snapshot_columns = [
+    "outage_identifer",
+    "captured_at",
+    "content_hash",
+    "jurisdiction",
+    "device_lat",
+    "device_lon",
+    "affected",
+    "cause",
+    "hull_geometry",
+    "restored",
+]
+
+
+"""
+Method for creating the outage_snapshots and outage_snapshot_heads tables
+"""
+
+
+def create_snapshot_tables(conn=None):
+    get_storage().create_snapshot_tables(conn)
+
+
+"""
+Method for hashing the parts of an outage that change while it is active
+"""
+
+
+def content_hash(entry):
+    content = json.dumps([
+        entry["device_lat"],
+        entry["device_lon"],
+        entry["affected"],
+        entry["cause"],
+        entry["convex_hull"],
+    ], sort_keys=True, default=str)
+
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+"""
+Method for reading the database clock once, so a whole cycle shares one capture time
+"""
+
+
+def capture_time(conn=None):
+    return get_storage().capture_time(conn)
+
+
+"""
+Method for appending a snapshot for every outage whose content changed
+Note: Only identifiers and hashes are compared in the database; the full
+rows are copied for the changed outages alone. Entries are validated like
+the duke_outages rows, so one bad entry cannot fail the COPY for the whole cycle
+"""
+
+
+def record_snapshots(data, captured_at, conn=None):
+    # Imported here, as dukeoutages imports this module
+    from dukeoutages import outage_row
+
+    rows = {}
+    for entry in data:
+        try:
+            row = outage_row(entry)
+            rows[row[0]] = (row, content_hash(entry))
+        except (KeyError, TypeError, ValueError):
+            # Rejected entries are already in the reject report of save_outages
+            continue
+
+    with get_storage().transaction(conn) as conn:
+        changed = get_storage().changed_snapshots(
+            [(identifer, digest) for identifer, (row, digest) in rows.items()], conn)
+
+        if changed:
+            get_storage().append_snapshots(snapshot_columns, [
+                (
+                    identifer,
+                    captured_at,
+                    rows[identifer][1],
+                    rows[identifer][0][3],
+                    rows[identifer][0][1],
+                    rows[identifer][0][2],
+                    rows[identifer][0][4],
+                    rows[identifer][0][5],
+                    rows[identifer][0][6],
+                    False,
+                )
+                for identifer in changed
+            ], captured_at, conn)
+
+    return len(changed)
+
+
+"""
+Method for closing the series of every outage that is no longer reported
+Note: Needs the identifiers of the whole cycle, not a single batch; with
+jurisdictions, only the outages of those jurisdictions are closed
+"""
+
+
+def close_snapshots(current_identifers, captured_at, conn=None, jurisdictions=None):
+    return get_storage().close_snapshots(
+        {str(identifer) for identifer in current_identifers}, captured_at, conn, jurisdictions)
+
+
+"""
+Method for reading the affected customers of an outage over time
+"""
+
+
+def snapshot_history(outage_identifer, since=None, conn=None):
+    return get_storage().snapshot_history(outage_identifer, since, conn)
+
+
+"""
+Method for reading the latest snapshot of every outage captured since a time
+Note: Without a time, the latest snapshot of every active outage is read
+"""
+
+
+def latest_snapshots(since=None):
+    storage = get_storage()
+    columns = [f"s.{column}" for column in follow_columns]
+    if since is None:
+        rows = storage.stream_rows(
+            "outage_snapshot_heads h JOIN outage_snapshots s "
+            "ON s.outage_identifer = h.outage_identifer AND s.captured_at = h.captured_at",
+            columns,
+        )
+    else:
+        rows = storage.stream_rows(
+            "outage_snapshots s",
+            columns,
+            where=f"WHERE s.captured_at >= {storage.param('since')} ORDER BY s.captured_at",
+            params={"since": since},
+        )
+
+    latest = {}
+    for row in rows:
+        snapshot = dict(zip(follow_columns, row))
+        latest[snapshot["outage_identifer"]] = snapshot
+    return latest
+
+
+"""
+Follows the outages other workers ingest, through the snapshots they append
+Note: Every read returns the latest snapshot of the outages captured since
+the previous one, including the 'restored' snapshots of the closed outages
+"""
+
+
+class SnapshotFollower:
+    def __init__(self, overlap=follow_overlap):
+        self.overlap = overlap
+        self.watermark = None
+
+    def read(self):
+        now = capture_time()
+        since = None if self.watermark is None else self.watermark - timedelta(seconds=self.overlap)
+        latest = latest_snapshots(since)
+        self.watermark = now
+        return latest
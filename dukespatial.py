@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import heapq
+import math
+import threading
+from collections import defaultdict
+from decouple import config
+from dukegeometry import decode_hull, hull_bounds
+from dukesnapshots import SnapshotFollower
+from dukestorage import get_storage
+
+"""
+In-memory spatial index over the active outages, for bounding-box, radius
+and nearest-neighbour queries that never touch the database. A uniform grid
+keeps every outage's device location in one cell and its hull bounding box
+in every cell it overlaps. It is loaded once from the active outage_tracker
+rows, and each ingestion cycle then stages only the outages whose location,
+bounds or attributes changed, plus the set of outages still reported, and
+applies them when the cycle's transaction commits. With INGEST_LEASES the
+outages of the jurisdictions other workers lease follow the snapshots those
+workers append.
+Note: Longitudes are not wrapped at the antimeridian, which Duke's
+territories never come near
+"""
+
+spatial_index = config("SPATIAL_INDEX", default=True, cast=bool)
+
+# Grid cell size in degrees, about 5 km at the latitudes Duke serves
+spatial_cell_size = config("SPATIAL_CELL_SIZE", default=0.05, cast=float)
+
+earth_radius_km = 6371.0088
+
+# Columns of the active outage_tracker rows the index is loaded from
+index_columns = [
+    "outage_identifer",
+    "device_lat",
+    "device_lon",
+    "jurisdiction",
+    "affected",
+    "cause",
+    "min_lat",
+    "min_lon",
+    "max_lat",
+    "max_lon",
+    "centroid_lat",
+    "centroid_lon",
+]
+
+
+"""
+Method for computing the great-circle distance between two points in kilometres
+"""
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * earth_radius_km * math.asin(min(1.0, math.sqrt(a)))
+
+
+"""
+Method for turning a reported outage entry into an index record
+"""
+
+
+def entry_record(entry):
+    device_lat = float(entry["device_lat"])
+    device_lon = float(entry["device_lon"])
+    min_lat, min_lon, max_lat, max_lon, centroid_lat, centroid_lon = hull_bounds(
+        entry["convex_hull"], device_lat, device_lon)
+
+    return {
+        "outage_identifer": str(entry["source_event_number"]),
+        "device_lat": device_lat,
+        "device_lon": device_lon,
+        "jurisdiction": entry["jurisdiction"],
+        "affected": int(entry["affected"]) if entry["affected"] is not None else None,
+        "cause": entry["cause"],
+        "min_lat": min_lat,
+        "min_lon": min_lon,
+        "max_lat": max_lat,
+        "max_lon": max_lon,
+        "centroid_lat": centroid_lat,
+        "centroid_lon": centroid_lon,
+    }
+
+
+"""
+Method for turning the latest snapshot of an active outage into an index record
+"""
+
+
+def snapshot_record(snapshot):
+    return entry_record({
+        "source_event_number": snapshot["outage_identifer"],
+        "device_lat": snapshot["device_lat"],
+        "device_lon": snapshot["device_lon"],
+        "jurisdiction": snapshot["jurisdiction"],
+        "affected": snapshot["affected"],
+        "cause": snapshot["cause"],
+        "convex_hull": decode_hull(snapshot["hull_geometry"]),
+    })
+
+
+"""
+Method for turning an active outage_tracker row into an index record
+Note: Rows without stored bounds are bounded by their device location
+"""
+
+
+def row_record(row):
+    record = dict(zip(index_columns, row))
+    record["device_lat"] = float(record["device_lat"])
+    record["device_lon"] = float(record["device_lon"])
+    if record["min_lat"] is None:
+        for column, value in (
+            ("min_lat", "device_lat"), ("max_lat", "device_lat"), ("centroid_lat", "device_lat"),
+            ("min_lon", "device_lon"), ("max_lon", "device_lon"), ("centroid_lon", "device_lon"),
+        ):
+            record[column] = record[value]
+    return record
+
+
+"""
+Uniform grid over the active outages. Queries and commits hold the same
+lock, so readers in other threads always see a whole cycle or none of it.
+"""
+
+
+class OutageIndex:
+    def __init__(self, cell_size=spatial_cell_size):
+        self.cell_size = cell_size
+        self.lock = threading.Lock()
+        self.outages = {}
+        self.point_cells = defaultdict(set)
+        self.bbox_cells = defaultdict(set)
+        self.pending = {}
+        self.current = None
+        self.jurisdictions = None
+        self.follower = SnapshotFollower()
+
+    def cell(self, lon, lat):
+        return (math.floor(lon / self.cell_size), math.floor(lat / self.cell_size))
+
+    def bbox_range(self, min_lat, min_lon, max_lat, max_lon):
+        min_cell = self.cell(min_lon, min_lat)
+        max_cell = self.cell(max_lon, max_lat)
+        return min_cell, max_cell
+
+    def add(self, record):
+        identifer = record["outage_identifer"]
+        self.outages[identifer] = record
+        self.point_cells[self.cell(record["device_lon"], record["device_lat"])].add(identifer)
+
+        min_cell, max_cell = self.bbox_range(record["min_lat"], record["min_lon"], record["max_lat"], record["max_lon"])
+        for cx in range(min_cell[0], max_cell[0] + 1):
+            for cy in range(min_cell[1], max_cell[1] + 1):
+                self.bbox_cells[(cx, cy)].add(identifer)
+
+    def discard(self, identifer):
+        record = self.outages.pop(identifer, None)
+        if record is None:
+            return
+
+        cell = self.cell(record["device_lon"], record["device_lat"])
+        self.point_cells[cell].discard(identifer)
+        if not self.point_cells[cell]:
+            del self.point_cells[cell]
+
+        min_cell, max_cell = self.bbox_range(record["min_lat"], record["min_lon"], record["max_lat"], record["max_lon"])
+        for cx in range(min_cell[0], max_cell[0] + 1):
+            for cy in range(min_cell[1], max_cell[1] + 1):
+                self.bbox_cells[(cx, cy)].discard(identifer)
+                if not self.bbox_cells[(cx, cy)]:
+                    del self.bbox_cells[(cx, cy)]
+
+    """
+    Method for replacing the whole index with a set of records
+    """
+
+    def load(self, records):
+        with self.lock:
+            self.outages = {}
+            self.point_cells = defaultdict(set)
+            self.bbox_cells = defaultdict(set)
+            for record in records:
+                self.add(record)
+            # The next follow starts over from the latest snapshot of every outage
+            self.follower = SnapshotFollower()
+            return len(self.outages)
+
+    def __len__(self):
+        return len(self.outages)
+
+    """
+    Method for starting a new cycle
+    """
+
+    def begin(self):
+        self.pending = {}
+        self.current = None
+        self.jurisdictions = None
+
+    """
+    Method for staging the reported outages that differ from the index
+    Note: Entries that cannot be read are left to the reject report of save_outages
+    """
+
+    def stage(self, entries):
+        for entry in entries:
+            try:
+                record = entry_record(entry)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if self.outages.get(record["outage_identifer"]) != record:
+                self.pending[record["outage_identifer"]] = record
+
+    """
+    Method for staging the identifiers of every outage still reported in this cycle
+    Note: Needs the identifiers of the whole cycle, not a single batch; with
+    jurisdictions, only the outages of those jurisdictions can be dropped
+    """
+
+    def stage_current(self, current_identifers, jurisdictions=None):
+        self.current = {str(identifer) for identifer in current_identifers}
+        self.jurisdictions = None if jurisdictions is None else set(jurisdictions)
+
+    """
+    Method for reading what changed in the outages other workers ingest
+    Note: A failed read is retried from the same point by the next cycle
+    """
+
+    def follow(self):
+        try:
+            return self.follower.read()
+        except Exception as e:
+            print(f"Error following the outages of other workers: {str(e)}")
+            return {}
+
+    """
+    Method for applying the staged changes once the cycle's transaction has committed
+    Note: With jurisdictions, the outages of the others are updated from their snapshots
+    """
+
+    def commit(self):
+        followed = self.follow() if self.jurisdictions is not None else {}
+
+        with self.lock:
+            if self.current is not None:
+                for identifer in [
+                    identifer for identifer, record in self.outages.items()
+                    if identifer not in self.current
+                    and (self.jurisdictions is None or record["jurisdiction"] in self.jurisdictions)
+                ]:
+                    self.discard(identifer)
+
+            for identifer, record in self.pending.items():
+                self.discard(identifer)
+                self.add(record)
+
+            changes = len(self.pending)
+            for identifer, snapshot in followed.items():
+                # This cycle's own outages are already current
+                if identifer in self.current or identifer in self.pending:
+                    continue
+                if snapshot["restored"]:
+                    if identifer in self.outages:
+                        self.discard(identifer)
+                        changes += 1
+                    continue
+                if snapshot["jurisdiction"] in self.jurisdictions:
+                    continue
+                try:
+                    record = snapshot_record(snapshot)
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if self.outages.get(identifer) != record:
+                    self.discard(identifer)
+                    self.add(record)
+                    changes += 1
+
+            self.pending = {}
+            self.current = None
+            self.jurisdictions = None
+            return changes
+
+    def rollback(self):
+        self.pending = {}
+        self.current = None
+        self.jurisdictions = None
+
+    """
+    Method for finding the outages whose hull bounding box overlaps a box
+    Note: Wide boxes walk the occupied cells instead of every cell they cover
+    """
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        min_cell, max_cell = self.bbox_range(min_lat, min_lon, max_lat, max_lon)
+        span = (max_cell[0] - min_cell[0] + 1) * (max_cell[1] - min_cell[1] + 1)
+
+        with self.lock:
+            if span > len(self.bbox_cells):
+                cells = [
+                    cell for cell in self.bbox_cells
+                    if min_cell[0] <= cell[0] <= max_cell[0] and min_cell[1] <= cell[1] <= max_cell[1]
+                ]
+            else:
+                cells = [
+                    (cx, cy)
+                    for cx in range(min_cell[0], max_cell[0] + 1)
+                    for cy in range(min_cell[1], max_cell[1] + 1)
+                ]
+
+            found = set()
+            for cell in cells:
+                found.update(self.bbox_cells.get(cell, ()))
+
+            results = []
+            for identifer in found:
+                record = self.outages[identifer]
+                if (record["min_lat"] <= max_lat and record["max_lat"] >= min_lat
+                        and record["min_lon"] <= max_lon and record["max_lon"] >= min_lon):
+                    results.append(dict(record))
+            return results
+
+    """
+    Method for finding the outages whose device location is within a radius,
+    nearest first, with their distance in 'distance_km'
+    """
+
+    def query_radius(self, lat, lon, radius_km):
+        angle = radius_km / earth_radius_km
+        delta_lat = math.degrees(angle)
+
+        # Widest longitude span of the circle, or all longitudes when it reaches a pole
+        if abs(lat) + delta_lat >= 90 or math.sin(angle) >= math.cos(math.radians(lat)):
+            min_lon, max_lon = -180.0, 180.0
+        else:
+            delta_lon = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat))))
+            min_lon, max_lon = lon - delta_lon, lon + delta_lon
+
+        min_cell, max_cell = self.bbox_range(lat - delta_lat, min_lon, lat + delta_lat, max_lon)
+        span = (max_cell[0] - min_cell[0] + 1) * (max_cell[1] - min_cell[1] + 1)
+
+        with self.lock:
+            if span > len(self.point_cells):
+                cells = [
+                    cell for cell in self.point_cells
+                    if min_cell[0] <= cell[0] <= max_cell[0] and min_cell[1] <= cell[1] <= max_cell[1]
+                ]
+            else:
+                cells = [
+                    (cx, cy)
+                    for cx in range(min_cell[0], max_cell[0] + 1)
+                    for cy in range(min_cell[1], max_cell[1] + 1)
+                ]
+
+            results = []
+            for cell in cells:
+                for identifer in self.point_cells.get(cell, ()):
+                    record = self.outages[identifer]
+                    distance = haversine_km(lat, lon, record["device_lat"], record["device_lon"])
+                    if distance <= radius_km:
+                        results.append(dict(record, distance_km=distance))
+
+        results.sort(key=lambda record: record["distance_km"])
+        return results
+
+    """
+    Method for finding the k outages whose device location is nearest a point
+    Note: Rings of cells are searched outwards until no unsearched cell can
+    hold anything nearer than the k-th outage found so far
+    """
+
+    def query_nearest(self, lat, lon, k=1, max_km=None):
+        with self.lock:
+            total = len(self.outages)
+            if total == 0 or k <= 0:
+                return []
+
+            cx, cy = self.cell(lon, lat)
+            heap = []
+            seen = 0
+            ring = 0
+            while True:
+                if ring == 0:
+                    cells = [(cx, cy)]
+                else:
+                    cells = [(cx + dx, cy - ring) for dx in range(-ring, ring + 1)]
+                    cells += [(cx + dx, cy + ring) for dx in range(-ring, ring + 1)]
+                    cells += [(cx - ring, cy + dy) for dy in range(-ring + 1, ring)]
+                    cells += [(cx + ring, cy + dy) for dy in range(-ring + 1, ring)]
+
+                for cell in cells:
+                    for identifer in self.point_cells.get(cell, ()):
+                        seen += 1
+                        record = self.outages[identifer]
+                        distance = haversine_km(lat, lon, record["device_lat"], record["device_lon"])
+                        if max_km is not None and distance > max_km:
+                            continue
+                        if len(heap) < k:
+                            heapq.heappush(heap, (-distance, identifer))
+                        elif distance < -heap[0][0]:
+                            heapq.heapreplace(heap, (-distance, identifer))
+
+                if seen >= total:
+                    break
+
+                # Nearest any unsearched outage can be: the gap to the edge of
+                # the searched square, with meridians converging towards the poles
+                gap_lat = min(lat - (cy - ring) * self.cell_size, (cy + ring + 1) * self.cell_size - lat)
+                gap_lon = min(lon - (cx - ring) * self.cell_size, (cx + ring + 1) * self.cell_size - lon)
+                polewards = min(90.0, abs(lat) + (ring + 1) * self.cell_size)
+                bound = min(
+                    math.radians(gap_lat) * earth_radius_km,
+                    2 * earth_radius_km * math.asin(min(1.0, math.cos(math.radians(polewards))
+                                                        * math.sin(min(math.radians(gap_lon), math.pi) / 2))),
+                )
+
+                if len(heap) == k and -heap[0][0] <= bound:
+                    break
+                if max_km is not None and bound > max_km:
+                    break
+                ring += 1
+
+            results = [dict(self.outages[identifer], distance_km=-distance) for distance, identifer in heap]
+
+        results.sort(key=lambda record: record["distance_km"])
+        return results
+
+
+active_index = OutageIndex()
+
+
+"""
+Method for loading the index from the active outage_tracker rows
+Note: Run once per process; afterwards every cycle keeps it current
+"""
+
+
+def load_index():
+    if not spatial_index:
+        return 0
+
+    rows = get_storage().stream_rows("outage_tracker", index_columns, where="WHERE outage_restored = false")
+    return active_index.load(row_record(row) for row in rows)
+
+
+"""
+Method for finding the active outages whose hull bounding box overlaps a box
+"""
+
+
+def query_bbox(min_lat, min_lon, max_lat, max_lon):
+    return active_index.query_bbox(min_lat, min_lon, max_lat, max_lon)
+
+
+"""
+Method for finding the active outages within a radius of a point, nearest first
+"""
+
+
+def query_radius(lat, lon, radius_km):
+    return active_index.query_radius(lat, lon, radius_km)
+
+
+"""
+Method for finding the k active outages nearest a point, optionally within max_km
+"""
+
+
+def query_nearest(lat, lon, k=1, max_km=None):
+    return active_index.query_nearest(lat, lon, k, max_km)
@@ -0,0 +1,2114 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from decouple import config
+from dukedb import copy_rows, stage_table, transaction
+from psycopg2.extras import execute_values
+
+"""
+Storage backends behind the save, update, snapshot, export and report
+functions. PostgresStorage stages rows with COPY and merges them with
+set-based statements; SqliteStorage runs the same steps against a single
+SQLite file in WAL mode, with executemany batches and the same indexes, so
+small and edge deployments can ingest without a PostgreSQL server.
+STORAGE_BACKEND picks the backend and get_storage() returns the shared
+instance.
+"""
+
+storage_backend = config("STORAGE_BACKEND", default="postgres")
+
+# SQLite file, page cache size and memory-mapped I/O size
+sqlite_file = config("SQLITE_FILE", default="dukeoutages.db")
+sqlite_cache_mb = config("SQLITE_CACHE_MB", default=64, cast=int)
+sqlite_mmap_mb = config("SQLITE_MMAP_MB", default=256, cast=int)
+
+# SQLite file for the master report rows, when they should not go to STORAGE_BACKEND
+reports_sqlite_file = config("REPORTS_SQLITE_FILE", default="")
+
+storage = None
+report_storage = None
+
+report_columns = ["lastupdated", "state", "countyname", "outages", "accounts", "outpct"]
+
+# Rollup key of a tracker row 't': its state, and its county without the
+# ' County' suffix the FCC adds
+# Note: Statements using these must not take query parameters on PostgreSQL,
+# where the '%' of LIKE would be read as a placeholder
+rollup_state = "COALESCE(t.state, 'Unknown')"
+rollup_county = """COALESCE(
+    CASE WHEN t.county LIKE '% County' THEN SUBSTR(t.county, 1, LENGTH(t.county) - 7) ELSE t.county END,
+    'Unknown'
+)"""
+
+# County name of the state-wide rollup rows
+statewide = "Statewide"
+
+# Archive table of each hot table, and the timestamp its rows are partitioned on
+archive_tables = {
+    "outage_tracker": ("outage_tracker_archive", "outage_start_estimate"),
+    "duke_outages": ("duke_outages_archive", "created_at"),
+}
+
+# Rows of each hot table that are due for the archive: restored outages, and
+# first sightings of outages that are no longer active
+archive_conditions = {
+    "outage_tracker": "hot.outage_restored = true AND hot.outage_end_estimate < {cutoff}",
+    "duke_outages": """hot.created_at < {cutoff} AND NOT EXISTS (
+        SELECT 1 FROM outage_tracker active
+        WHERE active.outage_identifer = hot.outage_identifer
+        AND active.outage_restored = false
+    )""",
+}
+
+# Snapshot heads of the given jurisdictions, by the jurisdiction of their
+# latest snapshot; used when workers lease jurisdictions
+head_jurisdiction = """AND EXISTS (
+    SELECT 1 FROM outage_snapshots latest
+    WHERE latest.outage_identifer = {head}.outage_identifer
+    AND latest.captured_at = {head}.captured_at
+    AND latest.jurisdiction {jurisdictions}
+)"""
+
+# Tables whose rows were first written with the hull as JSON in convex_hull
+hull_tables = ["duke_outages", "outage_tracker"] + [archive for archive, partition_key in archive_tables.values()]
+
+
+"""
+Method for getting the first day of a month and of the month after it
+"""
+
+
+def month_bounds(moment):
+    month_start = datetime(moment.year, moment.month, 1)
+    if moment.month == 12:
+        return month_start, datetime(moment.year + 1, 1, 1)
+    return month_start, datetime(moment.year, moment.month + 1, 1)
+
+
+# Compact hull written by dukegeometry, and the bounds precomputed from it
+geometry_columns = ["hull_geometry", "min_lat", "min_lon", "max_lat", "max_lon", "centroid_lat", "centroid_lon"]
+
+
+"""
+Method for listing the column definitions of the hull and its bounds
+"""
+
+
+def geometry_ddl(blob_type, float_type):
+    return [f"hull_geometry {blob_type}"] + [f"{column} {float_type}" for column in geometry_columns[1:]]
+
+
+"""
+Method for writing the text that identifies a PostgreSQL row, for rows without an identifier
+Note: ctid alone repeats across the partitions of a table, so the
+partition's oid is part of it
+"""
+
+
+def pg_row_key(alias):
+    return f"{alias}tableoid::text || ':' || {alias}ctid::text"
+
+
+"""
+Method for getting the storage backend shared by the process
+"""
+
+
+def get_storage():
+    global storage
+    if storage is None:
+        if storage_backend == "postgres":
+            storage = PostgresStorage()
+        elif storage_backend == "sqlite":
+            storage = SqliteStorage()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {storage_backend}")
+    return storage
+
+
+"""
+Method for getting the backend the master report rows are written to
+Note: The storage backend unless REPORTS_SQLITE_FILE is set, which keeps
+the reports in a SQLite file of their own, as before the backends existed
+"""
+
+
+def get_report_storage():
+    global report_storage
+    if report_storage is None:
+        report_storage = SqliteStorage(reports_sqlite_file) if reports_sqlite_file else get_storage()
+    return report_storage
+
+
+"""
+Method for adding the state-wide rows to per-county rollup deltas
+"""
+
+
+def rollup_rows(deltas, updated_at):
+    totals = {}
+    for state, county, outages, affected in deltas:
+        for key in ((state, county), (state, statewide)):
+            current = totals.get(key, (0, 0))
+            totals[key] = (current[0] + outages, current[1] + affected)
+
+    return [
+        (state, county, outages, affected, updated_at)
+        for (state, county), (outages, affected) in totals.items()
+        if outages or affected
+    ]
+
+
+"""
+PostgreSQL backend on the shared connection pool of dukedb
+"""
+
+
+class PostgresStorage:
+    name = "postgres"
+
+    def transaction(self, conn=None):
+        return transaction(conn)
+
+    """
+    Method for writing a named query parameter
+    """
+
+    def param(self, name):
+        return f"%({name})s"
+
+    """
+    Method for creating the duke_outages and outage_tracker tables
+    """
+
+    def create_tables(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS duke_outages (
+                        outage_identifer TEXT UNIQUE,
+                        device_lat DECIMAL,
+                        device_lon DECIMAL,
+                        jurisdiction TEXT,
+                        affected INTEGER,
+                        cause TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        {", ".join(geometry_ddl("BYTEA", "DOUBLE PRECISION"))}
+                    )
+                """)
+
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS outage_tracker (
+                        outage_identifer TEXT UNIQUE,
+                        device_lat DECIMAL,
+                        device_lon DECIMAL,
+                        block_fips TEXT,
+                        jurisdiction TEXT,
+                        origin TEXT,
+                        state TEXT,
+                        county TEXT,
+                        affected INTEGER,
+                        cause TEXT,
+                        outage_start_estimate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        outage_end_estimate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        outage_restored BOOLEAN,
+                        fix_duration_seconds INTEGER,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        {", ".join(geometry_ddl("BYTEA", "DOUBLE PRECISION"))}
+                    )
+                """)
+
+                # Tables created before hull_geometry get its columns, their JSON is moved over by dukemigrations
+                for table in ("duke_outages", "outage_tracker"):
+                    cur.execute(f"""
+                        ALTER TABLE {table}
+                        {", ".join(f"ADD COLUMN IF NOT EXISTS {definition}"
+                                   for definition in geometry_ddl("BYTEA", "DOUBLE PRECISION"))}
+                    """)
+
+                cur.execute("""
+                    ALTER TABLE outage_tracker
+                    ADD COLUMN IF NOT EXISTS fix_duration_seconds INTEGER
+                """)
+
+                # Change timestamp used by dukejsoner's incremental export
+                cur.execute("""
+                    ALTER TABLE outage_tracker
+                    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                """)
+
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS outage_tracker_updated_at_idx
+                    ON outage_tracker (updated_at)
+                """)
+
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS duke_outages_created_at_idx
+                    ON duke_outages (created_at)
+                """)
+
+                # Only active outages are ever reconciled, so only they are indexed
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS outage_tracker_active_idx
+                    ON outage_tracker (outage_identifer)
+                    WHERE outage_restored = false
+                """)
+
+                # Bounding-box overlap searches over the active outages
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS outage_tracker_bbox_idx
+                    ON outage_tracker
+                    USING GIST (box(point(min_lon, min_lat), point(max_lon, max_lat)))
+                    WHERE outage_restored = false
+                """)
+            finally:
+                cur.close()
+
+    """
+    Method for locking the schema and reading the migration versions already applied
+    Note: The advisory lock is held until the transaction ends, so processes
+    starting together apply each migration once
+    """
+
+    def applied_migrations(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cur.execute("SELECT version FROM schema_migrations")
+                return {row[0] for row in cur.fetchall()}
+            finally:
+                cur.close()
+
+    def record_migration(self, version, name, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    INSERT INTO schema_migrations (version, name)
+                    VALUES (%(version)s, %(name)s)
+                """, {"version": version, "name": name})
+            finally:
+                cur.close()
+
+    """
+    Method for getting the data type of a column, None when the table or column does not exist
+    """
+
+    def column_type(self, cur, table, column):
+        cur.execute("""
+            SELECT data_type
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+            AND table_name = %(table)s
+            AND column_name = %(column)s
+        """, {"table": table, "column": column})
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    """
+    Method for listing the columns of a table
+    """
+
+    def table_columns(self, table, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    SELECT column_name
+                    FROM information_schema.columns
+                    WHERE table_schema = current_schema()
+                    AND table_name = %(table)s
+                    ORDER BY ordinal_position
+                """, {"table": table})
+                return [row[0] for row in cur.fetchall()]
+            finally:
+                cur.close()
+
+    """
+    Method for listing which of the given tables exist
+    """
+
+    def existing_tables(self, tables, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    SELECT table_name
+                    FROM information_schema.tables
+                    WHERE table_schema = current_schema()
+                    AND table_name = ANY(%(tables)s)
+                """, {"tables": list(tables)})
+                found = {row[0] for row in cur.fetchall()}
+                return [table for table in tables if table in found]
+            finally:
+                cur.close()
+
+    """
+    Method for enforcing one row per outage identifier in duke_outages and outage_tracker
+    Note: Tables created by the early save_outages and save_tracker have no
+    unique constraint; their duplicates are removed first, keeping the
+    earliest row of each outage
+    """
+
+    def unique_identifers(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                for table, first_seen in (("duke_outages", "created_at"), ("outage_tracker", "outage_start_estimate")):
+                    cur.execute("""
+                        SELECT 1
+                        FROM pg_index i
+                        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                        WHERE i.indrelid = %(table)s::regclass
+                        AND i.indisunique
+                        AND i.indnkeyatts = 1
+                        AND i.indpred IS NULL
+                        AND a.attname = 'outage_identifer'
+                    """, {"table": table})
+                    if cur.fetchone():
+                        continue
+
+                    cur.execute(f"""
+                        DELETE FROM {table}
+                        WHERE ctid IN (
+                            SELECT ctid FROM (
+                                SELECT ctid, row_number() OVER (
+                                    PARTITION BY outage_identifer ORDER BY {first_seen}, ctid
+                                ) AS position
+                                FROM {table}
+                                WHERE outage_identifer IS NOT NULL
+                            ) ranked
+                            WHERE ranked.position > 1
+                        )
+                    """)
+                    if cur.rowcount:
+                        print(f"{table}: {cur.rowcount} duplicate rows removed")
+
+                    cur.execute(f"""
+                        ALTER TABLE {table}
+                        ADD CONSTRAINT {table}_outage_identifer_key UNIQUE (outage_identifer)
+                    """)
+            finally:
+                cur.close()
+
+    """
+    Method for storing block_fips as text, with the leading zeros DECIMAL dropped
+    """
+
+    def block_fips_text(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                for table in ("outage_tracker", archive_tables["outage_tracker"][0]):
+                    if self.column_type(cur, table, "block_fips") not in ("numeric", "double precision"):
+                        continue
+                    cur.execute(f"""
+                        ALTER TABLE {table}
+                        ALTER COLUMN block_fips TYPE TEXT
+                        USING lpad(block_fips::BIGINT::TEXT, 15, '0')
+                    """)
+            finally:
+                cur.close()
+
+    """
+    Method for keeping outage durations only as 'fix_duration_seconds'
+    Note: Restored rows from before 'fix_duration_seconds' get it from their
+    start and end times before the formatted 'fix_duration_estimate' is dropped
+    """
+
+    def duration_seconds(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                for table in ("outage_tracker", archive_tables["outage_tracker"][0]):
+                    if self.column_type(cur, table, "fix_duration_estimate") is None:
+                        continue
+                    cur.execute(f"""
+                        UPDATE {table}
+                        SET fix_duration_seconds =
+                            EXTRACT(EPOCH FROM outage_end_estimate - outage_start_estimate)::INTEGER
+                        WHERE outage_restored = true
+                        AND fix_duration_seconds IS NULL
+                    """)
+                    cur.execute(f"ALTER TABLE {table} DROP COLUMN fix_duration_estimate")
+            finally:
+                cur.close()
+
+    """
+    Method for dropping the convex_hull JSON column once hull_geometry holds every hull
+    """
+
+    def drop_convex_hull(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                for table in self.existing_tables(hull_tables, conn):
+                    cur.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS convex_hull")
+            finally:
+                cur.close()
+
+    """
+    Method for refreshing the planner statistics of the hot tables
+    """
+
+    def optimize(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("ANALYZE duke_outages, outage_tracker")
+            finally:
+                cur.close()
+
+    """
+    Method for reading the database clock once, so a whole cycle shares one capture time
+    """
+
+    def capture_time(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT LOCALTIMESTAMP")
+                return cur.fetchone()[0]
+            finally:
+                cur.close()
+
+    """
+    Method for inserting the duke_outages rows that are not stored yet
+    Note: The rows are streamed into a temporary staging table with COPY and
+    merged with a single INSERT, so the cost is a handful of round trips
+    regardless of the number of outages
+    """
+
+    def insert_outages(self, columns, rows, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                # Staged with the table's own column types, so the two cannot disagree
+                stage_table(cur, "duke_outages_stage", "LIKE duke_outages")
+                copy_rows(cur, "duke_outages_stage", columns, rows)
+
+                cur.execute(f"""
+                    INSERT INTO duke_outages ({', '.join(columns)})
+                    SELECT DISTINCT ON (stage.outage_identifer)
+                        {', '.join(f'stage.{column}' for column in columns)}
+                    FROM duke_outages_stage stage
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM duke_outages existing
+                        WHERE existing.outage_identifer = stage.outage_identifer
+                    )
+                    ON CONFLICT DO NOTHING
+                """)
+                return cur.rowcount
+            finally:
+                cur.close()
+
+    """
+    Method for finding the identifiers that are not in the outage_tracker table yet
+    """
+
+    def new_identifers(self, identifers, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                stage_table(cur, "tracker_candidates", "outage_identifer TEXT")
+                copy_rows(cur, "tracker_candidates", ["outage_identifer"],
+                          [(identifer,) for identifer in identifers])
+
+                cur.execute("""
+                    SELECT DISTINCT candidate.outage_identifer
+                    FROM tracker_candidates candidate
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM outage_tracker tracker
+                        WHERE tracker.outage_identifer = candidate.outage_identifer
+                    )
+                """)
+                return {row[0] for row in cur.fetchall()}
+            finally:
+                cur.close()
+
+    """
+    Method for inserting new outage_tracker rows with a single COPY
+    """
+
+    def insert_tracker(self, columns, rows, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                stage_table(cur, "outage_tracker_stage", "LIKE outage_tracker")
+                copy_rows(cur, "outage_tracker_stage", columns, rows)
+
+                cur.execute(f"""
+                    INSERT INTO outage_tracker ({', '.join(columns)})
+                    SELECT {', '.join(columns)}
+                    FROM outage_tracker_stage
+                    ON CONFLICT DO NOTHING
+                """)
+                return cur.rowcount
+            finally:
+                cur.close()
+
+    """
+    Method for marking every active outage missing from the current identifiers as restored
+    Note: The end time and 'fix_duration_seconds' are computed by the database,
+    and the partial index on active outages keeps the cost proportional to the
+    active outages
+    """
+
+    def mark_restored(self, current_identifers, conn=None, jurisdictions=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                stage_table(cur, "current_outages", "outage_identifer TEXT PRIMARY KEY")
+                copy_rows(cur, "current_outages", ["outage_identifer"],
+                          [(identifer,) for identifer in current_identifers])
+                cur.execute("ANALYZE current_outages")
+
+                cur.execute(f"""
+                    UPDATE outage_tracker tracker
+                    SET
+                        outage_restored = true,
+                        outage_end_estimate = LOCALTIMESTAMP,
+                        fix_duration_seconds =
+                            EXTRACT(EPOCH FROM LOCALTIMESTAMP - tracker.outage_start_estimate)::INTEGER,
+                        updated_at = LOCALTIMESTAMP
+                    WHERE tracker.outage_restored = false
+                    AND NOT EXISTS (
+                        SELECT 1 FROM current_outages current
+                        WHERE current.outage_identifer = tracker.outage_identifer
+                    )
+                    {"" if jurisdictions is None else "AND tracker.jurisdiction = ANY(%(jurisdictions)s)"}
+                """, {"jurisdictions": list(jurisdictions or [])})
+                return cur.rowcount
+            finally:
+                cur.close()
+
+    """
+    Method for counting the active outages of every jurisdiction
+    """
+
+    def count_active(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT COUNT(*) FROM outage_tracker WHERE outage_restored = false")
+                return cur.fetchone()[0]
+            finally:
+                cur.close()
+
+    """
+    Method for creating the outage_snapshots and outage_snapshot_heads tables
+    """
+
+    def create_snapshot_tables(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS outage_snapshots (
+                        outage_identifer TEXT NOT NULL,
+                        captured_at TIMESTAMP NOT NULL,
+                        content_hash TEXT NOT NULL,
+                        jurisdiction TEXT,
+                        device_lat DECIMAL,
+                        device_lon DECIMAL,
+                        affected INTEGER,
+                        cause TEXT,
+                        convex_hull JSONB,
+                        restored BOOLEAN DEFAULT false,
+                        hull_geometry BYTEA
+                    ) PARTITION BY RANGE (captured_at)
+                """)
+
+                cur.execute("""
+                    ALTER TABLE outage_snapshots
+                    ADD COLUMN IF NOT EXISTS hull_geometry BYTEA
+                """)
+
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS outage_snapshots_event_idx
+                    ON outage_snapshots (outage_identifer, captured_at)
+                """)
+
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS outage_snapshot_heads (
+                        outage_identifer TEXT PRIMARY KEY,
+                        content_hash TEXT NOT NULL,
+                        captured_at TIMESTAMP NOT NULL
+                    )
+                """)
+            finally:
+                cur.close()
+
+    """
+    Method for making sure the monthly partition of a table holding a timestamp exists
+    """
+
+    def ensure_partition(self, cur, captured_at, table="outage_snapshots"):
+        month_start, month_end = month_bounds(captured_at)
+
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table}_{month_start:%Y%m}
+            PARTITION OF {table}
+            FOR VALUES FROM ('{month_start:%Y-%m-%d}') TO ('{month_end:%Y-%m-%d}')
+        """)
+
+    """
+    Method for finding the outages whose content hash differs from their last snapshot
+    Note: The hashes stay staged for append_snapshots in the same transaction
+    """
+
+    def changed_snapshots(self, hashes, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                stage_table(cur, "snapshot_hashes", "outage_identifer TEXT, content_hash TEXT")
+                copy_rows(cur, "snapshot_hashes", ["outage_identifer", "content_hash"], hashes)
+
+                cur.execute("""
+                    SELECT stage.outage_identifer
+                    FROM snapshot_hashes stage
+                    LEFT JOIN outage_snapshot_heads head
+                        ON head.outage_identifer = stage.outage_identifer
+                    WHERE head.content_hash IS DISTINCT FROM stage.content_hash
+                """)
+                return [row[0] for row in cur.fetchall()]
+            finally:
+                cur.close()
+
+    """
+    Method for appending snapshot rows and moving the heads to the staged hashes
+    """
+
+    def append_snapshots(self, columns, rows, captured_at, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                self.ensure_partition(cur, captured_at)
+                copy_rows(cur, "outage_snapshots", columns, rows)
+
+                cur.execute("""
+                    INSERT INTO outage_snapshot_heads (outage_identifer, content_hash, captured_at)
+                    SELECT outage_identifer, content_hash, %(captured_at)s
+                    FROM snapshot_hashes
+                    ON CONFLICT (outage_identifer) DO UPDATE
+                    SET content_hash = EXCLUDED.content_hash,
+                        captured_at = EXCLUDED.captured_at
+                    WHERE outage_snapshot_heads.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                """, {"captured_at": captured_at})
+            finally:
+                cur.close()
+
+    """
+    Method for closing the series of every outage that is no longer reported
+    """
+
+    def close_snapshots(self, current_identifers, captured_at, conn=None, jurisdictions=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                stage_table(cur, "snapshot_current", "outage_identifer TEXT PRIMARY KEY")
+                copy_rows(cur, "snapshot_current", ["outage_identifer"],
+                          [(identifer,) for identifer in current_identifers])
+
+                self.ensure_partition(cur, captured_at)
+                cur.execute(f"""
+                    WITH closed AS (
+                        DELETE FROM outage_snapshot_heads head
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM snapshot_current current
+                            WHERE current.outage_identifer = head.outage_identifer
+                        )
+                        {"" if jurisdictions is None else head_jurisdiction.format(
+                            head="head", jurisdictions="= ANY(%(jurisdictions)s)")}
+                        RETURNING head.outage_identifer
+                    )
+                    INSERT INTO outage_snapshots (outage_identifer, captured_at, content_hash, restored)
+                    SELECT outage_identifer, %(captured_at)s, 'restored', true
+                    FROM closed
+                """, {"captured_at": captured_at, "jurisdictions": list(jurisdictions or [])})
+                return cur.rowcount
+            finally:
+                cur.close()
+
+    """
+    Method for reading the affected customers of an outage over time
+    """
+
+    def snapshot_history(self, outage_identifer, since=None, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    SELECT captured_at, affected, restored
+                    FROM outage_snapshots
+                    WHERE outage_identifer = %(outage_identifer)s
+                    AND captured_at >= COALESCE(%(since)s, '-infinity'::TIMESTAMP)
+                    ORDER BY captured_at
+                """, {"outage_identifer": outage_identifer, "since": since})
+                return cur.fetchall()
+            finally:
+                cur.close()
+
+    """
+    Method for creating the monthly-partitioned archive tables of duke_outages and outage_tracker
+    Note: PostgreSQL only allows unique constraints that include the partition
+    key, so the hot tables stay unpartitioned and keep enforcing one row per
+    outage, while restored rows move to the archive
+    """
+
+    def create_archive_tables(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                for table, (archive, partition_key) in archive_tables.items():
+                    cur.execute(f"""
+                        CREATE TABLE IF NOT EXISTS {archive}
+                        (LIKE {table} INCLUDING DEFAULTS)
+                        PARTITION BY RANGE ({partition_key})
+                    """)
+
+                    # Columns the hot table gained after its archive was created
+                    cur.execute("""
+                        SELECT hot.attname, format_type(hot.atttypid, hot.atttypmod)
+                        FROM pg_attribute hot
+                        WHERE hot.attrelid = %(table)s::regclass
+                        AND hot.attnum > 0
+                        AND NOT hot.attisdropped
+                        AND NOT EXISTS (
+                            SELECT 1 FROM pg_attribute archive
+                            WHERE archive.attrelid = %(archive)s::regclass
+                            AND archive.attname = hot.attname
+                            AND NOT archive.attisdropped
+                        )
+                        ORDER BY hot.attnum
+                    """, {"table": table, "archive": archive})
+                    for column, column_type in cur.fetchall():
+                        cur.execute(f"ALTER TABLE {archive} ADD COLUMN IF NOT EXISTS {column} {column_type}")
+
+                    cur.execute(f"""
+                        CREATE INDEX IF NOT EXISTS {archive}_identifer_idx
+                        ON {archive} (outage_identifer)
+                    """)
+            finally:
+                cur.close()
+
+    """
+    Method for listing the columns a hot table and its archive share
+    """
+
+    def archive_columns(self, cur, table):
+        cur.execute("""
+            SELECT hot.column_name
+            FROM information_schema.columns hot
+            JOIN information_schema.columns archive
+                ON archive.column_name = hot.column_name
+                AND archive.table_schema = hot.table_schema
+                AND archive.table_name = %(archive)s
+            WHERE hot.table_name = %(table)s
+            AND hot.table_schema = current_schema()
+            ORDER BY hot.ordinal_position
+        """, {"table": table, "archive": archive_tables[table][0]})
+        return [row[0] for row in cur.fetchall()]
+
+    """
+    Method for moving a batch of rows due for the archive out of a hot table
+    Note: The batch is staged first, so the monthly partitions it needs can be
+    created before one DELETE ... RETURNING moves it
+    """
+
+    def archive_rows(self, table, cutoff, limit, conn=None):
+        archive, partition_key = archive_tables[table]
+
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                stage_table(cur, "archive_batch", "outage_identifer TEXT PRIMARY KEY")
+                cur.execute(f"""
+                    INSERT INTO archive_batch (outage_identifer)
+                    SELECT DISTINCT hot.outage_identifer
+                    FROM {table} hot
+                    WHERE {archive_conditions[table].format(cutoff="%(cutoff)s")}
+                    AND hot.{partition_key} IS NOT NULL
+                    LIMIT %(limit)s
+                """, {"cutoff": cutoff, "limit": limit})
+                if cur.rowcount == 0:
+                    return 0
+
+                cur.execute(f"""
+                    SELECT DISTINCT date_trunc('month', hot.{partition_key})
+                    FROM {table} hot
+                    JOIN archive_batch batch ON batch.outage_identifer = hot.outage_identifer
+                """)
+                for (month,) in cur.fetchall():
+                    self.ensure_partition(cur, month, archive)
+
+                columns = ", ".join(self.archive_columns(cur, table))
+                cur.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM {table} hot
+                        USING archive_batch batch
+                        WHERE hot.outage_identifer = batch.outage_identifer
+                        RETURNING hot.*
+                    )
+                    INSERT INTO {archive} ({columns})
+                    SELECT {columns} FROM moved
+                """)
+                return cur.rowcount
+            finally:
+                cur.close()
+
+    """
+    Method for listing the archive months of a table that start before a date
+    """
+
+    def archive_months(self, table, before, conn=None):
+        archive = archive_tables[table][0]
+
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    SELECT child.relname
+                    FROM pg_inherits
+                    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                    WHERE parent.relname = %(archive)s
+                """, {"archive": archive})
+
+                months = []
+                for (name,) in cur.fetchall():
+                    month = datetime.strptime(name[len(archive) + 1:], "%Y%m")
+                    if month < before:
+                        months.append(month)
+                return sorted(months)
+            finally:
+                cur.close()
+
+    """
+    Method for detaching and dropping a month of an archive table
+    """
+
+    def drop_archive_month(self, table, month, conn=None):
+        archive = archive_tables[table][0]
+
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(f"ALTER TABLE {archive} DETACH PARTITION {archive}_{month:%Y%m}")
+                cur.execute(f"DROP TABLE {archive}_{month:%Y%m}")
+            finally:
+                cur.close()
+
+    """
+    Method for reading a batch of rows whose hull is still stored as JSON
+    Note: Walks the unique index from the last identifier read, so each batch
+    costs the same however much of the table is already converted. Without
+    one, reads the rows that have no identifier, keyed by their row
+    """
+
+    def legacy_hulls(self, table, after, limit, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                if after is None:
+                    cur.execute(f"""
+                        SELECT {pg_row_key("")}, device_lat, device_lon, convex_hull
+                        FROM {table}
+                        WHERE outage_identifer IS NULL
+                        AND convex_hull IS NOT NULL
+                        LIMIT %(limit)s
+                    """, {"limit": limit})
+                else:
+                    cur.execute(f"""
+                        SELECT outage_identifer, device_lat, device_lon, convex_hull
+                        FROM {table}
+                        WHERE outage_identifer > %(after)s
+                        AND convex_hull IS NOT NULL
+                        ORDER BY outage_identifer
+                        LIMIT %(limit)s
+                    """, {"after": after, "limit": limit})
+                return cur.fetchall()
+            finally:
+                cur.close()
+
+    """
+    Method for storing encoded hulls and their bounds, and clearing the JSON they replace
+    Note: With by_row, the rows are matched by the keys legacy_hulls read for
+    rows without an identifier
+    """
+
+    def update_geometry(self, table, rows, conn=None, by_row=False):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                stage_table(cur, "geometry_updates", f"""
+                    row_key TEXT,
+                    {", ".join(geometry_ddl("BYTEA", "DOUBLE PRECISION"))}
+                """)
+                copy_rows(cur, "geometry_updates", ["row_key"] + geometry_columns, rows)
+
+                cur.execute(f"""
+                    UPDATE {table} target
+                    SET {', '.join(f'{column} = stage.{column}' for column in geometry_columns)},
+                        convex_hull = NULL
+                    FROM geometry_updates stage
+                    WHERE {pg_row_key("target.") if by_row else "target.outage_identifer"} = stage.row_key
+                """)
+                return cur.rowcount
+            finally:
+                cur.close()
+
+    """
+    Method for reading the tracked outages whose bounding box overlaps a box
+    """
+
+    def outages_in_bbox(self, min_lat, min_lon, max_lat, max_lon, active_only=True, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(f"""
+                    SELECT outage_identifer, state, county, affected, {', '.join(geometry_columns)}
+                    FROM outage_tracker
+                    WHERE box(point(min_lon, min_lat), point(max_lon, max_lat))
+                        && box(point(%(min_lon)s, %(min_lat)s), point(%(max_lon)s, %(max_lat)s))
+                    {"AND outage_restored = false" if active_only else ""}
+                """, {"min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon})
+                return cur.fetchall()
+            finally:
+                cur.close()
+
+    """
+    Method for creating the outage_rollups table and the rollup_members it is computed from
+    """
+
+    def create_rollup_tables(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS outage_rollups (
+                        state TEXT NOT NULL,
+                        county TEXT NOT NULL,
+                        outages INTEGER NOT NULL DEFAULT 0,
+                        affected INTEGER NOT NULL DEFAULT 0,
+                        accounts INTEGER,
+                        updated_at TIMESTAMP,
+                        PRIMARY KEY (state, county)
+                    )
+                """)
+
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS rollup_members (
+                        outage_identifer TEXT PRIMARY KEY,
+                        state TEXT NOT NULL,
+                        county TEXT NOT NULL,
+                        affected INTEGER NOT NULL
+                    )
+                """)
+            finally:
+                cur.close()
+
+    """
+    Method for adding per-county deltas, and their state-wide sums, to the rollups
+    """
+
+    def add_rollups(self, cur, deltas, updated_at):
+        rows = rollup_rows(deltas, updated_at)
+        if not rows:
+            return
+
+        execute_values(cur, """
+            INSERT INTO outage_rollups (state, county, outages, affected, updated_at)
+            VALUES %s
+            ON CONFLICT (state, county) DO UPDATE
+            SET outages = outage_rollups.outages + EXCLUDED.outages,
+                affected = outage_rollups.affected + EXCLUDED.affected,
+                updated_at = EXCLUDED.updated_at
+        """, rows)
+
+    """
+    Method for locking the rollups for the rest of the transaction
+    Note: Workers ingesting different jurisdictions still share county and
+    state rows, and would deadlock updating them in different orders
+    """
+
+    def lock_rollups(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext('outage_rollups'))")
+            finally:
+                cur.close()
+
+    """
+    Method for applying new and changed active outages to the rollups
+    Note: Only outages that are new to rollup_members or whose affected
+    customers changed produce a delta
+    """
+
+    def apply_rollup_changes(self, changes, updated_at, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                stage_table(cur, "rollup_changes", "outage_identifer TEXT PRIMARY KEY, affected INTEGER")
+                copy_rows(cur, "rollup_changes", ["outage_identifer", "affected"], changes)
+
+                cur.execute(f"""
+                    SELECT {rollup_state}, {rollup_county},
+                        SUM(CASE WHEN m.outage_identifer IS NULL THEN 1 ELSE 0 END),
+                        SUM(c.affected - COALESCE(m.affected, 0))
+                    FROM rollup_changes c
+                    JOIN outage_tracker t ON t.outage_identifer = c.outage_identifer
+                    LEFT JOIN rollup_members m ON m.outage_identifer = c.outage_identifer
+                    WHERE t.outage_restored = false
+                    AND m.affected IS DISTINCT FROM c.affected
+                    GROUP BY 1, 2
+                """)
+                deltas = cur.fetchall()
+                if not deltas:
+                    return 0
+
+                self.add_rollups(cur, deltas, updated_at)
+
+                cur.execute(f"""
+                    INSERT INTO rollup_members (outage_identifer, state, county, affected)
+                    SELECT c.outage_identifer, {rollup_state}, {rollup_county}, c.affected
+                    FROM rollup_changes c
+                    JOIN outage_tracker t ON t.outage_identifer = c.outage_identifer
+                    WHERE t.outage_restored = false
+                    ON CONFLICT (outage_identifer) DO UPDATE
+                    SET affected = EXCLUDED.affected
+                    WHERE rollup_members.affected <> EXCLUDED.affected
+                """)
+                return cur.rowcount
+            finally:
+                cur.close()
+
+    """
+    Method for taking the outages restored this cycle out of the rollups
+    """
+
+    def remove_restored_rollups(self, updated_at, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                # Probing the partial index of active outages keeps this
+                # proportional to the members rather than the tracker's history
+                cur.execute("""
+                    DELETE FROM rollup_members m
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM outage_tracker t
+                        WHERE t.outage_identifer = m.outage_identifer
+                        AND t.outage_restored = false
+                    )
+                    RETURNING m.state, m.county, m.affected
+                """)
+                restored = cur.fetchall()
+
+                deltas = {}
+                for state, county, affected in restored:
+                    outages, total = deltas.get((state, county), (0, 0))
+                    deltas[(state, county)] = (outages - 1, total - affected)
+                self.add_rollups(cur, [key + value for key, value in deltas.items()], updated_at)
+
+                return len(restored)
+            finally:
+                cur.close()
+
+    """
+    Method for recomputing rollup_members and the rollups from the active outages
+    Note: The affected customers come from each outage's latest snapshot
+    """
+
+    def rebuild_rollups(self, updated_at, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("TRUNCATE rollup_members")
+                cur.execute(f"""
+                    INSERT INTO rollup_members (outage_identifer, state, county, affected)
+                    SELECT t.outage_identifer, {rollup_state}, {rollup_county},
+                        COALESCE(s.affected, t.affected, 0)
+                    FROM outage_tracker t
+                    LEFT JOIN outage_snapshot_heads h ON h.outage_identifer = t.outage_identifer
+                    LEFT JOIN outage_snapshots s
+                        ON s.outage_identifer = h.outage_identifer
+                        AND s.captured_at = h.captured_at
+                    WHERE t.outage_restored = false
+                """)
+
+                cur.execute("UPDATE outage_rollups SET outages = 0, affected = 0")
+                cur.execute("""
+                    SELECT state, county, COUNT(*), SUM(affected)
+                    FROM rollup_members
+                    GROUP BY state, county
+                """)
+                self.add_rollups(cur, cur.fetchall(), updated_at)
+            finally:
+                cur.close()
+
+    """
+    Method for listing the state and county of every rollup key the tracker has produced
+    """
+
+    def rollup_counties(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(f"SELECT DISTINCT {rollup_state}, {rollup_county} FROM outage_tracker t")
+                return cur.fetchall()
+            finally:
+                cur.close()
+
+    """
+    Method for setting the customer accounts of counties and states
+    """
+
+    def save_accounts(self, accounts, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                execute_values(cur, """
+                    INSERT INTO outage_rollups (state, county, accounts)
+                    VALUES %s
+                    ON CONFLICT (state, county) DO UPDATE
+                    SET accounts = EXCLUDED.accounts
+                """, accounts)
+            finally:
+                cur.close()
+
+    """
+    Method for reading the rollups, optionally of a single state
+    """
+
+    def read_rollups(self, state=None, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    SELECT state, county, outages, affected, accounts, updated_at
+                    FROM outage_rollups
+                    WHERE %(state)s IS NULL OR state = %(state)s
+                    ORDER BY state, county = %(statewide)s, county
+                """, {"state": state, "statewide": statewide})
+                return cur.fetchall()
+            finally:
+                cur.close()
+
+    """
+    Method for creating the ingestion_leases table workers coordinate through
+    """
+
+    def create_lease_table(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS ingestion_leases (
+                        name TEXT PRIMARY KEY,
+                        worker TEXT NOT NULL,
+                        expires_at TIMESTAMP NOT NULL
+                    )
+                """)
+            finally:
+                cur.close()
+
+    """
+    Method for locking the leases for the rest of the transaction and reading them
+    Note: A transaction-level advisory lock, so workers assigning jurisdictions
+    at the same moment take turns without holding a session on the pool
+    """
+
+    def read_leases(self, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext('ingestion_leases'))")
+                cur.execute("SELECT name, worker, expires_at FROM ingestion_leases")
+                return cur.fetchall()
+            finally:
+                cur.close()
+
+    """
+    Method for taking or renewing leases, returning the names now held by the worker
+    Note: A lease held by another worker is only taken once it has expired
+    """
+
+    def take_leases(self, names, worker, expires_at, now, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    INSERT INTO ingestion_leases (name, worker, expires_at)
+                    SELECT name, %(worker)s, %(expires_at)s
+                    FROM unnest(%(names)s::TEXT[]) AS name
+                    ON CONFLICT (name) DO UPDATE
+                    SET worker = EXCLUDED.worker,
+                        expires_at = EXCLUDED.expires_at
+                    WHERE ingestion_leases.worker = EXCLUDED.worker
+                    OR ingestion_leases.expires_at < %(now)s
+                    RETURNING name
+                """, {"names": list(names), "worker": worker, "expires_at": expires_at, "now": now})
+                return {row[0] for row in cur.fetchall()}
+            finally:
+                cur.close()
+
+    def release_leases(self, names, worker, conn=None):
+        with transaction(conn) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    DELETE FROM ingestion_leases
+                    WHERE name = ANY(%(names)s) AND worker = %(worker)s
+                """, {"names": list(names), "worker": worker})
+            finally:
+                cur.close()
+
+    """
+    Method for streaming the rows of a table through a named server-side cursor
+    Note: Only itersize rows are held in memory at a time
+    """
+
+    def stream_rows(self, table, columns, itersize=2000, where="", params=None):
+        with transaction() as conn:
+            cur = conn.cursor(name=f"export_{table.split()[0]}")
+            try:
+                cur.itersize = itersize
+                cur.execute(f"SELECT {', '.join(columns)} FROM {table} {where}", params)
+
+                for row in cur:
+                    yield row
+            finally:
+                cur.close()
+
+    """
+    Method for appending the county summary rows of dukereports to the master table
+    """
+
+    def save_reports(self, rows):
+        with transaction() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS master (
+                        lastupdated TEXT,
+                        state TEXT,
+                        countyname TEXT,
+                        outages INTEGER,
+                        accounts INTEGER,
+                        outpct REAL
+                    )
+                """)
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS master_county_idx
+                    ON master (state, countyname, lastupdated)
+                """)
+                copy_rows(cur, "master", report_columns, rows)
+            finally:
+                cur.close()
+
+
+"""
+Method for storing datetimes in SQLite as sortable ISO-8601 text
+"""
+
+
+def sqlite_timestamp(value):
+    return value.isoformat(" ", "milliseconds")
+
+
+# Rows come back from SQLite with the same Python types psycopg2 returns
+sqlite3.register_adapter(datetime, sqlite_timestamp)
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode("utf-8")))
+sqlite3.register_converter("JSON", lambda value: json.loads(value))
+sqlite3.register_converter("BOOLEAN", lambda value: bool(int(value)))
+
+# Current local time as stored by SqliteStorage, to the millisecond
+sqlite_now = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+
+
+"""
+SQLite backend: one connection per thread on a single WAL-mode file
+Note: Writes run in BEGIN IMMEDIATE transactions, so a cycle takes the write
+lock up front instead of failing to upgrade a read lock halfway through,
+while exports read from their own connection without blocking ingestion
+"""
+
+
+class SqliteStorage:
+    name = "sqlite"
+
+    def __init__(self, path=sqlite_file, cache_mb=sqlite_cache_mb, mmap_mb=sqlite_mmap_mb):
+        self.path = path
+        self.cache_mb = cache_mb
+        self.mmap_mb = mmap_mb
+        self.local = threading.local()
+
+    """
+    Method for opening a connection with the pragmas tuned for bulk ingestion
+    """
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_mb * 1024}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_mb * 1024 * 1024}")
+        return conn
+
+    def connection(self):
+        if getattr(self.local, "conn", None) is None:
+            self.local.conn = self.connect()
+        return self.local.conn
+
+    @contextmanager
+    def transaction(self, conn=None):
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def param(self, name):
+        return f":{name}"
+
+    """
+    Method for creating an empty temporary table, reused within a connection
+    """
+
+    def stage_table(self, conn, table, columns_sql):
+        conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} ({columns_sql})")
+        conn.execute(f"DELETE FROM {table}")
+
+    """
+    Method for adding the columns a table created by an earlier version is missing
+    """
+
+    def add_columns(self, conn, table, definitions):
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for definition in definitions:
+            if definition.split()[0] not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+
+    def create_tables(self, conn=None):
+        with self.transaction(conn) as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS duke_outages (
+                    outage_identifer TEXT UNIQUE,
+                    device_lat DECIMAL,
+                    device_lon DECIMAL,
+                    jurisdiction TEXT,
+                    affected INTEGER,
+                    cause TEXT,
+                    created_at TIMESTAMP DEFAULT ({sqlite_now}),
+                    {", ".join(geometry_ddl("BLOB", "REAL"))}
+                )
+            """)
+
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS outage_tracker (
+                    outage_identifer TEXT UNIQUE,
+                    device_lat DECIMAL,
+                    device_lon DECIMAL,
+                    block_fips TEXT,
+                    jurisdiction TEXT,
+                    origin TEXT,
+                    state TEXT,
+                    county TEXT,
+                    affected INTEGER,
+                    cause TEXT,
+                    outage_start_estimate TIMESTAMP DEFAULT ({sqlite_now}),
+                    outage_end_estimate TIMESTAMP DEFAULT ({sqlite_now}),
+                    outage_restored BOOLEAN,
+                    fix_duration_seconds INTEGER,
+                    updated_at TIMESTAMP DEFAULT ({sqlite_now}),
+                    {", ".join(geometry_ddl("BLOB", "REAL"))}
+                )
+            """)
+
+            for table in ("duke_outages", "outage_tracker"):
+                self.add_columns(conn, table, geometry_ddl("BLOB", "REAL"))
+
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS outage_tracker_updated_at_idx
+                ON outage_tracker (updated_at)
+            """)
+
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS duke_outages_created_at_idx
+                ON duke_outages (created_at)
+            """)
+
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS outage_tracker_active_idx
+                ON outage_tracker (outage_identifer)
+                WHERE outage_restored = 0
+            """)
+
+            # Covers the whole overlap test, so searches never read the table rows they skip
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS outage_tracker_bbox_idx
+                ON outage_tracker (min_lat, max_lat, min_lon, max_lon)
+                WHERE outage_restored = 0
+            """)
+
+    """
+    Method for reading the migration versions already applied
+    Note: BEGIN IMMEDIATE already serializes processes starting together
+    """
+
+    def applied_migrations(self, conn=None):
+        with self.transaction(conn) as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT ({sqlite_now})
+                )
+            """)
+            return {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+
+    def record_migration(self, version, name, conn=None):
+        with self.transaction(conn) as conn:
+            conn.execute("""
+                INSERT INTO schema_migrations (version, name)
+                VALUES (:version, :name)
+            """, {"version": version, "name": name})
+
+    def column_type(self, conn, table, column):
+        for row in conn.execute(f"PRAGMA table_info({table})"):
+            if row[1] == column:
+                return row[2].upper()
+        return None
+
+    def table_columns(self, table, conn=None):
+        with self.transaction(conn) as conn:
+            return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+    def existing_tables(self, tables, conn=None):
+        with self.transaction(conn) as conn:
+            found = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            return [table for table in tables if table in found]
+
+    """
+    Method for enforcing one row per outage identifier in duke_outages and outage_tracker
+    Note: SQLite cannot add a constraint to an existing table, so tables
+    without one get a unique index after their duplicates are removed
+    """
+
+    def unique_identifers(self, conn=None):
+        with self.transaction(conn) as conn:
+            for table, first_seen in (("duke_outages", "created_at"), ("outage_tracker", "outage_start_estimate")):
+                unique = [
+                    row[1] for row in conn.execute(f"PRAGMA index_list({table})")
+                    if row[2] and not row[4]
+                ]
+                if any(
+                    [column[2] for column in conn.execute(f"PRAGMA index_info({index})")] == ["outage_identifer"]
+                    for index in unique
+                ):
+                    continue
+
+                cur = conn.execute(f"""
+                    DELETE FROM {table}
+                    WHERE rowid IN (
+                        SELECT rowid FROM (
+                            SELECT rowid, row_number() OVER (
+                                PARTITION BY outage_identifer ORDER BY {first_seen}, rowid
+                            ) AS position
+                            FROM {table}
+                            WHERE outage_identifer IS NOT NULL
+                        )
+                        WHERE position > 1
+                    )
+                """)
+                if cur.rowcount:
+                    print(f"{table}: {cur.rowcount} duplicate rows removed")
+
+                conn.execute(f"""
+                    CREATE UNIQUE INDEX {table}_outage_identifer_key
+                    ON {table} (outage_identifer)
+                """)
+
+    """
+    Method for storing block_fips as text
+    Note: DECIMAL affinity turns numeric strings into numbers, so the column
+    is replaced rather than retyped
+    """
+
+    def block_fips_text(self, conn=None):
+        with self.transaction(conn) as conn:
+            for table in ("outage_tracker", archive_tables["outage_tracker"][0]):
+                if self.column_type(conn, table, "block_fips") in (None, "TEXT"):
+                    continue
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN block_fips_text TEXT")
+                conn.execute(f"""
+                    UPDATE {table}
+                    SET block_fips_text = CASE
+                        WHEN typeof(block_fips) IN ('integer', 'real')
+                            THEN printf('%015d', CAST(block_fips AS INTEGER))
+                        ELSE block_fips
+                    END
+                """)
+                conn.execute(f"ALTER TABLE {table} DROP COLUMN block_fips")
+                conn.execute(f"ALTER TABLE {table} RENAME COLUMN block_fips_text TO block_fips")
+
+    def duration_seconds(self, conn=None):
+        with self.transaction(conn) as conn:
+            for table in ("outage_tracker", archive_tables["outage_tracker"][0]):
+                if self.column_type(conn, table, "fix_duration_estimate") is None:
+                    continue
+                conn.execute(f"""
+                    UPDATE {table}
+                    SET fix_duration_seconds = CAST(
+                        (julianday(outage_end_estimate) - julianday(outage_start_estimate)) * 86400 AS INTEGER
+                    )
+                    WHERE outage_restored = 1
+                    AND fix_duration_seconds IS NULL
+                """)
+                conn.execute(f"ALTER TABLE {table} DROP COLUMN fix_duration_estimate")
+
+    def drop_convex_hull(self, conn=None):
+        with self.transaction(conn) as conn:
+            for table in self.existing_tables(hull_tables, conn):
+                if self.column_type(conn, table, "convex_hull") is not None:
+                    conn.execute(f"ALTER TABLE {table} DROP COLUMN convex_hull")
+
+    """
+    Method for refreshing the planner statistics of whatever changed since the last start
+    """
+
+    def optimize(self, conn=None):
+        with self.transaction(conn) as conn:
+            conn.execute("PRAGMA optimize")
+
+    def capture_time(self, conn=None):
+        now = datetime.now()
+        return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+    def insert_outages(self, columns, rows, conn=None):
+        with self.transaction(conn) as conn:
+            cur = conn.executemany(f"""
+                INSERT OR IGNORE INTO duke_outages ({', '.join(columns)})
+                VALUES ({', '.join('?' for column in columns)})
+            """, rows)
+            return cur.rowcount
+
+    def new_identifers(self, identifers, conn=None):
+        with self.transaction(conn) as conn:
+            self.stage_table(conn, "tracker_candidates", "outage_identifer TEXT PRIMARY KEY")
+            conn.executemany("INSERT OR IGNORE INTO tracker_candidates VALUES (?)",
+                             [(identifer,) for identifer in identifers])
+
+            cur = conn.execute("""
+                SELECT candidate.outage_identifer
+                FROM tracker_candidates candidate
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM outage_tracker tracker
+                    WHERE tracker.outage_identifer = candidate.outage_identifer
+                )
+            """)
+            return {row[0] for row in cur.fetchall()}
+
+    def insert_tracker(self, columns, rows, conn=None):
+        with self.transaction(conn) as conn:
+            cur = conn.executemany(f"""
+                INSERT OR IGNORE INTO outage_tracker ({', '.join(columns)})
+                VALUES ({', '.join('?' for column in columns)})
+            """, rows)
+            return cur.rowcount
+
+    def mark_restored(self, current_identifers, conn=None, jurisdictions=None):
+        elapsed = "CAST((julianday(:now) - julianday(outage_start_estimate)) * 86400 AS INTEGER)"
+
+        with self.transaction(conn) as conn:
+            self.stage_table(conn, "current_outages", "outage_identifer TEXT PRIMARY KEY")
+            conn.executemany("INSERT OR IGNORE INTO current_outages VALUES (?)",
+                             [(identifer,) for identifer in current_identifers])
+
+            cur = conn.execute(f"""
+                UPDATE outage_tracker
+                SET
+                    outage_restored = 1,
+                    outage_end_estimate = :now,
+                    fix_duration_seconds = {elapsed},
+                    updated_at = :now
+                WHERE outage_restored = 0
+                AND NOT EXISTS (
+                    SELECT 1 FROM current_outages current
+                    WHERE current.outage_identifer = outage_tracker.outage_identifer
+                )
+                {"" if jurisdictions is None else "AND jurisdiction IN (SELECT value FROM json_each(:jurisdictions))"}
+            """, {"now": self.capture_time(), "jurisdictions": json.dumps(list(jurisdictions or []))})
+            return cur.rowcount
+
+    def count_active(self, conn=None):
+        with self.transaction(conn) as conn:
+            return conn.execute("SELECT COUNT(*) FROM outage_tracker WHERE outage_restored = 0").fetchone()[0]
+
+    def create_snapshot_tables(self, conn=None):
+        with self.transaction(conn) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outage_snapshots (
+                    outage_identifer TEXT NOT NULL,
+                    captured_at TIMESTAMP NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    jurisdiction TEXT,
+                    device_lat DECIMAL,
+                    device_lon DECIMAL,
+                    affected INTEGER,
+                    cause TEXT,
+                    convex_hull JSON,
+                    restored BOOLEAN DEFAULT 0,
+                    hull_geometry BLOB
+                )
+            """)
+            self.add_columns(conn, "outage_snapshots", ["hull_geometry BLOB"])
+
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS outage_snapshots_event_idx
+                ON outage_snapshots (outage_identifer, captured_at)
+            """)
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outage_snapshot_heads (
+                    outage_identifer TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    captured_at TIMESTAMP NOT NULL
+                ) WITHOUT ROWID
+            """)
+
+    def changed_snapshots(self, hashes, conn=None):
+        with self.transaction(conn) as conn:
+            self.stage_table(conn, "snapshot_hashes", "outage_identifer TEXT PRIMARY KEY, content_hash TEXT")
+            conn.executemany("INSERT OR REPLACE INTO snapshot_hashes VALUES (?, ?)", hashes)
+
+            cur = conn.execute("""
+                SELECT stage.outage_identifer
+                FROM snapshot_hashes stage
+                LEFT JOIN outage_snapshot_heads head
+                    ON head.outage_identifer = stage.outage_identifer
+                WHERE head.content_hash IS NOT stage.content_hash
+            """)
+            return [row[0] for row in cur.fetchall()]
+
+    def append_snapshots(self, columns, rows, captured_at, conn=None):
+        with self.transaction(conn) as conn:
+            conn.executemany(f"""
+                INSERT INTO outage_snapshots ({', '.join(columns)})
+                VALUES ({', '.join('?' for column in columns)})
+            """, rows)
+
+            conn.execute("""
+                INSERT INTO outage_snapshot_heads (outage_identifer, content_hash, captured_at)
+                SELECT outage_identifer, content_hash, :captured_at
+                FROM snapshot_hashes
+                WHERE true
+                ON CONFLICT (outage_identifer) DO UPDATE
+                SET content_hash = excluded.content_hash,
+                    captured_at = excluded.captured_at
+                WHERE outage_snapshot_heads.content_hash IS NOT excluded.content_hash
+            """, {"captured_at": captured_at})
+
+    def close_snapshots(self, current_identifers, captured_at, conn=None, jurisdictions=None):
+        def scope(head):
+            if jurisdictions is None:
+                return ""
+            return head_jurisdiction.format(head=head, jurisdictions="IN (SELECT value FROM json_each(:jurisdictions))")
+
+        with self.transaction(conn) as conn:
+            self.stage_table(conn, "snapshot_current", "outage_identifer TEXT PRIMARY KEY")
+            conn.executemany("INSERT OR IGNORE INTO snapshot_current VALUES (?)",
+                             [(identifer,) for identifer in current_identifers])
+
+            params = {"captured_at": captured_at, "jurisdictions": json.dumps(list(jurisdictions or []))}
+            conn.execute(f"""
+                INSERT INTO outage_snapshots (outage_identifer, captured_at, content_hash, restored)
+                SELECT outage_identifer, :captured_at, 'restored', 1
+                FROM outage_snapshot_heads head
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM snapshot_current current
+                    WHERE current.outage_identifer = head.outage_identifer
+                )
+                {scope("head")}
+            """, params)
+
+            cur = conn.execute(f"""
+                DELETE FROM outage_snapshot_heads
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM snapshot_current current
+                    WHERE current.outage_identifer = outage_snapshot_heads.outage_identifer
+                )
+                {scope("outage_snapshot_heads")}
+            """, params)
+            return cur.rowcount
+
+    def snapshot_history(self, outage_identifer, since=None, conn=None):
+        with self.transaction(conn) as conn:
+            cur = conn.execute("""
+                SELECT captured_at, affected, restored
+                FROM outage_snapshots
+                WHERE outage_identifer = :outage_identifer
+                AND (:since IS NULL OR captured_at >= :since)
+                ORDER BY captured_at
+            """, {"outage_identifer": outage_identifer, "since": since})
+            return cur.fetchall()
+
+    """
+    Method for creating the archive tables, one per hot table with an index
+    on the timestamp their months are exported by
+    """
+
+    def create_archive_tables(self, conn=None):
+        with self.transaction(conn) as conn:
+            for table, (archive, partition_key) in archive_tables.items():
+                columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {archive} (
+                        {", ".join(f"{column[1]} {column[2]}" for column in columns)}
+                    )
+                """)
+                self.add_columns(conn, archive, [f"{column[1]} {column[2]}" for column in columns])
+
+                conn.execute(f"""
+                    CREATE INDEX IF NOT EXISTS {archive}_{partition_key}_idx
+                    ON {archive} ({partition_key})
+                """)
+
+    def archive_rows(self, table, cutoff, limit, conn=None):
+        archive, partition_key = archive_tables[table]
+
+        with self.transaction(conn) as conn:
+            self.stage_table(conn, "archive_batch", "outage_identifer TEXT PRIMARY KEY")
+            cur = conn.execute(f"""
+                INSERT OR IGNORE INTO archive_batch (outage_identifer)
+                SELECT hot.outage_identifer
+                FROM {table} hot
+                WHERE {archive_conditions[table].format(cutoff=":cutoff")}
+                AND hot.{partition_key} IS NOT NULL
+                LIMIT :limit
+            """, {"cutoff": cutoff, "limit": limit})
+            if cur.rowcount == 0:
+                return 0
+
+            columns = ", ".join(column[1] for column in conn.execute(f"PRAGMA table_info({table})"))
+            conn.execute(f"""
+                INSERT INTO {archive} ({columns})
+                SELECT {columns} FROM {table}
+                WHERE outage_identifer IN (SELECT outage_identifer FROM archive_batch)
+            """)
+            cur = conn.execute(f"""
+                DELETE FROM {table}
+                WHERE outage_identifer IN (SELECT outage_identifer FROM archive_batch)
+            """)
+            return cur.rowcount
+
+    def archive_months(self, table, before, conn=None):
+        archive, partition_key = archive_tables[table]
+
+        with self.transaction(conn) as conn:
+            rows = conn.execute(f"""
+                SELECT DISTINCT substr({partition_key}, 1, 7)
+                FROM {archive}
+                WHERE {partition_key} < :before
+            """, {"before": before}).fetchall()
+            return sorted(datetime.strptime(row[0], "%Y-%m") for row in rows if row[0])
+
+    def drop_archive_month(self, table, month, conn=None):
+        archive, partition_key = archive_tables[table]
+        month_start, month_end = month_bounds(month)
+
+        with self.transaction(conn) as conn:
+            conn.execute(f"""
+                DELETE FROM {archive}
+                WHERE {partition_key} >= :month_start AND {partition_key} < :month_end
+            """, {"month_start": month_start, "month_end": month_end})
+
+    def legacy_hulls(self, table, after, limit, conn=None):
+        with self.transaction(conn) as conn:
+            if after is None:
+                return conn.execute(f"""
+                    SELECT rowid, device_lat, device_lon, convex_hull
+                    FROM {table}
+                    WHERE outage_identifer IS NULL
+                    AND convex_hull IS NOT NULL
+                    LIMIT :limit
+                """, {"limit": limit}).fetchall()
+            return conn.execute(f"""
+                SELECT outage_identifer, device_lat, device_lon, convex_hull
+                FROM {table}
+                WHERE outage_identifer > :after
+                AND convex_hull IS NOT NULL
+                ORDER BY outage_identifer
+                LIMIT :limit
+            """, {"after": after, "limit": limit}).fetchall()
+
+    def update_geometry(self, table, rows, conn=None, by_row=False):
+        with self.transaction(conn) as conn:
+            cur = conn.executemany(f"""
+                UPDATE {table}
+                SET {', '.join(f'{column} = ?' for column in geometry_columns)},
+                    convex_hull = NULL
+                WHERE {"rowid" if by_row else "outage_identifer"} = ?
+            """, [(*row[1:], row[0]) for row in rows])
+            return cur.rowcount
+
+    def outages_in_bbox(self, min_lat, min_lon, max_lat, max_lon, active_only=True, conn=None):
+        with self.transaction(conn) as conn:
+            return conn.execute(f"""
+                SELECT outage_identifer, state, county, affected, {', '.join(geometry_columns)}
+                FROM outage_tracker
+                WHERE min_lat <= :max_lat AND max_lat >= :min_lat
+                AND min_lon <= :max_lon AND max_lon >= :min_lon
+                {"AND outage_restored = 0" if active_only else ""}
+            """, {"min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon}).fetchall()
+
+    def create_rollup_tables(self, conn=None):
+        with self.transaction(conn) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outage_rollups (
+                    state TEXT NOT NULL,
+                    county TEXT NOT NULL,
+                    outages INTEGER NOT NULL DEFAULT 0,
+                    affected INTEGER NOT NULL DEFAULT 0,
+                    accounts INTEGER,
+                    updated_at TIMESTAMP,
+                    PRIMARY KEY (state, county)
+                ) WITHOUT ROWID
+            """)
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_members (
+                    outage_identifer TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    county TEXT NOT NULL,
+                    affected INTEGER NOT NULL
+                ) WITHOUT ROWID
+            """)
+
+    def add_rollups(self, conn, deltas, updated_at):
+        conn.executemany("""
+            INSERT INTO outage_rollups (state, county, outages, affected, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (state, county) DO UPDATE
+            SET outages = outage_rollups.outages + excluded.outages,
+                affected = outage_rollups.affected + excluded.affected,
+                updated_at = excluded.updated_at
+        """, rollup_rows(deltas, updated_at))
+
+    """
+    Method for locking the rollups for the rest of the transaction
+    Note: BEGIN IMMEDIATE already serializes the writers
+    """
+
+    def lock_rollups(self, conn=None):
+        pass
+
+    def apply_rollup_changes(self, changes, updated_at, conn=None):
+        with self.transaction(conn) as conn:
+            self.stage_table(conn, "rollup_changes", "outage_identifer TEXT PRIMARY KEY, affected INTEGER")
+            conn.executemany("INSERT OR REPLACE INTO rollup_changes VALUES (?, ?)", changes)
+
+            deltas = conn.execute(f"""
+                SELECT {rollup_state}, {rollup_county},
+                    SUM(CASE WHEN m.outage_identifer IS NULL THEN 1 ELSE 0 END),
+                    SUM(c.affected - COALESCE(m.affected, 0))
+                FROM rollup_changes c
+                JOIN outage_tracker t ON t.outage_identifer = c.outage_identifer
+                LEFT JOIN rollup_members m ON m.outage_identifer = c.outage_identifer
+                WHERE t.outage_restored = 0
+                AND m.affected IS NOT c.affected
+                GROUP BY 1, 2
+            """).fetchall()
+            if not deltas:
+                return 0
+
+            self.add_rollups(conn, deltas, updated_at)
+
+            cur = conn.execute(f"""
+                INSERT INTO rollup_members (outage_identifer, state, county, affected)
+                SELECT c.outage_identifer, {rollup_state}, {rollup_county}, c.affected
+                FROM rollup_changes c
+                JOIN outage_tracker t ON t.outage_identifer = c.outage_identifer
+                WHERE t.outage_restored = 0
+                ON CONFLICT (outage_identifer) DO UPDATE
+                SET affected = excluded.affected
+                WHERE rollup_members.affected <> excluded.affected
+            """)
+            return cur.rowcount
+
+    def remove_restored_rollups(self, updated_at, conn=None):
+        restored = """
+            FROM rollup_members m
+            WHERE NOT EXISTS (
+                SELECT 1 FROM outage_tracker t
+                WHERE t.outage_identifer = m.outage_identifer
+                AND t.outage_restored = 0
+            )
+        """
+
+        with self.transaction(conn) as conn:
+            deltas = conn.execute(f"""
+                SELECT m.state, m.county, -COUNT(*), -SUM(m.affected)
+                {restored}
+                GROUP BY m.state, m.county
+            """).fetchall()
+            self.add_rollups(conn, deltas, updated_at)
+
+            cur = conn.execute(f"""
+                DELETE FROM rollup_members
+                WHERE outage_identifer IN (SELECT m.outage_identifer {restored})
+            """)
+            return cur.rowcount
+
+    def rebuild_rollups(self, updated_at, conn=None):
+        with self.transaction(conn) as conn:
+            conn.execute("DELETE FROM rollup_members")
+            conn.execute(f"""
+                INSERT INTO rollup_members (outage_identifer, state, county, affected)
+                SELECT t.outage_identifer, {rollup_state}, {rollup_county},
+                    COALESCE(s.affected, t.affected, 0)
+                FROM outage_tracker t
+                LEFT JOIN outage_snapshot_heads h ON h.outage_identifer = t.outage_identifer
+                LEFT JOIN outage_snapshots s
+                    ON s.outage_identifer = h.outage_identifer
+                    AND s.captured_at = h.captured_at
+                WHERE t.outage_restored = 0
+            """)
+
+            conn.execute("UPDATE outage_rollups SET outages = 0, affected = 0")
+            deltas = conn.execute("""
+                SELECT state, county, COUNT(*), SUM(affected)
+                FROM rollup_members
+                GROUP BY state, county
+            """).fetchall()
+            self.add_rollups(conn, deltas, updated_at)
+
+    def rollup_counties(self, conn=None):
+        conn = conn or self.connection()
+        return conn.execute(f"SELECT DISTINCT {rollup_state}, {rollup_county} FROM outage_tracker t").fetchall()
+
+    def save_accounts(self, accounts, conn=None):
+        with self.transaction(conn) as conn:
+            conn.executemany("""
+                INSERT INTO outage_rollups (state, county, accounts)
+                VALUES (?, ?, ?)
+                ON CONFLICT (state, county) DO UPDATE
+                SET accounts = excluded.accounts
+            """, accounts)
+
+    def read_rollups(self, state=None, conn=None):
+        conn = conn or self.connection()
+        return conn.execute("""
+            SELECT state, county, outages, affected, accounts, updated_at
+            FROM outage_rollups
+            WHERE :state IS NULL OR state = :state
+            ORDER BY state, county = :statewide, county
+        """, {"state": state, "statewide": statewide}).fetchall()
+
+    def create_lease_table(self, conn=None):
+        with self.transaction(conn) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingestion_leases (
+                    name TEXT PRIMARY KEY,
+                    worker TEXT NOT NULL,
+                    expires_at TIMESTAMP NOT NULL
+                )
+            """)
+
+    """
+    Method for reading the leases
+    Note: BEGIN IMMEDIATE already keeps them locked for the rest of the transaction
+    """
+
+    def read_leases(self, conn=None):
+        with self.transaction(conn) as conn:
+            return conn.execute("SELECT name, worker, expires_at FROM ingestion_leases").fetchall()
+
+    def take_leases(self, names, worker, expires_at, now, conn=None):
+        taken = set()
+        with self.transaction(conn) as conn:
+            for name in names:
+                row = conn.execute("""
+                    INSERT INTO ingestion_leases (name, worker, expires_at)
+                    VALUES (:name, :worker, :expires_at)
+                    ON CONFLICT (name) DO UPDATE
+                    SET worker = excluded.worker,
+                        expires_at = excluded.expires_at
+                    WHERE ingestion_leases.worker = excluded.worker
+                    OR ingestion_leases.expires_at < :now
+                    RETURNING name
+                """, {"name": name, "worker": worker, "expires_at": expires_at, "now": now}).fetchone()
+                if row is not None:
+                    taken.add(row[0])
+        return taken
+
+    def release_leases(self, names, worker, conn=None):
+        with self.transaction(conn) as conn:
+            conn.executemany("""
+                DELETE FROM ingestion_leases
+                WHERE name = ? AND worker = ?
+            """, [(name, worker) for name in names])
+
+    """
+    Method for streaming the rows of a table, itersize rows at a time
+    Note: A dedicated connection reads outside any write transaction
+    """
+
+    def stream_rows(self, table, columns, itersize=2000, where="", params=None):
+        conn = self.connect()
+        try:
+            cur = conn.execute(f"SELECT {', '.join(columns)} FROM {table} {where}", params or {})
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def save_reports(self, rows):
+        with self.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS master (
+                    lastupdated TEXT,
+                    state TEXT,
+                    countyname TEXT,
+                    outages INTEGER,
+                    accounts INTEGER,
+                    outpct REAL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS master_county_idx
+                ON master (state, countyname, lastupdated)
+            """)
+            conn.executemany(f"INSERT INTO master VALUES ({', '.join('?' for column in report_columns)})", rows)
@@ -1,13 +1,37 @@
+import json
 import logging
-import requests
-from dukeauth import get_auth
+import random
+import signal
+import threading
+import time
+from decouple import config
+import dukeapi
+import dukeleases
+import dukemetrics
+import dukeretention
 from dukeoutages import main
+from dukepolling import AdaptiveInterval
 
 
 """
-This script is used to schedule the decoutages script
+This script is used to schedule the dukeoutages script
 to run every 10 minutes, and log each occurrence of
 the task in the terminal.
+
+Ticks are laid on a fixed grid anchored at start-up (monotonic clock), so
+the schedule does not drift by the length of each cycle. When a cycle runs
+past the next tick, the missed ticks are either skipped until the next grid
+point or coalesced into a single immediate catch-up run. SIGTERM/SIGINT let
+the running cycle finish and then stop the loop.
+
+With POLL_ADAPTIVE enabled the interval is recomputed after every cycle
+from the share of active outages that changed: it shrinks towards
+POLL_MIN_INTERVAL during storms and grows towards POLL_MAX_INTERVAL when
+things are quiet.
+
+With INGEST_LEASES enabled several schedulers can run side by side: each
+one ingests the jurisdictions it leases (see dukeleases.py), only one of
+them runs the retention job, and a stopping scheduler hands its leases back.
 """
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -22,15 +46,136 @@ c_handler.setFormatter(c_format)
 
 logger.addHandler(c_handler)
 
-random_url = "https://en.wikipedia.org/"
+# Seconds between ticks, random delay added to each tick, and what to do
+# with ticks missed by an overrunning cycle: "skip" or "coalesce"
+interval = config("SCHEDULE_INTERVAL", default=600, cast=float)
+jitter = config("SCHEDULE_JITTER", default=0, cast=float)
+overrun_policy = config("SCHEDULE_OVERRUN", default="skip")
+# Local port of the Prometheus /metrics endpoint, 0 disables it
+metrics_port = config("METRICS_PORT", default=9108, cast=int)
+metrics_host = config("METRICS_HOST", default="127.0.0.1")
 
-r = requests.get(random_url)
+# Hours between runs of the retention job, 0 (the default) leaves it to dukeretention.py
+retention_interval = config("RETENTION_INTERVAL", default=0, cast=float)
 
-if __name__ == '__main__':
+adaptive = AdaptiveInterval() if config("POLL_ADAPTIVE", default=False, cast=bool) else None
+
+stop_event = threading.Event()
+
+
+def handle_signal(signum, frame):
+    logger.info(f"Received {signal.Signals(signum).name}, stopping after the current cycle.")
+    stop_event.set()
+
+
+def run_cycle():
+    started = time.perf_counter()
+
+    # Credentials come from dukeauth's cached provider and are only rebuilt when they expire
+    result = main()
+    timings = result["timings"]
+
+    stages = ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in timings.items())
+    if result["skipped"]:
+        logger.info(f"Outage data unchanged, cycle skipped after {time.perf_counter() - started:.2f}s ({stages})")
+    else:
+        logger.info(
+            f"Outage scripts ran successfully in {time.perf_counter() - started:.2f}s ({stages})")
+
+    return result
+
+
+def log_metrics():
+    logger.info(f"Metrics: {json.dumps(dukemetrics.summary())}")
+
+
+def run_retention():
+    started = time.perf_counter()
     try:
-        print(r.status_code)
-        logger.info("Outage scripts ran successfully.")
-    except ValueError as e:
-        print(e)
+        # With several workers, the one holding the retention lease runs the job
+        if dukeleases.ingest_leases and not dukeleases.claim("retention", retention_interval * 3600):
+            logger.info("Retention job left to the worker holding its lease.")
+            return
+
+        result = dukeretention.run_retention()
+        logger.info(
+            f"Retention job moved {result['moved']} and exported {len(result['exported'])} archive month(s) "
+            f"in {time.perf_counter() - started:.2f}s")
     except Exception as e:
-        print(e)
+        logger.exception(f"Retention job failed: {e}")
+
+
+def next_interval(result, tick_interval):
+    if adaptive is None or result is None:
+        return tick_interval
+
+    updated = adaptive.update(result["changed"] + result["closed"], result["active"])
+    if abs(updated - tick_interval) >= 1:
+        logger.info(f"Polling interval is now {updated:.0f}s (change rate {adaptive.rate:.2f}).")
+    return updated
+
+
+def next_tick_after_overrun(next_tick, now, tick_interval):
+    missed = int((now - next_tick) // tick_interval) + 1
+
+    if overrun_policy == "coalesce":
+        logger.warning(f"Cycle overran {missed} tick(s), running one catch-up cycle now.")
+        return next_tick + (missed - 1) * tick_interval
+
+    logger.warning(f"Cycle overran {missed} tick(s), skipping to the next one.")
+    return next_tick + missed * tick_interval
+
+
+def run_forever():
+    next_tick = time.monotonic()
+    next_retention = time.monotonic()
+    tick_interval = adaptive.interval if adaptive is not None else interval
+
+    while not stop_event.is_set():
+        delay = next_tick + random.uniform(0, jitter) - time.monotonic()
+        if delay > 0 and stop_event.wait(delay):
+            break
+
+        result = None
+        try:
+            result = run_cycle()
+        except ValueError as e:
+            logger.error(e)
+        except Exception as e:
+            logger.exception(f"Outage scripts failed: {e}")
+
+        log_metrics()
+
+        # The retention job runs between cycles, so it never holds up an ingestion
+        if retention_interval and time.monotonic() >= next_retention:
+            run_retention()
+            next_retention = time.monotonic() + retention_interval * 3600
+
+        tick_interval = next_interval(result, tick_interval)
+        next_tick += tick_interval
+        now = time.monotonic()
+        if now > next_tick:
+            next_tick = next_tick_after_overrun(next_tick, now, tick_interval)
+
+    if dukeleases.ingest_leases:
+        try:
+            dukeleases.leases.release()
+        except Exception as e:
+            logger.exception(f"Releasing the jurisdiction leases failed: {e}")
+
+    logger.info("Scheduler stopped.")
+
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    if metrics_port:
+        dukemetrics.start_server(metrics_port, metrics_host)
+        logger.info(f"Serving metrics on http://{metrics_host}:{metrics_port}/metrics")
+
+    if dukeapi.read_api_port:
+        dukeapi.start_server(dukeapi.read_api_port, dukeapi.read_api_host)
+        logger.info(f"Serving the live outage snapshot on http://{dukeapi.read_api_host}:{dukeapi.read_api_port}/outages")
+
+    run_forever()
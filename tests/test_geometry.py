@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import json
+import random
+import unittest
+from dukegeometry import (
+    decode_hull, encode_hull, format_delta, format_raw, hull_bounds, read_varint, unzigzag, write_varint, zigzag,
+)
+
+"""
+Encoding of convex_hull polygons into hull_geometry bytes and back, and
+the bounds kept next to them
+"""
+
+hull = [{"lat": 35.1234567, "lng": -80.7654321}, {"lat": 35.2, "lng": -80.7}, {"lat": 35.15, "lng": -80.6}]
+
+
+class VarintTests(unittest.TestCase):
+    def test_zigzag_round_trips_around_zero(self):
+        values = [0, -1, 1, -2, 2, -63, 64, -(2 ** 40), 2 ** 40]
+
+        self.assertEqual([zigzag(value) for value in values[:5]], [0, 1, 2, 3, 4])
+        self.assertEqual([unzigzag(zigzag(value)) for value in values], values)
+
+    def test_varint_round_trips_across_byte_boundaries(self):
+        for value in (0, 1, 0x7F, 0x80, 0x3FFF, 0x4000, 2 ** 35 + 5):
+            out = bytearray([9])
+            write_varint(out, value)
+            self.assertEqual(read_varint(bytes(out), 1), (value, len(out)))
+
+        out = bytearray()
+        write_varint(out, 0x80)
+        self.assertEqual(bytes(out), b"\x80\x01")
+
+
+class HullEncodingTests(unittest.TestCase):
+    def test_round_trips_in_the_delta_format(self):
+        encoded = encode_hull(hull)
+
+        self.assertEqual(encoded[0], format_delta)
+        self.assertLess(len(encoded), len(json.dumps(hull)))
+        self.assertEqual(decode_hull(encoded), hull)
+
+    def test_round_trips_random_hulls(self):
+        generator = random.Random(20)
+        for _ in range(200):
+            points = [
+                {"lat": round(generator.uniform(-89, 89), generator.randint(1, 7)),
+                 "lng": round(generator.uniform(-179, 179), generator.randint(1, 7))}
+                for _ in range(generator.randint(0, 12))
+            ]
+            self.assertEqual(decode_hull(encode_hull(points)), points)
+
+    def test_keeps_what_the_delta_format_cannot_hold_as_raw_json(self):
+        for odd in (
+            [{"lat": 35, "lng": -80}],
+            [{"lat": 35.123456789, "lng": -80.7}],
+            [{"lng": -80.7, "lat": 35.1}],
+            [{"lat": 35.1, "lng": -80.7, "z": 1}],
+            [{"lat": "35.1", "lng": -80.7}],
+            {"type": "Polygon"},
+        ):
+            encoded = encode_hull(odd)
+            self.assertEqual(encoded[0], format_raw)
+            self.assertEqual(decode_hull(encoded), odd)
+
+    def test_keeps_missing_hulls_missing(self):
+        self.assertIsNone(encode_hull(None))
+        self.assertIsNone(decode_hull(None))
+        self.assertEqual(decode_hull(encode_hull([])), [])
+
+    def test_rejects_unknown_formats(self):
+        with self.assertRaises(ValueError):
+            decode_hull(b"\x07")
+
+
+class HullBoundsTests(unittest.TestCase):
+    def test_bounds_and_centroid_of_a_square(self):
+        square = [{"lat": 35.0, "lng": -81.0}, {"lat": 35.0, "lng": -80.0},
+                  {"lat": 36.0, "lng": -80.0}, {"lat": 36.0, "lng": -81.0}]
+
+        bounds = hull_bounds(square, 10.0, 10.0)
+
+        self.assertEqual(bounds[:4], (35.0, -81.0, 36.0, -80.0))
+        self.assertAlmostEqual(bounds[4], 35.5)
+        self.assertAlmostEqual(bounds[5], -80.5)
+
+    def test_collinear_points_fall_back_to_their_mean(self):
+        line = [{"lat": 35.0, "lng": -81.0}, {"lat": 35.5, "lng": -80.5}, {"lat": 36.0, "lng": -80.0}]
+
+        self.assertEqual(hull_bounds(line, 0.0, 0.0)[4:], (35.5, -80.5))
+
+    def test_outages_without_a_usable_hull_are_bounded_by_their_location(self):
+        for unusable in (None, [], [{"lat": None, "lng": -80.0}], {"type": "Polygon"}):
+            self.assertEqual(hull_bounds(unusable, 35.1, -80.7), (35.1, -80.7) * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
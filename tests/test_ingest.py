@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+import dukemigrations
+import dukeoutages
+import dukestorage
+
+"""
+Ingestion of Duke records that are incomplete, on a SQLite file of its own.
+Geocoding is answered locally, so no request leaves the test.
+"""
+
+good = {
+    "sourceEventNumber": "G1",
+    "deviceLatitudeLocation": 35.1,
+    "deviceLongitudeLocation": -80.7,
+    "convexHull": None,
+    "customersAffectedNumber": 4,
+    "outageCause": "x",
+}
+
+
+def without(key):
+    nugget = dict(good, sourceEventNumber=f"missing-{key}")
+    del nugget[key]
+    return nugget
+
+
+def geocoded(entries):
+    return [(entry, {"block_fips": "370630001001000", "state": "North Carolina", "county": "Wake County"})
+            for entry in entries]
+
+
+class IncompleteRecordTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.storage = dukestorage.SqliteStorage(os.path.join(self.directory.name, "dukeoutages.db"))
+        dukestorage.storage = self.storage
+        with contextlib.redirect_stdout(io.StringIO()):
+            dukemigrations.migrate()
+
+        self.reject_file = os.path.join(self.directory.name, "rejected.jsonl")
+        for patch in (
+            mock.patch.object(dukeoutages, "reject_file", self.reject_file),
+            mock.patch.object(dukeoutages, "geocode_entries", geocoded),
+            mock.patch.object(dukeoutages, "spatial_index", False),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        dukestorage.storage = None
+
+    def test_parses_records_with_missing_fields(self):
+        entry = dukeoutages.parse_nugget(without("deviceLongitudeLocation"), "DEC")
+
+        self.assertIsNone(entry["device_lon"])
+        self.assertEqual(entry["source_event_number"], "missing-deviceLongitudeLocation")
+
+    def test_rejects_incomplete_records_and_keeps_the_rest(self):
+        nuggets = [good, without("deviceLongitudeLocation"), without("sourceEventNumber"), without("outageCause")]
+        entries = [dukeoutages.parse_nugget(nugget, "DEC") for nugget in nuggets]
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.storage.transaction() as conn:
+                result = dukeoutages.run_pipeline(iter(entries), conn, {})
+
+        self.assertEqual(result["active"], 3)
+        with self.storage.transaction() as conn:
+            tracked = conn.execute("SELECT outage_identifer FROM outage_tracker ORDER BY 1").fetchall()
+        self.assertEqual(tracked, [("G1",), ("missing-outageCause",)])
+
+        with open(self.reject_file) as f:
+            rejects = [json.loads(line) for line in f]
+        self.assertEqual(
+            sorted((reject["table"], str(reject["entry"]["source_event_number"])) for reject in rejects),
+            [
+                ("duke_outages", "None"),
+                ("duke_outages", "missing-deviceLongitudeLocation"),
+                ("outage_tracker", "None"),
+                ("outage_tracker", "missing-deviceLongitudeLocation"),
+            ],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
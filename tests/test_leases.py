@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import dukemigrations
+import dukestorage
+from dukeapi import LiveSnapshot
+from dukeleases import JurisdictionLeases
+from dukesnapshots import close_snapshots, record_snapshots
+from dukespatial import OutageIndex
+
+"""
+Workers sharing the jurisdictions through leases, on a SQLite file of their
+own: what a worker keeps in memory of the outages the others ingest.
+"""
+
+
+def entry(identifer, jurisdiction, affected, lat=35.1):
+    return {
+        "source_event_number": identifer,
+        "jurisdiction": jurisdiction,
+        "device_lat": lat,
+        "device_lon": -80.7,
+        "affected": affected,
+        "cause": "x",
+        "convex_hull": None,
+    }
+
+
+class ShareTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        dukestorage.storage = dukestorage.SqliteStorage(os.path.join(self.directory.name, "dukeoutages.db"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            dukemigrations.migrate()
+
+    def tearDown(self):
+        dukestorage.storage = None
+
+    def assign(self, workers, jurisdictions):
+        return {worker.worker: worker.assign(jurisdictions) for worker in workers}
+
+    def test_splits_uneven_counts_across_every_worker(self):
+        jurisdictions = ["DEC", "DEF", "DEI", "DEM"]
+        workers = [JurisdictionLeases(name, 60) for name in ("A", "B", "C")]
+
+        # A starts alone with everything, B and C join while it holds it all
+        self.assign(workers, jurisdictions)
+        for _ in range(2):
+            owned = self.assign(workers, jurisdictions)
+
+        self.assertEqual(owned, {"A": ["DEC", "DEF"], "B": ["DEI"], "C": ["DEM"]})
+
+    def test_hands_the_leftovers_out_in_worker_order(self):
+        jurisdictions = ["DEC", "DEF", "DEI", "DEM", "DEK"]
+        workers = [JurisdictionLeases(name, 60) for name in ("C", "A", "B")]
+
+        for _ in range(3):
+            owned = self.assign(workers, jurisdictions)
+
+        self.assertEqual({worker: len(owned[worker]) for worker in owned}, {"A": 2, "B": 2, "C": 1})
+        self.assertEqual(sorted(sum(owned.values(), [])), sorted(jurisdictions))
+
+
+class FollowTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.storage = dukestorage.SqliteStorage(os.path.join(self.directory.name, "dukeoutages.db"))
+        dukestorage.storage = self.storage
+        with contextlib.redirect_stdout(io.StringIO()):
+            dukemigrations.migrate()
+
+    def tearDown(self):
+        dukestorage.storage = None
+
+    def other_worker(self, entries, jurisdictions=("DEF",)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.storage.transaction() as conn:
+                captured_at = self.storage.capture_time(conn)
+                record_snapshots(entries, captured_at, conn)
+                close_snapshots([item["source_event_number"] for item in entries], captured_at, conn, jurisdictions)
+                for item in entries:
+                    conn.execute("""
+                        INSERT OR IGNORE INTO outage_tracker
+                        (outage_identifer, device_lat, device_lon, jurisdiction, affected, cause,
+                         outage_start_estimate, outage_restored, updated_at)
+                        VALUES (:identifer, :lat, -80.7, :jurisdiction, :affected, 'x', :now, 0, :now)
+                    """, {"identifer": item["source_event_number"], "lat": item["device_lat"],
+                          "jurisdiction": item["jurisdiction"], "affected": item["affected"], "now": captured_at})
+
+    def cycle(self, index, entries, owned=("DEC",)):
+        index.begin()
+        index.stage(entries)
+        index.stage_current([item["source_event_number"] for item in entries], owned)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            index.commit()
+        self.assertEqual(output.getvalue(), "")
+
+    def test_index_follows_the_outages_of_other_workers(self):
+        index = OutageIndex()
+        index.load([])
+        self.other_worker([entry("B1", "DEF", 3)])
+
+        self.cycle(index, [entry("A1", "DEC", 1)])
+        self.assertEqual(sorted(index.outages), ["A1", "B1"])
+
+        self.other_worker([entry("B1", "DEF", 9, lat=35.4)])
+        self.cycle(index, [entry("A1", "DEC", 1)])
+        self.assertEqual((index.outages["B1"]["affected"], index.outages["B1"]["device_lat"]), (9, 35.4))
+        self.assertEqual([record["outage_identifer"] for record in index.query_radius(35.4, -80.7, 1)], ["B1"])
+
+        self.other_worker([])
+        self.cycle(index, [entry("A1", "DEC", 1)])
+        self.assertEqual(sorted(index.outages), ["A1"])
+
+    def test_index_takes_over_a_jurisdiction_from_its_snapshots(self):
+        index = OutageIndex()
+        index.load([])
+        self.other_worker([entry("B1", "DEF", 3)])
+        self.cycle(index, [entry("A1", "DEC", 1)])
+
+        # This worker now leases DEF too, where B1 is no longer reported
+        self.cycle(index, [entry("A1", "DEC", 1)], owned=("DEC", "DEF"))
+        self.assertEqual(sorted(index.outages), ["A1"])
+
+    def test_read_api_follows_live_fields_of_other_workers(self):
+        snapshot = LiveSnapshot()
+        snapshot.enabled = True
+        self.other_worker([entry("B1", "DEF", 3)])
+
+        for affected in (3, 9):
+            self.other_worker([entry("B1", "DEF", affected)])
+            snapshot.begin()
+            snapshot.stage([])
+            snapshot.stage_current([], ["DEC"])
+            with contextlib.redirect_stdout(io.StringIO()):
+                snapshot.commit()
+            self.assertEqual(
+                [(record["outage_identifer"], record["affected"]) for record in snapshot.published.records],
+                [("B1", affected)],
+            )
+
+        self.other_worker([])
+        snapshot.begin()
+        snapshot.stage_current([], ["DEC"])
+        snapshot.commit()
+        self.assertNotIn("B1", snapshot.live)
+
+
+if __name__ == '__main__':
+    unittest.main()
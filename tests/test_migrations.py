@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from decouple import config
+import dukedb
+import dukemigrations
+import dukestorage
+from dukegeometry import decode_hull
+
+"""
+Migrations of databases shaped like the ones earlier versions created:
+duplicate identifiers from the old save functions, block_fips as a number,
+durations only as 'fix_duration_estimate' text and hulls as convex_hull
+JSON. The SQLite tests always run; the PostgreSQL ones run against
+TEST_DB_SERVICE, whose pipeline tables are dropped, so it must point at a
+throwaway database.
+"""
+
+test_db_service = config("TEST_DB_SERVICE", default="")
+
+dropped_tables = [
+    "schema_migrations",
+    "duke_outages",
+    "outage_tracker",
+    "duke_outages_archive",
+    "outage_tracker_archive",
+    "outage_snapshots",
+    "outage_snapshot_heads",
+    "outage_rollups",
+    "rollup_members",
+    "ingestion_leases",
+]
+
+hull = [{"lat": 35.1234567, "lng": -80.7654321}, {"lat": 35.2, "lng": -80.7}, {"lat": 35.15, "lng": -80.6}]
+
+
+class MigrationTests:
+    json_type = None
+    legacy_columns = ""
+    drop_suffix = ""
+
+    def setUp(self):
+        self.storage = self.create_storage()
+        dukestorage.storage = self.storage
+        self.drop_tables()
+        self.create_legacy_tables()
+
+    def tearDown(self):
+        dukestorage.storage = None
+
+    def query(self, sql, params=None):
+        with self.storage.transaction() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params or {})
+            return cur.fetchall()
+
+    def drop_tables(self):
+        with self.storage.transaction() as conn:
+            cur = conn.cursor()
+            for table in dropped_tables:
+                cur.execute(f"DROP TABLE IF EXISTS {table}{self.drop_suffix}")
+
+    def create_legacy_tables(self):
+        p = self.storage.param
+        with self.storage.transaction() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                CREATE TABLE duke_outages (
+                    outage_identifer TEXT, device_lat DECIMAL, device_lon DECIMAL,
+                    convex_hull {self.json_type}, jurisdiction TEXT, affected INTEGER, cause TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute(f"""
+                CREATE TABLE outage_tracker (
+                    outage_identifer TEXT, device_lat DECIMAL, device_lon DECIMAL, block_fips DECIMAL,
+                    convex_hull {self.json_type}, jurisdiction TEXT, origin TEXT, state TEXT, county TEXT,
+                    affected INTEGER, cause TEXT,
+                    outage_start_estimate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    outage_end_estimate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    fix_duration_estimate TEXT, outage_restored BOOLEAN{self.legacy_columns}
+                )
+            """)
+
+            # The same outage saved on three cycles, the first one kept
+            for day, affected in ((1, 10), (2, 11), (3, 12)):
+                cur.execute(f"""
+                    INSERT INTO duke_outages
+                    (outage_identifer, device_lat, device_lon, convex_hull, jurisdiction, affected, cause, created_at)
+                    VALUES ('L1', 35.1, -80.7, {p('hull')}, 'DEC', {p('affected')}, 'x', {p('created_at')})
+                """, {"hull": json.dumps(hull), "affected": affected, "created_at": f"2024-01-0{day} 00:00:00"})
+
+            tracker = f"""
+                INSERT INTO outage_tracker
+                (outage_identifer, device_lat, device_lon, block_fips, convex_hull, jurisdiction, origin, state,
+                 county, affected, cause, outage_start_estimate, outage_end_estimate, fix_duration_estimate,
+                 outage_restored)
+                VALUES ({p('identifer')}, 35.1, -80.7, {p('block_fips')}, {p('hull')}, 'DEC', 'o', 'Alabama',
+                    'Autauga County', 10, 'x', {p('start')}, {p('end')}, {p('estimate')}, {p('restored')})
+            """
+            cur.execute(tracker, {
+                "identifer": "L1", "block_fips": 10010201001000, "hull": json.dumps(hull),
+                "start": "2024-01-01 00:00:00", "end": "2024-01-02 01:02:03", "estimate": "1d 1h 2m 3s",
+                "restored": True,
+            })
+            cur.execute(tracker, {
+                "identifer": "L1", "block_fips": 1, "hull": None,
+                "start": "2024-01-03 00:00:00", "end": "2024-01-03 00:00:00", "estimate": None,
+                "restored": False,
+            })
+            cur.execute(tracker, {
+                "identifer": "L2", "block_fips": 370630001001000, "hull": None,
+                "start": "2024-01-04 00:00:00", "end": "2024-01-04 00:00:00", "estimate": None,
+                "restored": False,
+            })
+
+    def migrate(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return dukemigrations.migrate()
+
+    def test_applies_every_migration_once(self):
+        self.assertEqual(self.migrate(), [name for version, name, apply in dukemigrations.migrations])
+        self.assertEqual(
+            [row[0] for row in self.query("SELECT version FROM schema_migrations ORDER BY version")],
+            [version for version, name, apply in dukemigrations.migrations],
+        )
+        self.assertEqual(self.migrate(), [])
+
+    def test_keeps_the_first_row_of_each_identifier(self):
+        self.migrate()
+
+        self.assertEqual(self.query("SELECT affected FROM duke_outages"), [(10,)])
+        self.assertEqual(
+            self.query("SELECT outage_identifer, outage_restored FROM outage_tracker ORDER BY outage_identifer"),
+            [("L1", True), ("L2", False)],
+        )
+        with self.assertRaises(Exception):
+            with self.storage.transaction() as conn:
+                conn.cursor().execute("INSERT INTO duke_outages (outage_identifer) VALUES ('L1')")
+
+    def test_block_fips_becomes_15_digit_text(self):
+        self.migrate()
+
+        self.assertEqual(
+            self.query("SELECT block_fips FROM outage_tracker ORDER BY outage_identifer"),
+            [("010010201001000",), ("370630001001000",)],
+        )
+
+    def test_durations_move_to_seconds(self):
+        self.migrate()
+
+        self.assertEqual(
+            self.query("SELECT fix_duration_seconds FROM outage_tracker ORDER BY outage_identifer"),
+            [(90123,), (None,)],
+        )
+        self.assertNotIn("fix_duration_estimate", self.storage.table_columns("outage_tracker"))
+
+    def test_hulls_move_to_hull_geometry(self):
+        self.migrate()
+
+        for table in ("duke_outages", "outage_tracker"):
+            self.assertNotIn("convex_hull", self.storage.table_columns(table))
+        self.assertEqual(decode_hull(self.query("SELECT hull_geometry FROM duke_outages")[0][0]), hull)
+        self.assertEqual(
+            decode_hull(self.query("SELECT hull_geometry FROM outage_tracker WHERE outage_identifer = 'L1'")[0][0]),
+            hull,
+        )
+
+    def test_hulls_without_identifier_or_location_move_too(self):
+        p = self.storage.param
+        with self.storage.transaction() as conn:
+            cur = conn.cursor()
+            for identifer, lat, lon in ((None, 35.1, -80.7), (None, 35.3, -80.6), ("L3", None, None)):
+                cur.execute(f"""
+                    INSERT INTO duke_outages (outage_identifer, device_lat, device_lon, convex_hull, jurisdiction)
+                    VALUES ({p('identifer')}, {p('lat')}, {p('lon')}, {p('hull')}, 'DEC')
+                """, {"identifer": identifer, "lat": lat, "lon": lon, "hull": json.dumps(hull)})
+        self.migrate()
+
+        rows = self.query("""
+            SELECT outage_identifer, device_lat, hull_geometry, min_lat, max_lon
+            FROM duke_outages
+            WHERE outage_identifer IS NULL OR outage_identifer = 'L3'
+        """)
+        self.assertEqual(
+            sorted((str(identifer), lat is None) for identifer, lat, geometry, min_lat, max_lon in rows),
+            [("L3", True), ("None", False), ("None", False)],
+        )
+        for identifer, lat, geometry, min_lat, max_lon in rows:
+            self.assertEqual(decode_hull(geometry), hull)
+            self.assertEqual((min_lat, max_lon), (35.1234567, -80.6))
+
+
+class SqliteMigrationTests(MigrationTests, unittest.TestCase):
+    json_type = "JSON"
+    # SQLite databases always had these two columns
+    legacy_columns = ", fix_duration_seconds INTEGER, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+
+    def create_storage(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        return dukestorage.SqliteStorage(os.path.join(self.directory.name, "dukeoutages.db"))
+
+
+@unittest.skipUnless(test_db_service, "TEST_DB_SERVICE is not set")
+class PostgresMigrationTests(MigrationTests, unittest.TestCase):
+    json_type = "JSONB"
+    drop_suffix = " CASCADE"
+
+    def create_storage(self):
+        os.environ["REMOTE_DB_SERVICE"] = test_db_service
+        dukedb.db_pool = None
+        return dukestorage.PostgresStorage()
+
+
+if __name__ == '__main__':
+    unittest.main()
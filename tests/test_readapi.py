@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import dukemigrations
+import dukestorage
+from dukeapi import LiveSnapshot
+
+"""
+Refreshes of the read API snapshot, on a SQLite file of its own
+"""
+
+
+class LiveSnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.storage = dukestorage.SqliteStorage(os.path.join(self.directory.name, "dukeoutages.db"))
+        dukestorage.storage = self.storage
+        with contextlib.redirect_stdout(io.StringIO()):
+            dukemigrations.migrate()
+
+        self.snapshot = LiveSnapshot()
+        self.snapshot.enabled = True
+
+    def tearDown(self):
+        dukestorage.storage = None
+
+    def add_outage(self, identifer, affected):
+        with self.storage.transaction() as conn:
+            conn.execute("""
+                INSERT INTO outage_tracker
+                (outage_identifer, device_lat, device_lon, jurisdiction, state, county, affected, cause,
+                 outage_start_estimate, outage_restored, updated_at)
+                VALUES (:identifer, 35.1, -80.7, 'DEC', 'North Carolina', 'Wake County', :affected, 'x',
+                    :now, 0, :now)
+            """, {"identifer": identifer, "affected": affected, "now": self.storage.capture_time()})
+
+    def cycle(self, entries=()):
+        self.snapshot.begin()
+        self.snapshot.stage(entries)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.snapshot.commit()
+        return output.getvalue()
+
+    def test_refreshes_after_loading_an_empty_tracker(self):
+        self.assertEqual(self.cycle(), "")
+        self.assertEqual(self.snapshot.published.records, [])
+
+        self.add_outage("A1", 5)
+        entry = {
+            "source_event_number": "A1",
+            "jurisdiction": "DEC",
+            "device_lat": 35.1,
+            "device_lon": -80.7,
+            "affected": 7,
+            "cause": "x",
+            "convex_hull": None,
+        }
+        self.assertEqual(self.cycle([entry]), "")
+
+        self.assertFalse(self.snapshot.stale)
+        self.assertIsNotNone(self.snapshot.watermark)
+        self.assertEqual(
+            [(record["outage_identifer"], record["affected"]) for record in self.snapshot.published.records],
+            [("A1", 7)],
+        )
+
+    def test_picks_up_later_changes_once_the_watermark_is_set(self):
+        self.add_outage("A1", 5)
+        self.cycle()
+        self.add_outage("A2", 3)
+        self.cycle()
+
+        self.assertEqual(
+            sorted(record["outage_identifer"] for record in self.snapshot.published.records), ["A1", "A2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
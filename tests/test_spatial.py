@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import random
+import unittest
+from dukespatial import OutageIndex, entry_record, haversine_km
+
+"""
+Queries of the in-memory grid index, checked against a scan of every
+outage. Duke's territories are far from the antimeridian and the poles, so
+the points stay in the western hemisphere, on both sides of cell edges.
+"""
+
+cell_size = 0.05
+
+
+def entry(identifer, lat, lon, hull=None):
+    return {
+        "source_event_number": identifer,
+        "device_lat": lat,
+        "device_lon": lon,
+        "jurisdiction": "DEC",
+        "affected": 1,
+        "cause": "x",
+        "convex_hull": hull,
+    }
+
+
+def identifers(records):
+    return sorted(record["outage_identifer"] for record in records)
+
+
+class GridQueryTests(unittest.TestCase):
+    def setUp(self):
+        generator = random.Random(21)
+        self.records = [
+            entry_record(entry(f"R{number}", generator.uniform(34.5, 36.5), generator.uniform(-82.5, -79.5)))
+            for number in range(500)
+        ]
+        # Points on cell edges, where floating point division can pick either cell
+        self.records += [
+            entry_record(entry(f"E{number}", round(35 + number * cell_size, 2), round(-81 + number * cell_size, 2)))
+            for number in range(10)
+        ]
+        self.index = OutageIndex(cell_size)
+        self.index.load(self.records)
+
+    def scan_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        return sorted(
+            record["outage_identifer"] for record in self.records
+            if record["min_lat"] <= max_lat and record["max_lat"] >= min_lat
+            and record["min_lon"] <= max_lon and record["max_lon"] >= min_lon
+        )
+
+    def scan_radius(self, lat, lon, radius_km):
+        return sorted(
+            record["outage_identifer"] for record in self.records
+            if haversine_km(lat, lon, record["device_lat"], record["device_lon"]) <= radius_km
+        )
+
+    def test_bbox_matches_a_scan(self):
+        generator = random.Random(1)
+        for _ in range(100):
+            lat, lon = generator.uniform(34.5, 36.5), generator.uniform(-82.5, -79.5)
+            size = generator.choice([0.001, 0.05, 0.3, 5])
+            box = (lat, lon, lat + size, lon + size)
+            self.assertEqual(identifers(self.index.query_bbox(*box)), self.scan_bbox(*box))
+
+    def test_bbox_edges_on_cell_boundaries_are_inclusive(self):
+        for number in range(10):
+            lat, lon = round(35 + number * cell_size, 2), round(-81 + number * cell_size, 2)
+            self.assertIn(f"E{number}", identifers(self.index.query_bbox(lat, lon, lat, lon)))
+            self.assertIn(f"E{number}", identifers(self.index.query_bbox(lat - 1, lon - 1, lat, lon)))
+            self.assertIn(f"E{number}", identifers(self.index.query_bbox(lat, lon, lat + 1, lon + 1)))
+
+    def test_radius_matches_a_scan_nearest_first(self):
+        generator = random.Random(2)
+        for _ in range(100):
+            lat, lon = generator.uniform(34.5, 36.5), generator.uniform(-82.5, -79.5)
+            radius = generator.choice([0.5, 3, 6, 40, 400])
+
+            found = self.index.query_radius(lat, lon, radius)
+
+            self.assertEqual(identifers(found), self.scan_radius(lat, lon, radius))
+            distances = [record["distance_km"] for record in found]
+            self.assertEqual(distances, sorted(distances))
+
+    def test_radius_reaches_across_cell_edges(self):
+        # Just west of a cell edge, a point 1 m east of it is in the next cell
+        self.index.load([entry_record(entry("East", 35.0, -80.99999))])
+
+        self.assertEqual(identifers(self.index.query_radius(35.0, -81.00001, 0.01)), ["East"])
+        self.assertEqual(self.index.query_radius(35.0, -81.00001, 0.001), [])
+
+    def test_nearest_matches_a_scan(self):
+        generator = random.Random(3)
+        for _ in range(100):
+            lat, lon = generator.uniform(34, 37), generator.uniform(-83, -79)
+            k = generator.choice([1, 5, 20])
+
+            found = self.index.query_nearest(lat, lon, k)
+
+            expected = sorted(
+                haversine_km(lat, lon, record["device_lat"], record["device_lon"]) for record in self.records)[:k]
+            self.assertEqual([record["distance_km"] for record in found], expected)
+
+    def test_nearest_far_from_every_outage_and_within_a_limit(self):
+        self.assertEqual(len(self.index.query_nearest(45.0, -70.0, 3)), 3)
+        self.assertEqual(self.index.query_nearest(45.0, -70.0, 3, max_km=100), [])
+        self.assertEqual(OutageIndex(cell_size).query_nearest(35.0, -80.0, 3), [])
+
+    def test_hulls_are_found_in_every_cell_they_overlap(self):
+        hull = [{"lat": 35.01, "lng": -80.99}, {"lat": 35.01, "lng": -80.71}, {"lat": 35.29, "lng": -80.85}]
+        self.index.load([entry_record(entry("H1", 35.02, -80.98, hull))])
+
+        self.assertEqual(identifers(self.index.query_bbox(35.2, -80.86, 35.21, -80.84)), ["H1"])
+        self.assertEqual(self.index.query_bbox(35.3, -80.86, 35.4, -80.84), [])
+        # Radius queries use the device location, in another cell
+        self.assertEqual(self.index.query_radius(35.2, -80.85, 1), [])
+
+    def test_moved_outages_leave_their_old_cells(self):
+        self.index.load([entry_record(entry("M1", 35.01, -80.99))])
+        self.index.begin()
+        self.index.stage([entry("M1", 35.51, -80.49)])
+        self.index.stage_current(["M1"])
+        self.index.commit()
+
+        self.assertEqual(self.index.query_bbox(35.0, -81.0, 35.02, -80.98), [])
+        self.assertEqual(identifers(self.index.query_radius(35.51, -80.49, 0.1)), ["M1"])
+        self.assertEqual(sorted(self.index.point_cells), [self.index.cell(-80.49, 35.51)])
+
+
+if __name__ == '__main__':
+    unittest.main()